@@ -0,0 +1,78 @@
+import heapq
+import itertools
+import logging
+import threading
+import time
+
+logger = logging.getLogger('djangoldp')
+
+
+class DelayScheduler:
+    '''
+    Holds items until their due time, in a heap watched by a single thread which passes each item to dispatch once it
+    is due, so that the delays and retry backoffs of the activities don't occupy the workers sending them.
+    Items due at the same time are dispatched in the order they were scheduled
+    '''
+    def __init__(self, dispatch, name='activity-scheduler'):
+        self.dispatch = dispatch
+        self.name = name
+        # (due timestamp, sequence number, item)
+        self.heap = []
+        self.counter = itertools.count()
+        self.condition = threading.Condition()
+        self.dispatching = 0
+        self.running = False
+        self.thread = None
+
+    def __len__(self):
+        return len(self.heap) + self.dispatching
+
+    def schedule(self, item, due):
+        '''holds the item until the due timestamp (as given by time.time())'''
+        with self.condition:
+            heapq.heappush(self.heap, (due, next(self.counter), item))
+            self.condition.notify_all()
+
+    def start(self):
+        with self.condition:
+            if self.running:
+                return
+            self.running = True
+        self.thread = threading.Thread(target=self.run, daemon=True, name=self.name)
+        self.thread.start()
+
+    def stop(self, timeout=None):
+        '''stops dispatching, the items not due yet being kept in the heap'''
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+        if self.thread is not None:
+            self.thread.join(timeout)
+            self.thread = None
+
+    def clear(self):
+        with self.condition:
+            self.heap.clear()
+
+    def join(self, timeout=None):
+        '''blocks until all the scheduled items are dispatched'''
+        with self.condition:
+            return self.condition.wait_for(lambda: not self.heap and not self.dispatching, timeout)
+
+    def run(self):
+        while True:
+            with self.condition:
+                while self.running and (not self.heap or self.heap[0][0] > time.time()):
+                    self.condition.wait(self.heap[0][0] - time.time() if self.heap else None)
+                if not self.running:
+                    return
+                item = heapq.heappop(self.heap)[2]
+                self.dispatching += 1
+            try:
+                self.dispatch(item)
+            except Exception as e:
+                logger.error('Failed to dispatch a scheduled item: ' + str(e.__class__) + ': ' + str(e))
+            finally:
+                with self.condition:
+                    self.dispatching -= 1
+                    self.condition.notify_all()
@@ -2,7 +2,8 @@ import threading
 import json
 import time
 import copy
-import requests
+import zlib
+from datetime import timedelta
 from queue import Queue
 from requests.exceptions import Timeout, ConnectionError
 from urllib.parse import urlparse
@@ -11,8 +12,11 @@ from django.db.models.signals import post_save, post_delete, m2m_changed
 from django.db.models import Q
 from django.dispatch import receiver, Signal
 from django.conf import settings
+from django.utils import timezone
 from rest_framework.utils import model_meta
 
+from djangoldp.activities.scheduler import DelayScheduler
+from djangoldp.http_client import get_session
 from djangoldp.models import Model, Follower, ScheduledActivity
 from djangoldp.models import Activity as ActivityModel
 
@@ -34,9 +38,15 @@ DEFAULT_BACKOFF_FACTOR = getattr(settings, 'DEFAULT_BACKOFF_FACTOR', 1)
 DEFAULT_ACTIVITY_DELAY = getattr(settings, 'DEFAULT_ACTIVITY_DELAY', 0.1)
 DEFAULT_REQUEST_TIMEOUT = getattr(settings, 'DEFAULT_REQUEST_TIMEOUT', 10)
 MAX_RECORDS_ACTIVITY_CACHE = getattr(settings, 'MAX_RECORDS_ACTIVITY_CACHE', 10000)
+ACTIVITY_QUEUE_WORKERS = getattr(settings, 'ACTIVITY_QUEUE_WORKERS', 4)
+ACTIVITY_BATCH_WINDOW = getattr(settings, 'ACTIVITY_BATCH_WINDOW', 0)
+ACTIVITY_BATCH_SIZE = getattr(settings, 'ACTIVITY_BATCH_SIZE', 100)
+ACTIVITY_UNBATCHED_HOST_TTL = getattr(settings, 'ACTIVITY_UNBATCHED_HOST_TTL', 3600)
 
 
 activity_sending_finished = Signal()
+# the item queued at the end of the batch window of an inbox, to send its batch
+FLUSH_BATCH = object()
 
 
 class ActivityInMemoryCache:
@@ -118,49 +128,212 @@ ACTIVITY_SAVING_SETTING = getattr(settings, 'STORE_ACTIVITIES', 'ERROR')
 
 
 class ActivityQueueService:
-    '''Manages an asynchronous queue for Activity format messages'''
+    '''
+    Manages asynchronous queues for Activity format messages, sharded by the host of their inbox: each queue has its own
+    worker, so that the activities to an inbox are sent in order, while activities to other hosts are sent in parallel.
+    Activities with a delay (or a backoff after a failure) are held by a scheduler until they are due, before being
+    queued. With a batch window, the activities queued for an inbox within the window are sent together in an
+    OrderedCollection: the first one opens a batch, sent once the scheduler queues its flush at the end of the window,
+    the worker serving the other inboxes meanwhile
+    '''
     initialized = False
-    queue = None
+    # one queue, worker thread and number of activities being sent for each shard
+    queues = None
+    workers = None
+    in_flight = None
+    # the batches opened by the worker of each shard, as {inbox: (flush due timestamp, [activities])}
+    batches = None
+    scheduler = None
+    lock = threading.Lock()
+    batch_window = ACTIVITY_BATCH_WINDOW
+    batch_size = ACTIVITY_BATCH_SIZE
+    # the hosts whose inboxes refused a batch, to which activities are sent one by one until the timestamp they map to
+    unbatched_hosts = {}
+    unbatched_host_ttl = ACTIVITY_UNBATCHED_HOST_TTL
 
     @classmethod
-    def revive_activities(cls):
-        '''re-schedules all ScheduledActivities to the queue'''
-        with cls.queue.mutex:
-            cls.queue.queue.clear()
+    def get_shard(cls, url):
+        '''returns the index of the queue of an inbox, from its host'''
+        return zlib.crc32(urlparse(str(url)).netloc.encode()) % len(cls.queues)
 
-        scheduled = ScheduledActivity.objects.all()
+    @classmethod
+    def _enqueue(cls, item):
+        '''queues an item due to be sent, in the queue of its inbox'''
+        cls.queues[cls.get_shard(item[0])].put(item)
+
+    @classmethod
+    def revive_activities(cls):
+        '''re-schedules all ScheduledActivities to the queue, when they were due'''
+        for queue in cls.queues:
+            with queue.mutex:
+                queue.queue.clear()
+        for batches in cls.batches:
+            batches.clear()
+        cls.scheduler.clear()
+
+        now = timezone.now()
+        scheduled = ScheduledActivity.objects.order_by('created_at')
         for activity in scheduled:
             if activity.external_id is not None:
-                cls.resend_activity(str(activity.external_id), activity, failed=False)
+                delay = (activity.due_at - now).total_seconds() if activity.due_at is not None else 0
+                cls.resend_activity(str(activity.external_id), activity, failed=False, delay=max(delay, 0))
             else:
                 activity.delete()
 
     @classmethod
-    def start(cls):
+    def start(cls, workers=ACTIVITY_QUEUE_WORKERS):
         '''
         method checks if there are scheduled activities on the queue and starts them up
         Important: this method should only be called in start-up, when you know there are not queue tasks running
         otherwise duplicate activities may be sent
+        :param workers: the number of queues, each sending its activities in a worker thread
         '''
-        def queue_worker(queue):
+        def queue_worker(shard):
+            queue = cls.queues[shard]
+            batches = cls.batches[shard]
             while True:
-                # wait for queue item to manifest
+                # wait for queue item to manifest, None stopping the worker once the open batches are sent
                 item = queue.get()
-                time.sleep(item[2])
-                cls._activity_queue_worker(item[0], item[1])
-                cls.queue.task_done()
+                if item is None:
+                    for url in list(batches):
+                        cls._process(shard, url, batches.pop(url)[1])
+                    queue.task_done()
+                    return
+                try:
+                    for url, activities in cls._collect_batch(item, batches):
+                        cls._process(shard, url, activities)
+                except Exception as e:
+                    logger.error('Failed to process the activity queued for ' + str(item[0]) + ': ' +
+                                 str(e.__class__) + ': ' + str(e))
+                finally:
+                    queue.task_done()
 
         if not cls.initialized:
             cls.initialized = True
 
-            # initialise the queue worker - infinite maxsize
-            cls.queue = Queue(maxsize=0)
-            t = threading.Thread(target=queue_worker, args=[cls.queue])
-            t.setDaemon(True)
-            t.start()
+            # initialise the queue workers - infinite maxsize
+            workers = max(int(workers), 1)
+            cls.queues = [Queue(maxsize=0) for _ in range(workers)]
+            cls.in_flight = [0] * workers
+            cls.batches = [{} for _ in range(workers)]
+            cls.workers = [threading.Thread(target=queue_worker, args=[shard], daemon=True,
+                                            name='activity-queue-{}'.format(shard)) for shard in range(workers)]
+            for t in cls.workers:
+                t.start()
+            cls.scheduler = DelayScheduler(cls._enqueue)
+            cls.scheduler.start()
 
             cls.revive_activities()
 
+    @classmethod
+    def stop(cls, timeout=None):
+        '''
+        stops the workers once they have processed the activities already queued. The activities not due yet are
+        revived on the next start
+        '''
+        if not cls.initialized:
+            return
+        cls.scheduler.stop(timeout)
+        for queue in cls.queues:
+            queue.put(None)
+        for t in cls.workers:
+            t.join(timeout)
+        cls.initialized = False
+
+    @classmethod
+    def join(cls):
+        '''blocks until all the scheduled and queued activities are processed'''
+        if not cls.initialized:
+            return
+        while True:
+            cls.scheduler.join()
+            for queue in cls.queues:
+                queue.join()
+            # the activities rescheduled after a failure are waited for as well
+            if not len(cls.scheduler):
+                return
+
+    @classmethod
+    def stats(cls):
+        '''
+        returns the number of activities waiting for their due time, waiting in the queues and being sent, in total
+        and per queue
+        '''
+        if not cls.initialized:
+            return {'workers': 0, 'scheduled': 0, 'queued': 0, 'in_flight': 0, 'shards': []}
+        with cls.lock:
+            in_flight = list(cls.in_flight)
+        shards = [{'queued': queue.qsize() + sum(len(batch) for _, batch in list(batches.values())),
+                   'in_flight': sending} for queue, batches, sending in zip(cls.queues, cls.batches, in_flight)]
+        return {'workers': len(shards), 'scheduled': len(cls.scheduler), 'queued': sum(shard['queued'] for shard in shards),
+                'in_flight': sum(in_flight), 'shards': shards}
+
+    @classmethod
+    def _process(cls, shard, url, scheduled_activities):
+        '''sends the activities taken from the queue of a shard to an inbox, in a batch if there are several'''
+        with cls.lock:
+            cls.in_flight[shard] += len(scheduled_activities)
+        try:
+            if len(scheduled_activities) > 1:
+                cls._send_batch(url, scheduled_activities)
+            else:
+                cls._activity_queue_worker(url, scheduled_activities[0])
+        except Exception as e:
+            logger.error('Failed to process the activity queued for ' + str(url) + ': ' +
+                         str(e.__class__) + ': ' + str(e))
+        finally:
+            with cls.lock:
+                cls.in_flight[shard] -= len(scheduled_activities)
+
+    @classmethod
+    def _is_batchable(cls, scheduled_activity):
+        '''activities which are sent again after a failure are sent alone, with their own backoff'''
+        return getattr(scheduled_activity, 'failed_attempts', 0) == 0
+
+    @classmethod
+    def _is_unbatched(cls, url):
+        '''returns True if the host of the inbox refused a batch, less than unbatched_host_ttl seconds ago'''
+        host = urlparse(str(url)).netloc
+        expires = cls.unbatched_hosts.get(host)
+        if expires is not None and expires <= time.monotonic():
+            cls.unbatched_hosts.pop(host, None)
+            return False
+        return expires is not None
+
+    @classmethod
+    def _set_unbatched(cls, url):
+        cls.unbatched_hosts[urlparse(str(url)).netloc] = time.monotonic() + cls.unbatched_host_ttl
+
+    @classmethod
+    def _collect_batch(cls, item, batches):
+        '''
+        adds a queued item to the batch of its inbox, opening it and scheduling its flush at the end of the batch window
+        if there is none, and returns the (inbox, activities) ready to be sent: the batch when it is flushed or full, or
+        the item alone if it can't be batched, after the batch opened for its inbox to keep the activities in order
+        :param batches: the batches opened by the worker, see ActivityQueueService.batches
+        '''
+        url, scheduled_activity = item[0], item[1]
+        if scheduled_activity is FLUSH_BATCH:
+            # the flush of a batch sent when it was full is ignored
+            if url in batches and batches[url][0] == item[2]:
+                return [(url, batches.pop(url)[1])]
+            return []
+
+        if not cls.batch_window or cls.batch_size <= 1 or not cls._is_batchable(scheduled_activity) or \
+                cls._is_unbatched(url):
+            ready = [(url, batches.pop(url)[1])] if url in batches else []
+            return ready + [(url, [scheduled_activity])]
+
+        if url not in batches:
+            due = time.time() + cls.batch_window
+            batches[url] = (due, [])
+            cls.scheduler.schedule([url, FLUSH_BATCH, due], due)
+        batch = batches[url][1]
+        batch.append(scheduled_activity)
+        if len(batch) >= cls.batch_size:
+            return [(url, batches.pop(url)[1])]
+        return []
+
     @classmethod
     def do_post(cls, url, activity, auth=None, timeout=DEFAULT_REQUEST_TIMEOUT):
         '''
@@ -173,7 +346,8 @@ class ActivityQueueService:
 
         if getattr(settings, 'DISABLE_OUTBOX', False) == 'DEBUG':
             return {'data': {}}
-        return requests.post(url, data=json.dumps(activity), headers=headers, timeout=timeout)
+        # the shared session keeps the connections to the inboxes alive between activities
+        return get_session().post(url, data=json.dumps(activity), headers=headers, timeout=timeout)
 
     @classmethod
     def _get_str_urlid(cls, obj):
@@ -224,7 +398,7 @@ class ActivityQueueService:
         '''
         if scheduled_activity.failed_attempts < MAX_ACTIVITY_RESCHEDULES:
             backoff = backoff_factor * (2 ** (scheduled_activity.failed_attempts - 1))
-            cls.resend_activity(url, scheduled_activity, backoff)
+            cls.resend_activity(url, scheduled_activity, delay=backoff)
             return True
 
         # no retries left, save the failure state
@@ -246,6 +420,7 @@ class ActivityQueueService:
         makes a POST request to url, passing ScheduledActivity instance. reschedules if needed
         :param backoff_factor: a factor to use in the extension of waiting for retries. Used both in the RetryStrategy
         of requests.post and in rescheduling an activity which timed out
+        :return: the response of the inbox, None if the activity was rescheduled or couldn't be sent
         '''
         response = None
         activity = scheduled_activity.to_activitystream()
@@ -259,6 +434,12 @@ class ActivityQueueService:
             logger.error('Failed to deliver backlink to ' + str(url) + ', was attempting ' + str(activity) +
                          str(e.__class__) + ': ' + str(e))
 
+        cls._finish_activity(url, scheduled_activity, response)
+        return response
+
+    @classmethod
+    def _finish_activity(cls, url, scheduled_activity, response):
+        '''saves the result of a sent activity and removes it from the scheduled activities'''
         saved = None
         if response is not None:
             saved = cls._save_activity_from_response(response, url, scheduled_activity)
@@ -267,12 +448,77 @@ class ActivityQueueService:
         # emit activity finished event
         cls._dispatch_activity_sending_finished(response, saved)
 
+    @classmethod
+    def _send_batch(cls, url, scheduled_activities, auth=None, backoff_factor=DEFAULT_BACKOFF_FACTOR):
+        '''
+        makes a single POST request to url, passing the ScheduledActivity instances worth sending in an
+        OrderedCollection. A batch which couldn't be delivered (an error or a 5xx answer) is rescheduled, its activities
+        being sent again one by one with their backoff. If the inbox refuses the collection (a 4xx answer), the
+        activities are sent one by one, and its host isn't sent batches for unbatched_host_ttl seconds, unless it
+        understood them: an inbox understanding batches answers 400 Bad Request to a batch it can't handle, refusing
+        the same activities when sent alone, so a 400 to a batch whose activities are all accepted one by one means the
+        inbox doesn't understand batches either
+        '''
+        scheduled_activities = [scheduled for scheduled in scheduled_activities
+                                if cls._is_worth_sending(url, scheduled)]
+        if len(scheduled_activities) <= 1:
+            for scheduled in scheduled_activities:
+                cls._send_activity(url, scheduled, auth, backoff_factor)
+            return
+
+        items = [scheduled.to_activitystream() for scheduled in scheduled_activities]
+        collection = {
+            '@context': items[0].get('@context', 'https://www.w3.org/ns/activitystreams'),
+            'type': 'OrderedCollection',
+            'totalItems': len(items),
+            'orderedItems': items
+        }
+        response = None
+        try:
+            response = cls.do_post(url, collection, auth)
+        except (Timeout, ConnectionError):
+            pass
+        except Exception as e:
+            logger.error('Failed to deliver a batch of ' + str(len(items)) + ' activities to ' + str(url) + ': ' +
+                         str(e.__class__) + ': ' + str(e))
+
+        status_code = getattr(response, 'status_code', None)
+        if response is None or (status_code is not None and int(status_code) >= 500):
+            for scheduled in scheduled_activities:
+                if not cls._attempt_failed_reschedule(url, scheduled, backoff_factor):
+                    cls._finish_activity(url, scheduled, None)
+            return
+
+        def is_success(response):
+            return str(getattr(response, 'status_code', None)).startswith('2')
+
+        if not is_success(response):
+            responses = [cls._send_activity(url, scheduled, auth, backoff_factor) for scheduled in scheduled_activities]
+            if status_code == 400:
+                if all(is_success(single) for single in responses):
+                    cls._set_unbatched(url)
+            elif status_code is not None and 400 < int(status_code) < 500:
+                cls._set_unbatched(url)
+            return
+
+        for scheduled in scheduled_activities:
+            cls._finish_activity(url, scheduled, response)
+
     @classmethod
     def _activity_queue_worker(cls, url, scheduled_activity):
         '''
         Worker for sending a scheduled activity on the queue. Decides whether to send the activity and then passes to
         _send_activity if it is worth it
         '''
+        if cls._is_worth_sending(url, scheduled_activity):
+            cls._send_activity(url, scheduled_activity)
+
+    @classmethod
+    def _is_worth_sending(cls, url, scheduled_activity):
+        '''
+        returns whether a scheduled activity holds new information for the inbox, deleting it if it doesn't: when a
+        more recent activity on the same object is scheduled, or when it repeats the last activity sent
+        '''
 
         def get_related_activities(type):
             '''returns a list of activity types which should be considered a "match" with the parameterised type'''
@@ -290,42 +536,26 @@ class ActivityQueueService:
 
         types = get_related_activities(scheduled_activity.type)
         if len(types) > 0:
-            scheduled = ScheduledActivity.objects.filter(external_id=scheduled_activity.external_id,
-                                                         created_at__gt=scheduled_activity.created_at,
-                                                         type__in=types)
-
-            # filter to scheduled activities on the same object
-            scheduled = [s for s in scheduled if cls._is_same_object_target(s, scheduled_activity)]
-
-            if len(scheduled) > 0:
+            # a more recent activity scheduled on the same object and target, found with the ids saved on each
+            superseded = ScheduledActivity.objects.filter(external_id=scheduled_activity.external_id,
+                                                          created_at__gt=scheduled_activity.created_at,
+                                                          type__in=types,
+                                                          object_id=scheduled_activity.object_id,
+                                                          target_id=scheduled_activity.target_id).exists()
+
+            if superseded:
                 scheduled_activity.delete()
-                return
+                return False
 
         if scheduled_activity.type == 'update' and not cls._update_is_new(url, scheduled_activity):
             scheduled_activity.delete()
-            return
+            return False
 
         if scheduled_activity.type in ['add', 'remove'] and not cls._add_remove_is_new(url, scheduled_activity):
             scheduled_activity.delete()
-            return
-
-        cls._send_activity(url, scheduled_activity)
-
-    @classmethod
-    def _is_same_object_target(cls, activity_a, activity_b):
-        def get_property(object, property, default=None):
-            ret = object.get(property, default)
-            if isinstance(ret, dict):
-                ret = ret.get('@id', ret.get('name', None))
-            return ret
-
-        a = activity_a.to_activitystream()
-        b = activity_b.to_activitystream()
-
-        if get_property(a, 'object') != get_property(b, 'object'):
             return False
 
-        return get_property(a, 'target', a.get('origin', None)) == get_property(b, 'target', b.get('origin', None))
+        return True
 
     @classmethod
     def _update_is_new(cls, url, scheduled_activity):
@@ -388,24 +618,32 @@ class ActivityQueueService:
 
     @classmethod
     def _push_to_queue(cls, url, scheduled_activity, delay=DEFAULT_ACTIVITY_DELAY):
-        '''wrapper to check for singleton initialization before pushing'''
+        '''
+        wrapper to check for singleton initialization before pushing. An activity with a delay is held by the scheduler
+        until it is due
+        '''
         if not cls.initialized:
             cls.start()
-        cls.queue.put([url, scheduled_activity, delay])
+        if delay > 0:
+            cls.scheduler.schedule([url, scheduled_activity], time.time() + delay)
+        else:
+            cls._enqueue([url, scheduled_activity])
 
     @classmethod
-    def resend_activity(cls, url, scheduled_activity, failed=True):
+    def resend_activity(cls, url, scheduled_activity, failed=True, delay=DEFAULT_ACTIVITY_DELAY):
         '''
         a variation of send_activity for ScheduledActivity objects
         :param url: the recipient url inbox
         :param scheduled_activity: a ScheduledActivity object for sending
         :param failed: set to True to increment scheduled_activity.failed_attempts, to keep track of the number of resends
+        :param delay: the number of seconds to wait before sending the activity
         '''
         if failed:
             scheduled_activity.failed_attempts = scheduled_activity.failed_attempts + 1
+            scheduled_activity.due_at = timezone.now() + timedelta(seconds=delay)
             scheduled_activity.save()
 
-        cls._push_to_queue(url, scheduled_activity)
+        cls._push_to_queue(url, scheduled_activity, delay)
 
     @classmethod
     def send_activity(cls, url, activity, auth=None, delay=DEFAULT_ACTIVITY_DELAY):
@@ -420,16 +658,18 @@ class ActivityQueueService:
                                         response_code='201')
             return
 
-        # schedule the activity
-        scheduled = cls._save_sent_activity(activity, ScheduledActivity, external_id=url, type=activity.get('type', None))
+        # schedule the activity, with its due time to be restored by revive_activities
+        scheduled = cls._save_sent_activity(activity, ScheduledActivity, external_id=url, type=activity.get('type', None),
+                                            due_at=timezone.now() + timedelta(seconds=delay))
         cls._push_to_queue(url, scheduled, delay)
 
     @classmethod
     def _save_sent_activity(cls, activity, model_represenation=ActivityModel, success=False, external_id=None, type=None,
-                            response_location=None, response_code=None, local_id=None, response_body=None):
+                            response_location=None, response_code=None, local_id=None, response_body=None, **kwargs):
         '''
         Auxiliary function saves a record of parameterised activity
         :param model_represenation: the model class which should be used to store the activity. Defaults to djangol.Activity, must be a subclass
+        :param kwargs: the values of the fields specific to model_represenation
         '''
         payload = json.dumps(activity)
         if response_body is not None:
@@ -442,7 +682,7 @@ class ActivityQueueService:
             type = activity.get('type').lower()
         obj = model_represenation.objects.create(local_id=local_id, payload=payload, success=success,
                                                  external_id=external_id, type=type, response_location=response_location,
-                                                 response_code=response_code, response_body=response_body)
+                                                 response_code=response_code, response_body=response_body, **kwargs)
         return obj
 
 
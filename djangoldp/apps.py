@@ -7,6 +7,7 @@ class DjangoldpConfig(AppConfig):
     def ready(self):
         self.auto_register_model_admin()
         self.start_activity_queue()
+        self.install_context_store()
         
         # Patch guardian core to avoid prefetching permissions several times
         from guardian.core import ObjectPermissionChecker
@@ -20,6 +21,10 @@ class DjangoldpConfig(AppConfig):
 
         ObjectPermissionChecker._prefetch_cache = _prefetch_cache
 
+    def install_context_store(self):
+        from djangoldp.contexts import install_context_store
+        install_context_store()
+
     def start_activity_queue(self):
         from djangoldp.activities.services import ActivityQueueService
         if os.environ.get('RUN_MAIN') is not None:
@@ -4,9 +4,9 @@
 '''
 from django.apps import apps
 from django.conf import settings
+from djangoldp.http_client import get_session
 from djangoldp.models import LDPSource
 from urllib.parse import urlparse
-import requests
 
 # Helper command for argument type checking
 def is_string(target):
@@ -16,7 +16,7 @@ def is_string(target):
 
 # Helper command to check status code of a target
 def is_alive(target, status_code = 200):
-  return requests.get(target).status_code == status_code
+  return get_session().get(target).status_code == status_code
 
 # Add argument to the `check_integrity` command
 def add_arguments(parser):
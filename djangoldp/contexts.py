@@ -0,0 +1,130 @@
+import copy
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+from django.conf import settings
+from pyld import jsonld
+
+logger = logging.getLogger('djangoldp')
+
+# defaults for various DjangoLDP settings (see documentation)
+LDP_CONTEXT_CACHE_TTL = getattr(settings, 'LDP_CONTEXT_CACHE_TTL', 3600)
+LDP_CONTEXT_CACHE_DIR = getattr(settings, 'LDP_CONTEXT_CACHE_DIR', None)
+LDP_LOCAL_CONTEXTS = getattr(settings, 'LDP_LOCAL_CONTEXTS', {})
+
+
+class ContextStore:
+    '''
+    A process-wide store of the JSON-LD documents (mostly @context) dereferenced by pyld, used as its document loader.
+    Documents are pre-loaded from local files, or fetched once and kept for a time-to-live. Fetched documents can be
+    persisted in a directory, to survive restarts, and an expired document is still served if it can't be fetched again
+    '''
+    def __init__(self, ttl=LDP_CONTEXT_CACHE_TTL, directory=LDP_CONTEXT_CACHE_DIR, local_contexts=None,
+                 timeout=None):
+        self.ttl = ttl
+        self.directory = directory
+        self.timeout = timeout if timeout is not None else getattr(settings, 'DEFAULT_REQUEST_TIMEOUT', 10)
+        self.lock = threading.Lock()
+        # incremented on each change of the documents, for the results computed from them to be recomputed
+        self.version = 0
+        self.reset()
+        for url, path in (LDP_LOCAL_CONTEXTS if local_contexts is None else local_contexts).items():
+            try:
+                self.load_file(url, path)
+            except (OSError, ValueError) as e:
+                logger.error(f'Could not load the JSON-LD document {url} from {path}: {e}')
+
+    def reset(self):
+        with self.lock:
+            # url -> {'document': remote document, 'expires': timestamp or None}
+            self.documents = {}
+            self.version += 1
+            self.hits = 0
+            self.misses = 0
+
+    def _is_expired(self, entry):
+        return entry['expires'] is not None and entry['expires'] <= time.time()
+
+    def _get_path(self, url):
+        return os.path.join(self.directory, hashlib.sha256(url.encode()).hexdigest() + '.json')
+
+    def load_file(self, url, path):
+        '''serves the document stored in a local file for the url, which never expires'''
+        with open(path, encoding='utf-8') as f:
+            document = json.load(f)
+        self.set(url, {'contextUrl': None, 'documentUrl': url, 'document': document}, expires=None)
+
+    def set(self, url, remote_document, expires=None):
+        with self.lock:
+            self.documents[url] = {'document': remote_document, 'expires': expires}
+            self.version += 1
+
+    def fetch(self, url):
+        '''fetches the document from its url, persisting it if a directory is set'''
+        remote_document = jsonld.requests_document_loader(timeout=self.timeout)(url)
+        expires = time.time() + self.ttl if self.ttl is not None else None
+        self.set(url, remote_document, expires)
+        if self.directory:
+            self.persist(url, remote_document, expires)
+        return remote_document
+
+    def persist(self, url, remote_document, expires):
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            path = self._get_path(url)
+            with open(path + '.tmp', 'w', encoding='utf-8') as f:
+                json.dump({'url': url, 'expires': expires, 'document': remote_document}, f)
+            os.replace(path + '.tmp', path)
+        except OSError as e:
+            logger.warning(f'Could not persist the JSON-LD document {url}: {e}')
+
+    def restore(self, url):
+        '''returns the entry persisted for the url, None if there isn't any'''
+        if not self.directory:
+            return None
+        try:
+            with open(self._get_path(url), encoding='utf-8') as f:
+                persisted = json.load(f)
+        except (OSError, ValueError):
+            return None
+        entry = {'document': persisted['document'], 'expires': persisted['expires']}
+        with self.lock:
+            self.documents[url] = entry
+            self.version += 1
+        return entry
+
+    def load_document(self, url):
+        '''the document loader of pyld: returns a copy of the remote document, as pyld may alter it'''
+        entry = self.documents.get(url) or self.restore(url)
+        if entry is not None and not self._is_expired(entry):
+            with self.lock:
+                self.hits += 1
+            return copy.deepcopy(entry['document'])
+        with self.lock:
+            self.misses += 1
+        try:
+            return copy.deepcopy(self.fetch(url))
+        except jsonld.JsonLdError:
+            if entry is None:
+                raise
+            logger.warning(f'Could not fetch the JSON-LD document {url}, serving an expired copy')
+            return copy.deepcopy(entry['document'])
+
+    def __call__(self, url):
+        return self.load_document(url)
+
+    def stats(self):
+        with self.lock:
+            return {'hits': self.hits, 'misses': self.misses, 'documents': len(self.documents)}
+
+
+def install_context_store():
+    '''plugs the context store in as the default document loader of pyld'''
+    jsonld.set_document_loader(GLOBAL_CONTEXT_STORE)
+
+
+GLOBAL_CONTEXT_STORE = ContextStore()
@@ -8,11 +8,15 @@ import hashlib
 import json
 from typing import Optional, Any
 from django.core.exceptions import FieldDoesNotExist
-from django.db.models import QuerySet
+from django.db.models import Count, Max, QuerySet
+from django.utils.http import parse_etags
 
 # Constant for timestamp conversion
 TIMESTAMP_TO_MICROSECONDS = 1000000
 
+# Marks the latest modification time of a container as not given, for generate_container_etag to query it
+NOT_GIVEN = object()
+
 
 def normalize_etag(etag_str):
     """
@@ -34,6 +38,24 @@ def normalize_etag(etag_str):
     return is_weak, etag_str.strip('"')
 
 
+def match_etags(header: str, etag: str) -> bool:
+    """
+    Compare an ETag with the ones of an If-Match or If-None-Match header, with the weak comparison.
+
+    Args:
+        header: Value of the If-Match or If-None-Match header
+        etag: Current ETag of the resource or container
+
+    Returns:
+        bool: True if the header is '*' or lists the ETag, ignoring the weak/strong distinction
+    """
+    etags = parse_etags(header)
+    if '*' in etags:
+        return True
+    _, etag_value = normalize_etag(etag)
+    return any(normalize_etag(candidate)[1] == etag_value for candidate in etags)
+
+
 def generate_etag(obj: Any, serialized_data: Optional[dict] = None) -> str:
     """
     Generate weak ETag for a model instance.
@@ -72,34 +94,103 @@ def generate_etag(obj: Any, serialized_data: Optional[dict] = None) -> str:
     return f'W/"{hash_value}"'  # Weak ETag
 
 
-def generate_container_etag(queryset: QuerySet, count: int, page_number: Optional[int] = None) -> str:
+def has_updated_at(model) -> bool:
+    try:
+        model._meta.get_field('updated_at')
+        return True
+    except FieldDoesNotExist:
+        return False
+
+
+def get_container_stats(queryset: QuerySet, count_limit: Optional[int] = None) -> dict:
+    """
+    Compute the number of items of a container and their latest modification time, in a single aggregate query.
+
+    Args:
+        queryset: Django QuerySet for the container
+        count_limit: Optional number of items above which they aren't counted exactly
+
+    Returns:
+        dict: 'count', 'latest_updated' (None if the model has no updated_at field) and 'exact', False if the items
+        were only counted up to count_limit + 1
+    """
+    queryset = queryset.order_by()
+    aggregates = {'latest_updated': Max('updated_at')} if has_updated_at(queryset.model) else {}
+    if count_limit is None:
+        stats = queryset.aggregate(count=Count('pk'), **aggregates)
+        stats['exact'] = True
+    else:
+        # the count is bounded by a LIMIT, and can't share the query of the latest modification time
+        stats = queryset.aggregate(**aggregates) if aggregates else {}
+        stats['count'] = queryset[:count_limit + 1].count()
+        stats['exact'] = stats['count'] <= count_limit
+    stats.setdefault('latest_updated', None)
+    return stats
+
+
+def generate_content_etag(serialized_data: Any, *keys: Any) -> str:
+    """
+    Generate weak ETag from the serialized representation of a container, for the models without an updated_at field
+    whose members can change without changing the container metadata.
+
+    Args:
+        serialized_data: Serialized representation of the container, or of its page
+        keys: Other values selecting the representation of the container (media type)
+
+    Returns:
+        str: Weak ETag value for the container in format W/"hash"
+    """
+    content = json.dumps(serialized_data, sort_keys=True, default=str)
+    etag_content = ":".join(str(value) for value in [content, *keys])
+    hash_value = hashlib.sha256(etag_content.encode()).hexdigest()[:32]  # Truncate to 32 chars
+    return f'W/"{hash_value}"'
+
+
+def generate_journal_etag(versions: list, *keys: Any) -> str:
+    """
+    Generate weak ETag for a container from the change journal, without querying the container.
+
+    Args:
+        versions: Versions of the models the container is built from, in the change journal
+        keys: Other values selecting the members and representation of the container (URL, user, media type)
+
+    Returns:
+        str: Weak ETag value for the container in format W/"hash"
+    """
+    etag_content = ":".join(str(value) for value in [*versions, *keys])
+    hash_value = hashlib.sha256(etag_content.encode()).hexdigest()[:32]  # Truncate to 32 chars
+    return f'W/"{hash_value}"'
+
+
+def generate_container_etag(queryset: QuerySet, count: int, page_number: Optional[int] = None,
+                            cursor: Optional[str] = None, latest_updated: Any = NOT_GIVEN) -> str:
     """
     Generate weak ETag for a container.
-    Based on count, latest modification time, and optional page number.
+    Based on count, latest modification time, and optional page number or cursor.
 
     Args:
         queryset: Django QuerySet for the container
         count: Number of items in the container (total count, not page size)
         page_number: Optional page number for paginated containers
+        cursor: Optional cursor for containers paginated with a cursor ('' for the first page)
+        latest_updated: Optional latest modification time of the items, already computed by get_container_stats
 
     Returns:
         str: Weak ETag value for the container in format W/"hash"
     """
-    latest_updated = None
+    latest_timestamp = latest_updated
+    if latest_timestamp is NOT_GIVEN:
+        latest_timestamp = None
+        # Check if model has updated_at field, then get the latest timestamp
+        if has_updated_at(queryset.model):
+            latest_timestamp = queryset.order_by('-updated_at').values_list('updated_at', flat=True).first()
 
-    # Check if model has updated_at field using FieldDoesNotExist
-    try:
-        queryset.model._meta.get_field('updated_at')
-        # Field exists, get the latest timestamp
-        latest_timestamp = queryset.order_by('-updated_at').values_list('updated_at', flat=True).first()
-        if latest_timestamp:
-            try:
-                latest_updated = latest_timestamp.timestamp()
-            except (AttributeError, ValueError, TypeError):
-                pass
-    except FieldDoesNotExist:
-        # Field doesn't exist, continue with fallback
-        pass
+    latest_updated = None
+    if latest_timestamp:
+        try:
+            latest_updated = latest_timestamp.timestamp()
+        except (AttributeError, ValueError, TypeError):
+            pass
 
     if latest_updated:
         timestamp_micro = int(latest_updated * TIMESTAMP_TO_MICROSECONDS)
@@ -114,6 +205,8 @@ def generate_container_etag(queryset: QuerySet, count: int, page_number: Optiona
     # Include page number in ETag if paginated
     if page_number is not None:
         etag_content = f"{etag_content}:page{page_number}"
+    elif cursor is not None:
+        etag_content = f"{etag_content}:cursor{cursor}"
 
     # Use SHA256 for final hash
     hash_value = hashlib.sha256(etag_content.encode()).hexdigest()[:32]  # Truncate to 32 chars
@@ -1,9 +1,41 @@
 from django.conf import settings
-from django.db.models import Q
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import Exists, OuterRef, Q
 from rest_framework.filters import BaseFilterBackend
 from djangoldp.utils import check_client_ip
 
 
+def match_all() -> Q:
+    '''returns a Q object matching all the objects'''
+    return Q(pk__isnull=False)
+
+def match_none() -> Q:
+    '''returns a Q object matching no object'''
+    return Q(pk__isnull=True)
+
+def is_multivalued_lookup(model, lookup:str) -> bool:
+    '''returns True if the lookup follows a many-to-many or a reverse foreign key relation'''
+    opts = model._meta
+    for part in lookup.split('__'):
+        try:
+            field = opts.get_field(part)
+        except FieldDoesNotExist:
+            return False
+        if not field.is_relation or field.related_model is None:
+            return False
+        if field.many_to_many or field.one_to_many:
+            return True
+        opts = field.related_model._meta
+    return False
+
+def lookup_q(model, **lookups) -> Q:
+    '''returns a Q object applying the lookups to the model. Lookups following multi-valued relations are evaluated in
+    an Exists subquery, so that the joins don't duplicate the objects'''
+    if any(is_multivalued_lookup(model, lookup) for lookup in lookups):
+        return Q(Exists(model._base_manager.filter(pk=OuterRef('pk'), **lookups)))
+    return Q(**lookups)
+
+
 class OwnerFilterBackend(BaseFilterBackend):
     """Adds the objects owned by the user"""
     def filter_queryset(self, request, queryset, view):
@@ -19,6 +51,19 @@ class OwnerFilterBackend(BaseFilterBackend):
             return queryset.filter(**{view.model._meta.auto_author: request.user})
         return queryset
 
+    def get_filter_q(self, request, model):
+        if request.user.is_superuser:
+            return match_all()
+        if request.user.is_anonymous:
+            return match_none()
+        if getattr(model._meta, 'owner_field', None):
+            return lookup_q(model, **{model._meta.owner_field: request.user})
+        if getattr(model._meta, 'owner_urlid_field', None):
+            return lookup_q(model, **{model._meta.owner_urlid_field: request.user.urlid})
+        if getattr(model._meta, 'auto_author', None):
+            return lookup_q(model, **{model._meta.auto_author: request.user})
+        return match_all()
+
 class PublicFilterBackend(BaseFilterBackend):
     """
     Public filter applied.
@@ -28,6 +73,9 @@ class PublicFilterBackend(BaseFilterBackend):
         public_field = queryset.model._meta.public_field
         return queryset.filter(**{public_field: True})
 
+    def get_filter_q(self, request, model):
+        return lookup_q(model, **{model._meta.public_field: True})
+
 class ActiveFilterBackend(BaseFilterBackend):
     """
     Filter which removes inactive objects from the queryset, useful for user for instance and configurable using the active_field meta
@@ -38,6 +86,11 @@ class ActiveFilterBackend(BaseFilterBackend):
             return queryset.filter(**{is_active_field :True})
         return queryset
 
+    def get_filter_q(self, request, model):
+        if (hasattr(model._meta, 'active_field')):
+            return lookup_q(model, **{model._meta.active_field: True})
+        return match_all()
+
 class NoFilterBackend(BaseFilterBackend):
     """
     No filter applied.
@@ -46,6 +99,9 @@ class NoFilterBackend(BaseFilterBackend):
     def filter_queryset(self, request, queryset, view):
         return queryset 
 
+    def get_filter_q(self, request, model):
+        return match_all()
+
 class LocalObjectFilterBackend(BaseFilterBackend):
     """
     Filter which removes external objects (federated backlinks) from the queryset
@@ -151,4 +207,7 @@ class IPFilterBackend(BaseFilterBackend):
         if check_client_ip(request):
             return queryset
         else:
-            return queryset.none()
\ No newline at end of file
+            return queryset.none()
+
+    def get_filter_q(self, request, model):
+        return match_all() if check_client_ip(request) else match_none()
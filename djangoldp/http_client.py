@@ -0,0 +1,77 @@
+import threading
+from http.cookiejar import DefaultCookiePolicy
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# defaults for various DjangoLDP settings (see documentation)
+LDP_HTTP_POOL_CONNECTIONS = getattr(settings, 'LDP_HTTP_POOL_CONNECTIONS', 10)
+LDP_HTTP_POOL_MAXSIZE = getattr(settings, 'LDP_HTTP_POOL_MAXSIZE', 10)
+LDP_HTTP_RETRIES = getattr(settings, 'LDP_HTTP_RETRIES', 2)
+
+_session = None
+_lock = threading.Lock()
+
+
+class TimeoutHTTPAdapter(HTTPAdapter):
+    '''an HTTPAdapter applying a default timeout to the requests sent without one'''
+    def __init__(self, timeout=None, **kwargs):
+        self.timeout = timeout
+        super().__init__(**kwargs)
+
+    def send(self, request, **kwargs):
+        if kwargs.get('timeout') is None:
+            kwargs['timeout'] = self.timeout
+        return super().send(request, **kwargs)
+
+
+def get_retry(retries=LDP_HTTP_RETRIES):
+    '''
+    returns the retry policy of the session: the connections which failed to open are retried with the backoff of the
+    ActivityQueueService, as well as the idempotent requests answered by an unavailable server.
+    A POST already sent is never retried, the ActivityQueueService rescheduling it instead
+    '''
+    return Retry(total=retries, connect=retries, read=0, status=retries, redirect=False,
+                 backoff_factor=getattr(settings, 'DEFAULT_BACKOFF_FACTOR', 1),
+                 status_forcelist=(502, 503, 504), raise_on_status=False)
+
+
+def create_session(pool_connections=LDP_HTTP_POOL_CONNECTIONS, pool_maxsize=LDP_HTTP_POOL_MAXSIZE,
+                   retries=LDP_HTTP_RETRIES, timeout=None):
+    '''
+    returns a requests Session keeping a pool of connections alive for each host it sends to
+    :param pool_connections: the number of hosts whose pools are kept
+    :param pool_maxsize: the number of connections kept alive to each host
+    :param timeout: the default timeout of the requests, DEFAULT_REQUEST_TIMEOUT if not given
+    '''
+    if timeout is None:
+        timeout = getattr(settings, 'DEFAULT_REQUEST_TIMEOUT', 10)
+    session = requests.Session()
+    # the session is shared by the whole process, and must not carry the cookies of a server to the next requests
+    session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+    adapter = TimeoutHTTPAdapter(timeout=timeout, pool_connections=pool_connections, pool_maxsize=pool_maxsize,
+                                 max_retries=get_retry(retries))
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def get_session():
+    '''returns the session shared by the outgoing requests of the process, created on first use'''
+    global _session
+    if _session is None:
+        with _lock:
+            if _session is None:
+                _session = create_session()
+    return _session
+
+
+def reset_session():
+    '''closes the connections of the shared session, which is created again on next use'''
+    global _session
+    with _lock:
+        session, _session = _session, None
+    if session is not None:
+        session.close()
@@ -0,0 +1,104 @@
+import time
+from functools import partial
+
+from django.apps import apps
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Group
+from django.core.cache import caches
+from django.db import transaction
+
+# the alias of a Django cache (settings.CACHES) in which to keep the change journal, None to disable it
+LDP_CHANGE_JOURNAL = getattr(settings, 'LDP_CHANGE_JOURNAL', None)
+
+
+def get_related_models(model, depth, models):
+    '''
+    adds to models the models related to model, and the models related to them while depth isn't exhausted, as nested
+    objects embed their own relations (the same recursion as get_prefetch_fields)
+    :param models: a dict of {model: the greatest depth left when it was reached}
+    '''
+    for field in model._meta.get_fields():
+        related_model = field.related_model if field.is_relation else None
+        if not isinstance(related_model, type) or models.get(related_model, -2) >= depth - 1:
+            continue
+        models[related_model] = depth - 1
+        if depth >= 0:
+            get_related_models(related_model, depth - 1, models)
+
+
+def get_journal_models(model, depth=0):
+    '''
+    returns the labels of the models whose changes may change a container of the model serialized at depth: the model
+    itself, the models it is related to (up to the depth), and the models granting permissions (users, groups, and
+    the object permissions of guardian)
+    '''
+    journal_models = model.__dict__.get('_journal_models')
+    if journal_models is None:
+        journal_models = model._journal_models = {}
+    if depth in journal_models:
+        return journal_models[depth]
+    models = {model: depth}
+    get_related_models(model, depth, models)
+    models = [*models, get_user_model(), Group]
+    if apps.is_installed('guardian'):
+        models.extend([apps.get_model('guardian', 'UserObjectPermission'),
+                       apps.get_model('guardian', 'GroupObjectPermission')])
+    labels = tuple(sorted({related._meta.label for related in models}))
+    journal_models[depth] = labels
+    return labels
+
+
+class ChangeJournal:
+    '''
+    A version per model label, changed on each save, delete or change of relations of an instance of the model, which
+    tells whether a container may have changed without querying it.
+    Versions are kept in a Django cache, to be shared by all the workers of a deployment. They start from the current
+    time, so that losing a version (e.g. to an eviction) can never bring back the ETags built from a previous one.
+    Changes made without signals (QuerySet.update, bulk_create, raw SQL) are not recorded
+    '''
+    key_prefix = 'djangoldp:journal'
+
+    def __init__(self, alias=LDP_CHANGE_JOURNAL):
+        self.alias = alias
+
+    @property
+    def enabled(self):
+        return self.alias is not None
+
+    @property
+    def backend(self):
+        return caches[self.alias]
+
+    def _key(self, label):
+        return '{}:{}'.format(self.key_prefix, label)
+
+    def bump(self, label):
+        self.backend.set(self._key(label), time.time_ns(), timeout=None)
+
+    def record(self, model):
+        '''
+        records a change on the model, now and once the current transaction is committed: a container read in the
+        meantime, with the changes not yet visible, doesn't keep the version of the committed changes
+        '''
+        if not self.enabled:
+            return
+        label = model._meta.label
+        self.bump(label)
+        transaction.on_commit(partial(self.bump, label))
+
+    def get_versions(self, labels):
+        '''returns the versions of the model labels, in a single read of the cache'''
+        keys = {self._key(label): label for label in labels}
+        versions = self.backend.get_many(keys)
+        for key in keys:
+            if key not in versions:
+                version = time.time_ns()
+                # add() does not overwrite a version set concurrently by another worker
+                if not self.backend.add(key, version, timeout=None):
+                    version = self.backend.get(key, version)
+                versions[key] = version
+        return [versions[key] for key in keys]
+
+
+GLOBAL_CHANGE_JOURNAL = ChangeJournal()
@@ -5,6 +5,7 @@ from django.core.management.base import BaseCommand
 from django.conf import settings
 from django.apps import apps
 from urllib.parse import urlparse, urljoin
+from djangoldp.http_client import get_session
 
 class StaticContentGenerator:
     def __init__(self, stdout, style):
@@ -13,6 +14,7 @@ class StaticContentGenerator:
         self.base_uri = getattr(settings, 'BASE_URL', '')
         self.max_depth = getattr(settings, 'MAX_RECURSION_DEPTH', 5)
         self.request_timeout = getattr(settings, 'SSR_REQUEST_TIMEOUT', 10)
+        self.session = get_session()
         self.regenerated_urls = set()
         self.failed_urls = set()
         self.output_dir = 'ssr'
@@ -53,7 +55,7 @@ class StaticContentGenerator:
 
     def _fetch_and_save_content(self, model, url, output_dir):
         try:
-            response = requests.get(url, timeout=self.request_timeout)
+            response = self.session.get(url, timeout=self.request_timeout)
             if response.status_code == 200:
                 content = self._update_ids_and_fetch_associated(response.text)
                 self._save_content(model, url, content, output_dir)
@@ -162,7 +164,7 @@ class StaticContentGenerator:
         os.makedirs(os.path.dirname(file_path), exist_ok=True)
 
         try:
-            response = requests.get(url, timeout=self.request_timeout)
+            response = self.session.get(url, timeout=self.request_timeout)
             if response.status_code == 200:
                 updated_content = json.loads(self._update_ids_and_fetch_associated(response.text, depth + 1))
                 updated_content = self._rewrite_ids_before_saving(updated_content)
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 01:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('djangoldp', '0021_add_timestamps_to_ldp_models'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='scheduledactivity',
+            name='due_at',
+            field=models.DateTimeField(blank=True, help_text='when the activity is due to be sent, restored by revive_activities on restart', null=True),
+        ),
+    ]
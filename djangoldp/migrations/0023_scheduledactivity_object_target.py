@@ -0,0 +1,57 @@
+# Generated by Django 5.2.18 on 2026-10-17 02:00
+
+import hashlib
+import json
+
+from django.db import migrations, models
+
+
+def get_normalized_id(value):
+    if isinstance(value, dict):
+        value = value.get('@id', value.get('name', None))
+    if value is None:
+        return None
+    value = str(value)
+    if len(value) > 255:
+        return 'sha256:' + hashlib.sha256(value.encode('utf-8')).hexdigest()
+    return value
+
+
+def backfill_object_target(apps, schema_editor):
+    '''saves the ids of the object and target of the activities already scheduled'''
+    ScheduledActivity = apps.get_model('djangoldp', 'ScheduledActivity')
+    for scheduled in ScheduledActivity.objects.only('pk', 'payload').iterator():
+        try:
+            activity = json.loads(scheduled.payload)
+        except ValueError:
+            continue
+        if not isinstance(activity, dict):
+            continue
+        ScheduledActivity.objects.filter(pk=scheduled.pk).update(
+            object_id=get_normalized_id(activity.get('object', None)),
+            target_id=get_normalized_id(activity.get('target', activity.get('origin', None))))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('djangoldp', '0022_scheduledactivity_due_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='scheduledactivity',
+            name='object_id',
+            field=models.CharField(blank=True, help_text='the id of the object of the activity, to find the activities superseding it', max_length=255, null=True),
+        ),
+        migrations.AddField(
+            model_name='scheduledactivity',
+            name='target_id',
+            field=models.CharField(blank=True, help_text='the id of the target (or origin) of the activity', max_length=255, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='scheduledactivity',
+            index=models.Index(fields=['object_id', 'target_id'], name='djangoldp_scheduled_obj_idx'),
+        ),
+        migrations.RunPython(backfill_object_target, migrations.RunPython.noop),
+    ]
@@ -1,3 +1,4 @@
+import hashlib
 import json
 import logging
 import uuid
@@ -8,7 +9,7 @@ from django.contrib.auth.models import Group
 from django.core.exceptions import FieldDoesNotExist, ObjectDoesNotExist, ValidationError
 from django.db import models
 from django.db.models.base import ModelBase
-from django.db.models.signals import post_save, pre_save, pre_delete, m2m_changed
+from django.db.models.signals import post_save, pre_save, post_delete, pre_delete, m2m_changed
 from django.dispatch import receiver
 from django.urls import get_resolver
 from django.utils.datastructures import MultiValueDictKeyError
@@ -311,13 +312,36 @@ class Activity(Model):
 class ScheduledActivity(Activity):
     failed_attempts = models.PositiveIntegerField(default=0,
                                                   help_text='a log of how many failed retries have been made sending the activity')
+    due_at = models.DateTimeField(null=True, blank=True,
+                                  help_text='when the activity is due to be sent, restored by revive_activities on restart')
+    object_id = models.CharField(max_length=255, null=True, blank=True,
+                                 help_text='the id of the object of the activity, to find the activities superseding it')
+    target_id = models.CharField(max_length=255, null=True, blank=True,
+                                 help_text='the id of the target (or origin) of the activity')
+
+    @classmethod
+    def get_normalized_id(cls, value):
+        '''returns the @id (or name) of an object of an activity, hashed if it doesn't fit in the columns'''
+        if isinstance(value, dict):
+            value = value.get('@id', value.get('name', None))
+        if value is None:
+            return None
+        value = str(value)
+        if len(value) > 255:
+            return 'sha256:' + hashlib.sha256(value.encode('utf-8')).hexdigest()
+        return value
 
     def save(self, *args, **kwargs):
         self.is_finished = False
+        activity = self.to_activitystream()
+        if isinstance(activity, dict):
+            self.object_id = self.get_normalized_id(activity.get('object', None))
+            self.target_id = self.get_normalized_id(activity.get('target', activity.get('origin', None)))
         super(ScheduledActivity, self).save(*args, **kwargs)
 
     class Meta(Model.Meta):
         disable_url = True
+        indexes = [models.Index(fields=['object_id', 'target_id'], name='djangoldp_scheduled_obj_idx')]
 
 
 class Follower(Model):
@@ -393,10 +417,43 @@ def invalidate_model_cache_if_has_entry(model):
     entry = getattr(model._meta, 'label', None)
     invalidate_cache_if_has_entry(entry)
 
+def invalidate_instances_cache(model, pks, owned=False):
+    from djangoldp.serializers import GLOBAL_SERIALIZER_CACHE
+
+    GLOBAL_SERIALIZER_CACHE.invalidate_instances(getattr(model._meta, 'label', None), pks, owned=owned)
+
 @receiver([pre_save, pre_delete])
-def invalidate_caches(sender, instance, **kwargs):
-    invalidate_model_cache_if_has_entry(sender)
+def invalidate_caches(sender, instance, signal, **kwargs):
+    from djangoldp.journal import GLOBAL_CHANGE_JOURNAL
+    from djangoldp.serializers import GLOBAL_SERIALIZER_CACHE
+    from djangoldp.serializers.cache import get_membership_fingerprint
+
+    GLOBAL_CHANGE_JOURNAL.record(sender)
+    if signal is pre_delete:
+        invalidate_instances_cache(sender, [instance.pk], owned=True)
+    # a new instance, or an instance with changes on its relations or filtered fields, may enter any container
+    elif instance._state.adding or instance.pk is None or \
+            GLOBAL_SERIALIZER_CACHE.fingerprint(sender._meta.label, instance.pk) != get_membership_fingerprint(instance):
+        invalidate_model_cache_if_has_entry(sender)
+    else:
+        invalidate_instances_cache(sender, [instance.pk])
+
+@receiver([post_save, post_delete])
+def record_change(sender, **kwargs):
+    from djangoldp.journal import GLOBAL_CHANGE_JOURNAL
+
+    # recorded again once the change is made, for the containers read before it was visible to be read again
+    GLOBAL_CHANGE_JOURNAL.record(sender)
 
 @receiver([m2m_changed])
 def invalidate_caches_m2m(sender, instance, action, *args, **kwargs):
-    invalidate_model_cache_if_has_entry(kwargs['model'])
\ No newline at end of file
+    from djangoldp.journal import GLOBAL_CHANGE_JOURNAL
+
+    for model in (sender, type(instance), kwargs['model']):
+        GLOBAL_CHANGE_JOURNAL.record(model)
+    # the nested containers of the instance and of the related instances change, and so do the containers embedding them
+    invalidate_instances_cache(type(instance), [instance.pk], owned=True)
+    if kwargs['pk_set'] is None:
+        invalidate_model_cache_if_has_entry(kwargs['model'])
+    else:
+        invalidate_instances_cache(kwargs['model'], kwargs['pk_set'], owned=True)
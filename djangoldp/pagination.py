@@ -1,3 +1,7 @@
+from functools import partial
+
+from django.core.paginator import Paginator
+from rest_framework.pagination import CursorPagination
 from rest_framework.pagination import LimitOffsetPagination
 from rest_framework.pagination import PageNumberPagination
 from rest_framework.response import Response
@@ -6,6 +10,18 @@ import logging
 logger = logging.getLogger('djangoldp')
 
 
+class CountedPaginator(Paginator):
+    """
+    A Django paginator given the number of objects, when the view has already counted them.
+    """
+
+    def __init__(self, object_list, per_page, count=None, **kwargs):
+        super().__init__(object_list, per_page, **kwargs)
+        if count is not None:
+            # overrides the cached property, which would count the objects again
+            self.__dict__['count'] = count
+
+
 class LDPOffsetPagination(LimitOffsetPagination):
     """
     LDP-compliant offset-based pagination.
@@ -15,8 +31,29 @@ class LDPOffsetPagination(LimitOffsetPagination):
     - last: Link to last page (when determinable)
     - prev: Link to previous page
     - next: Link to next page
+
+    Reuses the number of objects counted by the view, as its container_count.
     """
 
+    def paginate_queryset(self, queryset, request, view=None):
+        self.container_count = getattr(view, 'container_count', None)
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_count(self, queryset):
+        if self.container_count is not None:
+            return self.container_count
+        return super().get_count(queryset)
+
+    def get_page_key(self, request):
+        """
+        Return the key identifying the page in the ETag of the container, before the page is fetched:
+        its offset and limit, or None if the container isn't paginated.
+        """
+        limit = self.get_limit(request)
+        if limit is None:
+            return None
+        return '{}:{}'.format(self.get_offset(request), limit)
+
     def get_paginated_response(self, data):
         """
         Generate paginated response with W3C LDP-compliant Link headers.
@@ -79,11 +116,25 @@ class LDPPagination(PageNumberPagination):
     - next: Link to next page
 
     Additionally marks paginated responses with ldp:Page type.
+    Reuses the number of objects counted by the view, as its container_count.
     """
 
     page_query_param = 'p'
     page_size_query_param = 'limit'
 
+    def paginate_queryset(self, queryset, request, view=None):
+        self.django_paginator_class = partial(CountedPaginator, count=getattr(view, 'container_count', None))
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_page_key(self, request):
+        """
+        Return the key identifying the page in the ETag of the container, before the page is fetched:
+        its requested number, or None if the container isn't paginated.
+        """
+        if self.get_page_size(request) is None:
+            return None
+        return request.query_params.get(self.page_query_param, 1)
+
     def get_paginated_response(self, data):
         """
         Generate paginated response with W3C LDP-compliant Link headers.
@@ -139,3 +190,60 @@ class LDPPagination(PageNumberPagination):
 
         headers = {'Link': ', '.join(links)} if links else {}
         return Response(data, headers=headers)
+
+
+class LDPCursorPagination(CursorPagination):
+    """
+    LDP-compliant keyset (cursor) pagination.
+
+    Pages are selected with a WHERE clause on a stable ordering, instead of the OFFSET of the other paginations,
+    so that the pages of large containers are as fast to fetch at their end as at their start.
+    The ordering defaults to the primary key, and can be set to ('updated_at', 'pk') on subclasses.
+
+    Provides Link headers with proper rel types as per W3C LDP Paging specification:
+    - first: Link to first page
+    - prev: Link to previous page
+    - next: Link to next page
+
+    The last page can't be linked, as it is only known by walking the pages.
+    Additionally marks paginated responses with ldp:Page type.
+    """
+
+    ordering = 'pk'
+    page_size_query_param = 'limit'
+
+    def get_page_key(self, request):
+        """
+        Return the key identifying the page in the ETag of the container, before the page is fetched:
+        the cursor of the request, or None if the container isn't paginated.
+        """
+        if self.get_page_size(request) is None:
+            return None
+        return request.query_params.get(self.cursor_query_param, '')
+
+    def get_paginated_response(self, data):
+        """
+        Generate paginated response with W3C LDP-compliant Link headers.
+
+        Returns:
+            Response: DRF Response with Link headers for pagination navigation
+        """
+        links = []
+
+        # Add first link (without cursor)
+        if self.request:
+            first_url = self.request.build_absolute_uri(self.request.path)
+            links.append('<{}>; rel="first"'.format(first_url))
+
+        previous_url = self.get_previous_link()
+        if previous_url is not None:
+            links.append('<{}>; rel="prev"'.format(previous_url))
+
+        next_url = self.get_next_link()
+        if next_url is not None:
+            links.append('<{}>; rel="next"'.format(next_url))
+
+        # Add ldp:Page type to indicate this is a paginated response
+        links.append('<http://www.w3.org/ns/ldp#Page>; rel="type"')
+
+        return Response(data, headers={'Link': ', '.join(links)})
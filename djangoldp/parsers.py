@@ -8,6 +8,7 @@ Provides parsers for:
 
 import json
 import logging
+import re
 
 from django.conf import settings
 from pyld import jsonld
@@ -15,8 +16,62 @@ from rest_framework.exceptions import ParseError
 from rest_framework.parsers import JSONParser, BaseParser
 from rdflib import Graph
 
+from djangoldp.contexts import GLOBAL_CONTEXT_STORE
+
 logger = logging.getLogger('djangoldp')
 
+# the maximum number of payload shapes for which the parser remembers whether compaction changes them
+MAX_COMPACT_SHAPES = 1000
+_compact_shapes = {}
+_context_iris = {}
+COMPACT_IRI = re.compile(r'^[A-Za-z][\w.-]*:(?!//)\S*$')
+
+
+def get_context_iris(context):
+    '''returns the IRIs of the vocabulary, the terms and the prefixes of a context, to which compaction shortens the
+    IRIs starting with them'''
+    if isinstance(context, str):
+        context = GLOBAL_CONTEXT_STORE.load_document(context)['document'].get('@context', {})
+    if isinstance(context, list):
+        return {iri for item in context for iri in get_context_iris(item)}
+    if not isinstance(context, dict):
+        return set()
+    vocab = context.get('@vocab') or ''
+    iris = {vocab} if vocab else set()
+    for term, definition in context.items():
+        if term.startswith('@'):
+            continue
+        iri = definition.get('@id', vocab + term) if isinstance(definition, dict) else definition
+        if not isinstance(iri, str):
+            continue
+        prefix, _, suffix = iri.partition(':')
+        if suffix and not suffix.startswith('//') and isinstance(context.get(prefix), str):
+            iri = context[prefix] + suffix
+        iris.add(iri)
+    return iris
+
+
+def get_string_shape(value, iris):
+    '''returns what the compaction of a string depends on, if it is an IRI: the IRIs of the context it starts with,
+    which compaction shortens, how it is relative, or the whole compact IRI, which may be replaced by a term'''
+    if COMPACT_IRI.match(value):
+        return ('compact iri', value)
+    return (frozenset(iri for iri in iris if value.startswith(iri)), value in iris, value[:1] in ('/', '#', '?', ''),
+            './' in value, '../' in value)
+
+
+def get_payload_shape(data, iris):
+    '''returns a hashable description of what the compaction of a JSON-LD payload depends on: its keys, the types
+    of its values, the @type values and the shapes of the strings which may be IRIs, leaving out the literals'''
+    if isinstance(data, dict):
+        return tuple(sorted((key, json.dumps(data[key], sort_keys=True) if key in ('@type', '@context')
+                             else get_payload_shape(data[key], iris)) for key in data))
+    if isinstance(data, list):
+        return ('list', min(len(data), 2), frozenset(get_payload_shape(item, iris) for item in data))
+    if isinstance(data, str):
+        return get_string_shape(data, iris)
+    return type(data).__name__
+
 
 class JSONLDParser(JSONParser):
     """
@@ -27,6 +82,11 @@ class JSONLDParser(JSONParser):
     Note: Currently only works with pyld 1.0. We need to check support for newer versions.
     """
     media_type = 'application/ld+json'
+    # skips the compaction of payloads already compacted against the configured context
+    fast_path = getattr(settings, 'LDP_PARSER_FAST_PATH', True)
+    # in strict mode, compaction is only skipped for the shapes of payloads which compaction was seen to leave
+    # unchanged. Otherwise, payloads using the configured context are trusted to be compact
+    strict = getattr(settings, 'LDP_PARSER_STRICT', True)
 
     def parse(self, stream, media_type=None, parser_context=None):
         """
@@ -37,10 +97,40 @@ class JSONLDParser(JSONParser):
         """
         data = super(JSONLDParser, self).parse(stream, media_type, parser_context)
 
+        shape_key = None
+        if self.fast_path and isinstance(data, dict) and self.uses_server_context(data.get('@context')):
+            if not self.strict:
+                return data
+            try:
+                shape_key = self.get_shape_key(data)
+            except jsonld.JsonLdError:
+                # the context can't be loaded, which compaction reports
+                shape_key = None
+            if shape_key is not None and _compact_shapes.get(shape_key):
+                return data
+
         try:
-            return jsonld.compact(data, ctx=settings.LDP_RDF_CONTEXT)
+            compacted = jsonld.compact(data, ctx=settings.LDP_RDF_CONTEXT)
         except jsonld.JsonLdError as e:
             raise ParseError(str(e.cause))
+        if shape_key is not None:
+            if len(_compact_shapes) >= MAX_COMPACT_SHAPES:
+                _compact_shapes.clear()
+                _context_iris.clear()
+            _compact_shapes[shape_key] = compacted == data
+        return compacted
+
+    def uses_server_context(self, context):
+        '''returns True if the @context of the payload is the configured context'''
+        return context == settings.LDP_RDF_CONTEXT or context == [settings.LDP_RDF_CONTEXT]
+
+    def get_shape_key(self, data):
+        '''returns the key under which the parser remembers if compaction leaves payloads like this one unchanged'''
+        context = settings.LDP_RDF_CONTEXT
+        context_key = context if isinstance(context, str) else json.dumps(context, sort_keys=True)
+        if context_key not in _context_iris:
+            _context_iris[context_key] = tuple(get_context_iris(context))
+        return (context_key, get_payload_shape(data, _context_iris[context_key]))
 
 
 class TurtleParser(BaseParser):
@@ -1,16 +1,134 @@
 from copy import copy
 from django.conf import settings
+from django.db.models import Q
 from django.http import Http404
 from rest_framework.permissions import BasePermission, DjangoObjectPermissions, OR, AND
 from rest_framework.filters import BaseFilterBackend
 from rest_framework_guardian.filters import ObjectPermissionsFilter
-from djangoldp.filters import OwnerFilterBackend, NoFilterBackend, PublicFilterBackend, IPFilterBackend, ActiveFilterBackend
+from guardian.backends import check_support
+from guardian.conf import settings as guardian_settings
+from guardian.core import ObjectPermissionChecker
+from guardian.shortcuts import get_objects_for_user
+from guardian.utils import get_user_obj_perms_model
+from djangoldp.filters import OwnerFilterBackend, NoFilterBackend, PublicFilterBackend, IPFilterBackend, ActiveFilterBackend, \
+    lookup_q, match_all, match_none
 from djangoldp.utils import is_anonymous_user, is_authenticated_user, check_client_ip
 
 
 DEFAULT_DJANGOLDP_PERMISSIONS = {'view', 'add', 'change', 'delete', 'control'}
 DEFAULT_RESOURCE_PERMISSIONS = {'view', 'change', 'delete', 'control'}
 DEFAULT_CONTAINER_PERMISSIONS = {'view', 'add'}
+# filter backends which keep the same objects for every user
+PUBLIC_FILTER_BACKENDS = (None, NoFilterBackend, PublicFilterBackend, ActiveFilterBackend)
+
+class PermissionMemo:
+    '''memoizes the evaluations of the permission classes during a request, counting the evaluations it saves'''
+    def __init__(self) -> None:
+        self.values = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, compute):
+        '''returns the value memoized for the key, computing it on the first call'''
+        if key in self.values:
+            self.hits += 1
+            return self.values[key]
+        self.misses += 1
+        value = self.values[key] = compute()
+        return value
+
+    def clear(self) -> None:
+        '''forgets the memoized values, e.g. after the request changed the objects they were computed on'''
+        self.values.clear()
+
+    def stats(self) -> dict:
+        return {'hits': self.hits, 'misses': self.misses, 'entries': len(self.values)}
+
+def attach_permission_memo(request, memo=None) -> PermissionMemo:
+    '''attaches a new memo, or the given one, to the request and to its user, as the permission classes are only given
+    the user'''
+    if memo is None:
+        memo = PermissionMemo()
+    request.permission_memo = memo
+    request.user.permission_memo = memo
+    return memo
+
+def detach_permission_memo(request) -> PermissionMemo:
+    '''detaches the memo from the request and its user at the end of the request, returning it'''
+    memo = getattr(request, 'permission_memo', None)
+    request.permission_memo = None
+    if getattr(request.user, 'permission_memo', None) is memo:
+        request.user.permission_memo = None
+    return memo
+
+def get_permission_memo(request_or_user) -> PermissionMemo:
+    '''returns the memo of the current request, None outside of requests'''
+    return getattr(request_or_user, 'permission_memo', None)
+
+def get_permission_key(permission) -> tuple:
+    '''returns a key identifying a permission class, or a combination of permission classes with OR and AND'''
+    if isinstance(permission, (OR, AND)):
+        return (type(permission), get_permission_key(permission.op1), get_permission_key(permission.op2))
+    return (type(permission),)
+
+def get_memo_permissions(permission, user, model, obj=None) -> set:
+    '''returns the permissions given by a permission class to the user, memoized during the request'''
+    memo = get_permission_memo(user)
+    if memo is None or (obj is not None and obj.pk is None):
+        return permission.get_permissions(user, model, obj)
+    key = ('permissions', get_permission_key(permission), model, obj.pk if obj is not None else None)
+    return memo.get(key, lambda: permission.get_permissions(user, model, obj))
+
+def get_user_cache_vary(user) -> str:
+    '''returns the cache vary key of representations private to the user'''
+    return f'user:{user.pk}'
+
+def get_op_cache_vary(op, request, model) -> str:
+    '''returns the cache vary key of an operand of OR and AND, varying on the user if it isn't a LDP permission'''
+    if hasattr(op, 'get_cache_vary'):
+        return op.get_cache_vary(request, model)
+    return get_user_cache_vary(request.user)
+
+def get_op_batch_permissions(op, user, model, objs) -> dict:
+    '''returns the {pk: permissions} of an operand of OR and AND, computed one by one if it has no batch method'''
+    if hasattr(op, 'get_batch_permissions'):
+        return op.get_batch_permissions(user, model, objs)
+    if hasattr(op, 'get_permissions'):
+        return {obj.pk: op.get_permissions(user, model, obj) for obj in objs}
+    return {obj.pk: set() for obj in objs}
+
+def get_batch_permissions(permission_classes, user, model, objs) -> dict:
+    '''returns the {pk: permissions} given by all permission classes to the user on each object, in a constant number of
+    queries for the classes supporting it'''
+    batches = [get_op_batch_permissions(permission(), user, model, objs) for permission in permission_classes]
+    if not batches:
+        return {obj.pk: set() for obj in objs}
+    return {obj.pk: set.intersection(*[batch[obj.pk] for batch in batches]) for obj in objs}
+
+def get_op_filter_q(op, request, model) -> Q:
+    '''returns the compiled filter of an operand of OR and AND, None if it doesn't filter the objects and NotImplemented
+    if it has a filter backend which can't be compiled'''
+    if hasattr(op, 'get_filter_q'):
+        return op.get_filter_q(request, model)
+    return NotImplemented if hasattr(op, 'get_filter_backend') else None
+
+def get_permissions_filter_q(permission_classes, request, model) -> Q:
+    '''returns a single Q object applying the filter backends of all permission classes, to filter a queryset in one
+    query without duplicates. Returns None if one of the filter backends can't be compiled'''
+    def compile_filter_q():
+        q = None
+        for permission in permission_classes:
+            permission_q = get_op_filter_q(permission(), request, model)
+            if permission_q is NotImplemented:
+                return None
+            if permission_q is not None:
+                q = permission_q if q is None else q & permission_q
+        return match_all() if q is None else q
+    memo = get_permission_memo(request)
+    if memo is None:
+        return compile_filter_q()
+    return memo.get(('filter_q', model, tuple(get_permission_key(permission()) for permission in permission_classes)),
+                    compile_filter_q)
 
 def join_filter_backends(*permissions_or_filters:BaseFilterBackend|BasePermission, model:object, union:bool=False) -> BaseFilterBackend:
     '''Creates a new Filter backend by joining a list of existing backends.
@@ -52,23 +170,56 @@ permission_map ={
 
 # Patch of OR and AND classes to enable chaining of LDPBasePermission
 def OR_get_permissions(self, user, model, obj=None):
-    perms1 = self.op1.get_permissions(user, model, obj) if hasattr(self.op1, 'get_permissions') else set()
-    perms2 = self.op2.get_permissions(user, model, obj) if hasattr(self.op2, 'get_permissions') else set()
+    perms1 = get_memo_permissions(self.op1, user, model, obj) if hasattr(self.op1, 'get_permissions') else set()
+    perms2 = get_memo_permissions(self.op2, user, model, obj) if hasattr(self.op2, 'get_permissions') else set()
     return set.union(perms1, perms2)    
 OR.get_permissions = OR_get_permissions
 def OR_get_filter_backend(self, model):
     return join_filter_backends(self.op1, self.op2, model=model, union=True)
 OR.get_filter_backend = OR_get_filter_backend
+def OR_get_cache_vary(self, request, model):
+    return f"({get_op_cache_vary(self.op1, request, model)}|{get_op_cache_vary(self.op2, request, model)})"
+OR.get_cache_vary = OR_get_cache_vary
+def OR_get_batch_permissions(self, user, model, objs):
+    perms1 = get_op_batch_permissions(self.op1, user, model, objs)
+    perms2 = get_op_batch_permissions(self.op2, user, model, objs)
+    return {obj.pk: set.union(perms1[obj.pk], perms2[obj.pk]) for obj in objs}
+OR.get_batch_permissions = OR_get_batch_permissions
+def OR_get_filter_q(self, request, model):
+    q1 = get_op_filter_q(self.op1, request, model)
+    q2 = get_op_filter_q(self.op2, request, model)
+    if q1 is NotImplemented or q2 is NotImplemented:
+        return NotImplemented
+    # as in the joint filter backend, the operands which don't filter add no object to the union
+    return (match_none() if q1 is None else q1) | (match_none() if q2 is None else q2)
+OR.get_filter_q = OR_get_filter_q
 OR.__repr__ = lambda self: f"{self.op1}|{self.op2}"
 
 def AND_get_permissions(self, user, model, obj=None):
-    perms1 = self.op1.get_permissions(user, model, obj) if hasattr(self.op1, 'get_permissions') else set()
-    perms2 = self.op2.get_permissions(user, model, obj) if hasattr(self.op2, 'get_permissions') else set()
+    perms1 = get_memo_permissions(self.op1, user, model, obj) if hasattr(self.op1, 'get_permissions') else set()
+    perms2 = get_memo_permissions(self.op2, user, model, obj) if hasattr(self.op2, 'get_permissions') else set()
     return set.intersection(perms1, perms2)    
 AND.get_permissions = AND_get_permissions
 def AND_get_filter_backend(self, model):
     return join_filter_backends(self.op1, self.op2, model=model, union=False)
 AND.get_filter_backend = AND_get_filter_backend
+def AND_get_cache_vary(self, request, model):
+    return f"({get_op_cache_vary(self.op1, request, model)}&{get_op_cache_vary(self.op2, request, model)})"
+AND.get_cache_vary = AND_get_cache_vary
+def AND_get_batch_permissions(self, user, model, objs):
+    perms1 = get_op_batch_permissions(self.op1, user, model, objs)
+    perms2 = get_op_batch_permissions(self.op2, user, model, objs)
+    return {obj.pk: set.intersection(perms1[obj.pk], perms2[obj.pk]) for obj in objs}
+AND.get_batch_permissions = AND_get_batch_permissions
+def AND_get_filter_q(self, request, model):
+    q1 = get_op_filter_q(self.op1, request, model)
+    q2 = get_op_filter_q(self.op2, request, model)
+    if q1 is NotImplemented or q2 is NotImplemented:
+        return NotImplemented
+    if q1 is None or q2 is None:
+        return q2 if q1 is None else q1
+    return q1 & q2
+AND.get_filter_q = AND_get_filter_q
 AND.__repr__ = lambda self: f"{self.op1}&{self.op2}"
 
 class LDPBasePermission(BasePermission):
@@ -104,6 +255,25 @@ class LDPBasePermission(BasePermission):
     def get_permissions(self, user, model, obj=None):
         '''returns the permissions the user has on a given model or on a given object'''
         return self.permissions.intersection(DEFAULT_RESOURCE_PERMISSIONS if obj else DEFAULT_CONTAINER_PERMISSIONS)
+    def get_batch_permissions(self, user, model, objs):
+        '''returns the {pk: permissions} the user has on each of the objects, to override for fewer queries'''
+        return {obj.pk: self.get_permissions(user, model, obj) for obj in objs}
+    def get_filter_q(self, request, model):
+        '''returns the filter backend of the class compiled into a Q object, None if the class doesn't filter the objects
+        and NotImplemented if its filter backend can't be compiled'''
+        backend = self.get_filter_backend(model)
+        if backend is None:
+            return None
+        if hasattr(backend, 'get_filter_q'):
+            return backend().get_filter_q(request, model)
+        return NotImplemented
+    def get_cache_vary(self, request, model):
+        '''returns the key on which the permissions and the filtered objects vary, for caching their representations.
+        Classes keeping the default permissions and a public filter backend give the same ones to everyone'''
+        if type(self).get_permissions is LDPBasePermission.get_permissions and \
+                self.get_filter_backend(model) in PUBLIC_FILTER_BACKENDS:
+            return 'public'
+        return get_user_cache_vary(request.user)
 
 class AnonymousReadOnly(LDPBasePermission):
     """Anonymous users can only view, no check for others"""
@@ -115,6 +285,8 @@ class AnonymousReadOnly(LDPBasePermission):
             return self.permissions
         else:
             return super().permissions #all permissions
+    def get_cache_vary(self, request, model):
+        return 'anonymous' if is_anonymous_user(request.user) else 'authenticated'
 
 class AuthenticatedOnly(LDPBasePermission):
     """Only authenticated users have permissions"""
@@ -151,10 +323,54 @@ class ACLPermissions(DjangoObjectPermissions, LDPBasePermission):
         permissions = set(filter(lambda perm: perm.startswith(app_label) and perm.endswith(model_name), user.get_all_permissions()))
         return {perm.replace(app_label+'.', '').replace('_'+model_name, '') for perm in permissions}
 
+    def get_batch_permissions(self, user, model, objs):
+        '''prefetches the object permissions of the user on all the objects, in two queries'''
+        if not objs or guardian_settings.AUTO_PREFETCH:
+            # with auto-prefetching, guardian already loads all the object permissions of the user at once
+            return super().get_batch_permissions(user, model, objs)
+        model_name = model._meta.model_name
+        supported, user = check_support(user, objs[0])
+        if not supported:
+            return {obj.pk: set() for obj in objs}
+        checker = ObjectPermissionChecker(user)
+        checker.prefetch_perms(objs)
+        return {obj.pk: {perm.replace('_'+model_name, '') for perm in checker.get_perms(obj)} for obj in objs}
+
+    def get_filter_q(self, request, model):
+        '''selects the objects on which the user has the view permission, in a subquery on the object permissions'''
+        if self.get_filter_backend(model) is not ObjectPermissionsFilter:
+            return super().get_filter_q(request, model)
+        if request.user.is_superuser:
+            return match_all()
+        permission = ObjectPermissionsFilter.perm_format % {'app_label': model._meta.app_label,
+                                                            'model_name': model._meta.model_name}
+        allowed = get_objects_for_user(request.user, permission, model._base_manager.all(),
+                                       **ObjectPermissionsFilter.shortcut_kwargs)
+        return Q(pk__in=allowed.values('pk'))
+
+    def get_cache_vary(self, request, model):
+        '''users without permissions of their own get them from their groups, and share the same key'''
+        user = request.user
+        if is_anonymous_user(user):
+            return 'anonymous'
+        if not hasattr(user, '_acl_cache_vary'):
+            if not user.is_active or user.user_permissions.exists() or \
+                    get_user_obj_perms_model().objects.filter(user=user).exists():
+                user._acl_cache_vary = get_user_cache_vary(user)
+            else:
+                groups = user.groups.order_by('pk').values_list('pk', flat=True)
+                user._acl_cache_vary = 'groups:' + ','.join(str(pk) for pk in groups)
+        return user._acl_cache_vary
+
 class OwnerPermissions(LDPBasePermission):
     """Gives all permissions to the owner of the object"""
     filter_backend = OwnerFilterBackend
     def check_permission(self, user, model, obj):
+        memo = get_permission_memo(user)
+        if memo is None or obj is None or obj.pk is None:
+            return self.check_ownership(user, model, obj)
+        return memo.get(('owner', model, obj.pk), lambda: self.check_ownership(user, model, obj))
+    def check_ownership(self, user, model, obj):
         if user.is_superuser:
             return True
         if getattr(model._meta, 'owner_field', None):
@@ -173,6 +389,20 @@ class OwnerPermissions(LDPBasePermission):
         if not obj or self.check_permission(user, model, obj):
             return self.permissions
         return set()
+    def get_batch_permissions(self, user, model, objs):
+        '''checks the ownership of all the objects in a single query'''
+        owner_field = getattr(model._meta, 'owner_field', None)
+        if not owner_field or user.is_superuser:
+            return super().get_batch_permissions(user, model, objs)
+        owned = set()
+        if user.pk is not None:
+            owned = set(model.objects.filter(pk__in=[obj.pk for obj in objs], **{owner_field: user})
+                        .values_list('pk', flat=True))
+        return {obj.pk: self.permissions if obj.pk in owned else set() for obj in objs}
+    def get_cache_vary(self, request, model):
+        if any(getattr(model._meta, field, None) for field in ('owner_field', 'owner_urlid_field', 'auto_author')):
+            return get_user_cache_vary(request.user)
+        return 'anonymous' if is_anonymous_user(request.user) else 'authenticated'
 
 class OwnerCreatePermission(LDPBasePermission):
     '''only accepts the creation of new resources if the owner of the created resource is the user of the request'''
@@ -234,6 +464,9 @@ class JoinMembersPermission(LDPBasePermission):
     def get_permissions(self, user, model, obj=None):
         return set()
 
+    def get_cache_vary(self, request, model):
+        return 'public'
+
 
 class IPOpenPermissions(LDPBasePermission):
     filter_backend = IPFilterBackend
@@ -247,6 +480,9 @@ class IPOpenPermissions(LDPBasePermission):
         #Will always say there is no migrations, not taking the IP into accounts
         return set()
 
+    def get_cache_vary(self, request, model):
+        return 'open-ip' if check_client_ip(request) else 'closed-ip'
+
 
 class InheritPermissions(LDPBasePermission):
     """Gets the permissions from a related objects"""
@@ -363,8 +599,51 @@ class InheritPermissions(LDPBasePermission):
             parent_model = InheritPermissions.get_parent_model(model, field)
             for parent_object in self.get_parent_objects(obj, field):
                 parents.append(parent_object)
-                perms = perms.union(set.intersection(*[perm().get_permissions(user, parent_model, parent_object) 
+                perms = perms.union(set.intersection(*[get_memo_permissions(perm(), user, parent_model, parent_object)
                                                for perm in parent_model._meta.permission_classes]))
         if parents:
             return perms
-        return super().get_permissions(user, model, obj)
\ No newline at end of file
+        return super().get_permissions(user, model, obj)
+
+    def get_batch_permissions(self, user:object, model:object, objs:list) -> dict:
+        '''returns a union of the permissions on the parents of each object, fetching the parents of all objects at once'''
+        perms = {obj.pk: set() for obj in objs}
+        inheriting = set()
+        for field in InheritPermissions.get_parent_fields(model):
+            parent_model = InheritPermissions.get_parent_model(model, field)
+            links = [(pk, parent_pk) for pk, parent_pk in
+                     model.objects.filter(pk__in=list(perms)).values_list('pk', f'{field}__pk') if parent_pk is not None]
+            parents = list(parent_model.objects.in_bulk({parent_pk for _, parent_pk in links}).values())
+            parent_perms = get_batch_permissions(parent_model._meta.permission_classes, user, parent_model, parents)
+            for pk, parent_pk in links:
+                inheriting.add(pk)
+                perms[pk] = perms[pk].union(parent_perms.get(parent_pk, set()))
+        for obj in objs:
+            if obj.pk not in inheriting:
+                perms[obj.pk] = super().get_permissions(user, model, obj)
+        return perms
+
+    def get_filter_q(self, request:object, model:object) -> Q:
+        '''selects the objects whose parents are allowed by the compiled filters of the parent models, or which have
+        no parent, without cloning the request and view for each parent'''
+        if type(self).get_filter_backend.__func__ is not InheritPermissions.get_filter_backend.__func__:
+            return super().get_filter_q(request, model)
+        fields = InheritPermissions.get_parent_fields(model)
+        q = lookup_q(model, **{field: None for field in fields})
+        for field in fields:
+            parent_model = InheritPermissions.get_parent_model(model, field)
+            parent_q = get_permissions_filter_q(parent_model._meta.permission_classes, request, parent_model)
+            if parent_q is None:
+                return NotImplemented
+            allowed_parents = parent_model._base_manager.filter(parent_q).values('pk')
+            q |= lookup_q(model, **{f'{field}__in': allowed_parents})
+        return q
+
+    def get_cache_vary(self, request:object, model:object) -> str:
+        '''returns the keys of the permissions of all parent models'''
+        varies = []
+        for field in InheritPermissions.get_parent_fields(model):
+            parent_model = InheritPermissions.get_parent_model(model, field)
+            varies.extend(get_op_cache_vary(perm(), request, parent_model)
+                          for perm in parent_model._meta.permission_classes)
+        return f"inherit({','.join(varies)})"
\ No newline at end of file
@@ -1,3 +1,6 @@
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import Prefetch
+from rest_framework.serializers import BaseSerializer
 from rest_framework.utils import model_meta
 
 
@@ -43,3 +46,90 @@ def get_prefetch_fields(model, serializer, depth, prepend_string=''):
                 fields = fields.union(get_prefetch_fields(relation_info.related_model, serializer, depth - 1, new_prepend_str))
 
     return fields
+
+
+class QueryPlan:
+    '''
+    The lookups loading the relations serialized with the objects of a queryset: the to-one relations are joined in its
+    query (select_related), and the to-many relations are prefetched (prefetch_related) with Prefetch objects.
+    The querysets of the nested containers serialized as links have the permissions of their model applied, and only
+    load the columns used by the links
+    '''
+    def __init__(self):
+        self.select_related = set()
+        self.prefetch_related = []
+        # the (model, field name) of the relations prefetched with the permissions of their related model applied
+        self.filtered_relations = set()
+
+    def apply(self, queryset):
+        if self.select_related:
+            queryset = queryset.select_related(*sorted(self.select_related))
+        return queryset.prefetch_related(*self.prefetch_related)
+
+    def get_lookups(self):
+        '''returns all the lookups of the plan, to be given to prefetch_related_objects on instances already fetched'''
+        return sorted(self.select_related) + self.prefetch_related
+
+    def is_filtered(self, model, field_name):
+        return (model, field_name) in self.filtered_relations
+
+
+def get_link_fields(model):
+    '''returns the fields loaded on the objects of a container serialized as links: their id, and the fields deciding
+    which containers they belong to, which are used to cache and filter them'''
+    from djangoldp.models import Model
+    from djangoldp.serializers.cache import get_membership_fields
+
+    names = {model._meta.pk.attname, *get_membership_fields(model)}
+    for name in ('urlid', Model.slug_field(model)):
+        try:
+            names.add(model._meta.get_field(name).attname)
+        except FieldDoesNotExist:
+            pass
+    return sorted(names)
+
+
+def get_query_plan(model, serializer, depth, filter_queryset=None):
+    '''
+    Builds the QueryPlan of a model, with the same relations as get_prefetch_fields
+    :param model: the model to be analysed
+    :param serializer: an LDPSerializer instance. Used to extract the fields for each nested model
+    :param depth: the depth at which to stop the recursion (should be set to the configured depth of the ViewSet)
+    :param filter_queryset: an optional function(queryset, model) applying the permissions of the model to a queryset,
+    to filter the prefetched objects of nested containers in their query
+    :return: a QueryPlan
+    '''
+    plan = QueryPlan()
+    serializer_fields = set(serializer.get_fields())
+    empty_containers = getattr(model._meta, 'empty_containers', [])
+    # the relations read on each object by the permissions, to its owner or to the parents it inherits permissions from
+    permission_fields = {getattr(model._meta, 'owner_field', None), *getattr(model._meta, 'inherit_permissions', [])}
+
+    for field_name, relation_info in model_meta.get_field_info(model).relations.items():
+        # serialized foreign keys, and one-to-one relations both ways, are joined
+        if not relation_info.to_many:
+            if field_name in serializer_fields or field_name in permission_fields:
+                plan.select_related.add(field_name)
+            continue
+
+        if field_name not in serializer_fields or field_name in empty_containers:
+            continue
+        related_model = relation_info.related_model
+        queryset = related_model._default_manager.all()
+        if depth > 0:
+            # the nested objects are serialized with their own relations, by the child of the nested serializer
+            nested_serializer = getattr(serializer.fields.get(field_name), 'child', None)
+            if not isinstance(nested_serializer, BaseSerializer):
+                nested_serializer = serializer
+            nested_plan = get_query_plan(related_model, nested_serializer, depth - 1, filter_queryset)
+            plan.filtered_relations.update(nested_plan.filtered_relations)
+            queryset = nested_plan.apply(queryset)
+        else:
+            # the nested objects are only serialized as links, in a container whose objects are filtered by permissions
+            queryset = queryset.only(*get_link_fields(related_model))
+            if filter_queryset is not None:
+                queryset = filter_queryset(queryset, related_model)
+                plan.filtered_relations.add((model, field_name))
+        plan.prefetch_related.append(Prefetch(field_name, queryset=queryset))
+
+    return plan
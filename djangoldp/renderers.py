@@ -8,6 +8,8 @@ Provides renderers for:
 
 import json
 import logging
+import math
+import re
 from collections import OrderedDict
 
 from django.conf import settings
@@ -16,8 +18,60 @@ from rest_framework.renderers import JSONRenderer, BaseRenderer
 from rdflib import Graph, Namespace, URIRef, Literal
 from rdflib.namespace import RDF, RDFS
 
+from djangoldp.contexts import GLOBAL_CONTEXT_STORE
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
 logger = logging.getLogger('djangoldp')
 
+# the maximum number of contexts whose terms the Turtle writer keeps resolved
+MAX_TURTLE_CONTEXTS = 100
+_turtle_contexts = {}
+
+XSD_DOUBLE = 'http://www.w3.org/2001/XMLSchema#double'
+RDF_TYPE = 'http://www.w3.org/1999/02/22-rdf-syntax-ns#type'
+PREFIX_NAME = re.compile(r'^[A-Za-z]([\w.-]*[\w-])?$', re.ASCII)
+LOCAL_NAME = re.compile(r'^[A-Za-z0-9_]([\w.-]*[\w-])?$', re.ASCII)
+LANGUAGE_TAG = re.compile(r'^[A-Za-z]+(-[A-Za-z0-9]+)*$')
+NAMESPACE = re.compile(r'^(.*[:/?#\[\]@])(.*)$', re.S)
+UNSAFE_IRI = re.compile(r'[\x00-\x20<>"{}|^`\\]')
+STRING_ESCAPES = str.maketrans({'\\': '\\\\', '"': '\\"', '\n': '\\n', '\r': '\\r'})
+
+
+def orjson_dumps(data, default):
+    # with OPT_UTC_Z, the dates are formatted like by the encoder of DRF
+    return orjson.dumps(data, default=default, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_UTC_Z)
+
+
+def ujson_dumps(data, default):
+    return ujson.dumps(data, ensure_ascii=False, escape_forward_slashes=False, default=default).encode()
+
+
+# the encoders which can be set in LDP_JSON_ENCODER, None if their library isn't installed
+JSON_ENCODERS = {
+    'orjson': orjson_dumps if orjson is not None else None,
+    'ujson': ujson_dumps if ujson is not None else None,
+}
+
+
+def merge_rdf_context(context):
+    """
+    Merges the LDP_RDF_CONTEXT from settings with the @context of the data.
+    """
+    if isinstance(context, list):
+        return [settings.LDP_RDF_CONTEXT] + context
+    elif isinstance(context, str) or isinstance(context, dict):
+        return [settings.LDP_RDF_CONTEXT, context]
+    return settings.LDP_RDF_CONTEXT
+
 
 class JSONLDRenderer(JSONRenderer):
     """
@@ -26,30 +80,310 @@ class JSONLDRenderer(JSONRenderer):
     Uses pyld library for JSON-LD processing: https://github.com/digitalbazaar/pyld
     """
     media_type = 'application/ld+json'
+    json_encoder = getattr(settings, 'LDP_JSON_ENCODER', None)
+
+    def get_dumps(self):
+        """
+        Return the function encoding data with the configured JSON encoder, or None to use the one of DRF.
+
+        The encoder falls back to DRF's when its library isn't installed, or when the output must be ASCII.
+        """
+        if self.json_encoder is None or self.ensure_ascii:
+            return None
+        if self.json_encoder not in JSON_ENCODERS:
+            logger.warning(f"Unknown LDP_JSON_ENCODER {self.json_encoder}, using the JSON encoder of DRF")
+            return None
+        return JSON_ENCODERS[self.json_encoder]
+
+    def dumps(self, data, accepted_media_type=None, renderer_context=None):
+        """
+        Render data into JSON, with the configured JSON encoder unless the output is indented.
+        """
+        dumps = self.get_dumps()
+        if dumps is None or data is None or self.get_indent(accepted_media_type, renderer_context or {}) is not None:
+            return super(JSONLDRenderer, self).render(data, accepted_media_type, renderer_context)
+        ret = dumps(data, self.encoder_class().default)
+        # like DRF, escape these characters to output JSON that is a strict javascript subset
+        return ret.replace('\u2028'.encode(), b'\\u2028').replace('\u2029'.encode(), b'\\u2029')
 
     def render(self, data, accepted_media_type=None, renderer_context=None):
         """
         Render data to JSON-LD by ensuring proper @context.
 
         Merges the LDP_RDF_CONTEXT from settings with any existing @context in the data.
+        The @context is written first, without copying the data unless it has its own @context.
         """
-        if isinstance(data, dict):
-            context = data.get("@context")
-            if isinstance(context, list):
-                context_value = [settings.LDP_RDF_CONTEXT] + context
-            elif isinstance(context, str) or isinstance(context, dict):
-                context_value = [settings.LDP_RDF_CONTEXT, context]
-            else:
-                context_value = settings.LDP_RDF_CONTEXT
+        if not isinstance(data, dict):
+            return self.dumps(data, accepted_media_type, renderer_context)
 
+        context = merge_rdf_context(data.get("@context"))
+        if self.get_indent(accepted_media_type, renderer_context or {}) is not None:
             ordered_data = OrderedDict()
-            ordered_data["@context"] = context_value
+            ordered_data["@context"] = context
             for key, value in data.items():
                 if key != "@context":
                     ordered_data[key] = value
-            data = ordered_data
+            return self.dumps(ordered_data, accepted_media_type, renderer_context)
+
+        if "@context" in data:
+            data = {key: value for key, value in data.items() if key != "@context"}
+        head = b'{"@context":' if self.compact else b'{"@context": '
+        head += self.dumps(context, accepted_media_type, renderer_context)
+        body = self.dumps(data, accepted_media_type, renderer_context)
+        if body == b'{}':
+            return head + b'}'
+        return head + (b',' if self.compact else b', ') + body[1:]
+
+    def render_stream(self, container, members, accepted_media_type=None, renderer_context=None):
+        """
+        Render a container to JSON-LD in chunks: the container with its @context first, then each of its members in
+        ldp:contains, as they are serialized.
+        """
+        head = self.render(container, accepted_media_type, renderer_context).rstrip()
+        yield head[:-1] + b',"ldp:contains":['
+        for index, member in enumerate(members):
+            member = self.dumps(member, accepted_media_type, renderer_context)
+            yield b',' + member if index else member
+        yield b']}'
+
+
+class UnsupportedJsonLd(Exception):
+    """
+    Raised by the TurtleWriter on the JSON-LD features it leaves to rdflib.
+    """
+
+
+class TurtleWriter:
+    """
+    Writes the triples of compact JSON-LD data to Turtle, walking the data without building an RDF graph.
+
+    The terms of a context are resolved once and shared by the writers using it. The writer only handles the JSON-LD
+    features used by the serializers, and raises UnsupportedJsonLd on any other, for the data to be rendered through
+    rdflib instead.
+    """
+
+    def __init__(self, context):
+        # the context is resolved again when the documents of the context store change
+        key = json.dumps(context, sort_keys=True)
+        resolved = _turtle_contexts.get((key, GLOBAL_CONTEXT_STORE.version))
+        if resolved is None:
+            resolved = self.resolve_context(context)
+            if len(_turtle_contexts) >= MAX_TURTLE_CONTEXTS:
+                _turtle_contexts.clear()
+            # once the documents it references are loaded
+            _turtle_contexts[(key, GLOBAL_CONTEXT_STORE.version)] = resolved
+        self.processor, self.active_context, self.terms, self.prefixes = resolved
+        self.iris = {}
+        self.blank_nodes = {}
+        self.count = 0
+
+    @staticmethod
+    def resolve_context(context):
+        """
+        Processes the context, and maps the namespaces of its prefixes to their names.
+        """
+        processor = jsonld.JsonLdProcessor()
+        options = {'base': '', 'documentLoader': GLOBAL_CONTEXT_STORE}
+        active_context = processor.process_context(processor._get_initial_context(options), context, options)
+        if '@language' in active_context:
+            raise UnsupportedJsonLd('default language')
+        prefixes = {}
+        for term, mapping in active_context['mappings'].items():
+            if (mapping and mapping.get('_prefix') and not mapping['reverse'] and PREFIX_NAME.match(term)
+                    and not UNSAFE_IRI.search(mapping['@id'])):
+                prefixes.setdefault(mapping['@id'], term)
+        # the vocabulary is written with the empty prefix
+        vocab = active_context.get('@vocab')
+        if vocab and vocab[-1] in ':/?#[]@' and not UNSAFE_IRI.search(vocab):
+            prefixes.setdefault(vocab, '')
+        return processor, active_context, {}, prefixes
+
+    def get_term(self, key):
+        """
+        Returns the IRI of a property and the type its values are coerced to, or None if the property is dropped.
+        """
+        if key not in self.terms:
+            mapping = self.active_context['mappings'].get(key)
+            if mapping:
+                if (mapping['reverse'] or mapping.get('@container') not in (None, '@set', ['@set'])
+                        or '@language' in mapping or mapping['@id'].startswith(('@', '_:'))):
+                    raise UnsupportedJsonLd(key)
+                self.terms[key] = (mapping['@id'], mapping.get('@type'))
+            else:
+                iri = self.processor._expand_iri(self.active_context, key, vocab=True)
+                if iri and iri.startswith('_:'):
+                    raise UnsupportedJsonLd(key)
+                self.terms[key] = (iri, None) if iri and ':' in iri else None
+        return self.terms[key]
+
+    def get_iri(self, value, vocab=False):
+        """
+        Expands an @id, or an @type with vocab, into an absolute IRI.
+        """
+        iri = self.processor._expand_iri(self.active_context, value, base=not vocab, vocab=vocab)
+        if not isinstance(iri, str) or ':' not in iri:
+            raise UnsupportedJsonLd(value)
+        return iri
+
+    def get_blank_node(self, label=None):
+        """
+        Returns a new blank node, or the one relabelled from a blank node identifier of the data.
+        """
+        node = self.blank_nodes.get(label)
+        if node is None:
+            node = f'_:b{len(self.blank_nodes)}'
+            self.blank_nodes[label if label is not None else object()] = node
+        return node
+
+    def format_iri(self, iri):
+        """
+        Returns the prefixed name of an IRI, or the IRI itself if no prefix applies.
+        """
+        if iri.startswith('_:'):
+            return self.get_blank_node(iri)
+        if iri not in self.iris:
+            if UNSAFE_IRI.search(iri):
+                raise UnsupportedJsonLd(iri)
+            match = NAMESPACE.match(iri)
+            prefix = self.prefixes.get(match.group(1)) if match else None
+            if prefix is not None and LOCAL_NAME.match(match.group(2)):
+                self.iris[iri] = f'{prefix}:{match.group(2)}'
+            else:
+                self.iris[iri] = f'<{iri}>'
+        return self.iris[iri]
+
+    def format_literal(self, value, datatype=None, language=None):
+        if isinstance(value, bool):
+            return 'true' if value else 'false'
+        if isinstance(value, int):
+            return str(value)
+        if isinstance(value, float):
+            if not math.isfinite(value):
+                raise UnsupportedJsonLd(value)
+            return f'"{value!r}"^^{self.format_iri(XSD_DOUBLE)}'
+        literal = f'"{value.translate(STRING_ESCAPES)}"'
+        if language:
+            if not LANGUAGE_TAG.match(language):
+                raise UnsupportedJsonLd(language)
+            return f'{literal}@{language}'
+        if datatype:
+            return f'{literal}^^{self.format_iri(datatype)}'
+        return literal
+
+    def get_value(self, value):
+        """
+        Returns the literal of a value object.
+        """
+        if not set(value).issubset({'@value', '@type', '@language', '@index'}) or (
+                '@type' in value and '@language' in value):
+            raise UnsupportedJsonLd(value)
+        literal = value['@value']
+        if literal is None:
+            return None
+        if '@type' in value or '@language' in value:
+            if not isinstance(literal, str) or not isinstance(value.get('@language', ''), str):
+                raise UnsupportedJsonLd(value)
+            datatype = self.get_iri(value['@type'], vocab=True) if '@type' in value else None
+            return self.format_literal(literal, datatype, value.get('@language'))
+        if not isinstance(literal, (str, bool, int, float)):
+            raise UnsupportedJsonLd(value)
+        return self.format_literal(literal)
+
+    def get_subject(self, node, nodes):
+        """
+        Returns the subject of a node, queuing the node in nodes if it has properties to write.
+        """
+        if '@id' in node:
+            subject = self.format_iri(self.get_iri(node['@id']))
+        elif node:
+            subject = self.get_blank_node()
+        else:
+            raise UnsupportedJsonLd('empty node')
+        if any(key != '@id' for key in node):
+            nodes.append((subject, node))
+        return subject
+
+    def get_objects(self, value, coercion, nodes):
+        """
+        Yields the objects of the values of a property, queuing the nested nodes in nodes.
+        """
+        if value is None:
+            return
+        if isinstance(value, list):
+            for item in value:
+                if isinstance(item, list):
+                    raise UnsupportedJsonLd('list of lists')
+                yield from self.get_objects(item, coercion, nodes)
+        elif isinstance(value, dict):
+            if '@value' in value:
+                literal = self.get_value(value)
+                if literal is not None:
+                    yield literal
+            elif '@set' in value and len(value) == 1:
+                yield from self.get_objects(value['@set'], coercion, nodes)
+            elif any(key.startswith('@') and key not in ('@id', '@type') for key in value):
+                raise UnsupportedJsonLd(value)
+            else:
+                yield self.get_subject(value, nodes)
+        elif isinstance(value, str):
+            if coercion in ('@id', '@vocab'):
+                yield self.format_iri(self.get_iri(value, vocab=coercion == '@vocab'))
+            else:
+                yield self.format_literal(value, coercion)
+        elif coercion is None and isinstance(value, (bool, int, float)):
+            yield self.format_literal(value)
+        else:
+            raise UnsupportedJsonLd(value)
+
+    def write_node(self, subject, node, nodes):
+        """
+        Returns the Turtle description of a node, queuing its nested nodes in nodes.
+        """
+        predicates = []
+        for key, value in node.items():
+            if key == '@id':
+                continue
+            if key == '@type':
+                predicate = 'a'
+                objects = [self.format_iri(self.get_iri(rdf_type, vocab=True))
+                           for rdf_type in (value if isinstance(value, list) else [value])]
+            elif key.startswith('@'):
+                raise UnsupportedJsonLd(key)
+            else:
+                term = self.get_term(key)
+                if term is None:
+                    continue
+                predicate = self.format_iri(term[0])
+                objects = list(self.get_objects(value, term[1], nodes))
+            if objects:
+                self.count += len(objects)
+                predicates.append(f'{predicate} {", ".join(objects)}')
+        if not predicates:
+            return ''
+        return f'{subject} ' + ' ;\n    '.join(predicates) + ' .\n\n'
+
+    def write(self, data):
+        """
+        Yields the Turtle document in chunks: the prefixes, then the description of each node in turn.
+        """
+        yield self.write_prefixes()
+        yield from self.write_nodes(data)
+
+    def write_prefixes(self):
+        return ''.join(f'@prefix {prefix}: <{namespace}> .\n' for namespace, prefix in self.prefixes.items()) + '\n'
 
-        return super(JSONLDRenderer, self).render(data, accepted_media_type, renderer_context)
+    def write_nodes(self, data):
+        """
+        Yields the description of each node of the data in turn, without the prefixes.
+        """
+        if not isinstance(data, dict):
+            raise UnsupportedJsonLd('not a node')
+        nodes = []
+        self.get_subject({key: value for key, value in data.items() if key != '@context'}, nodes)
+        index = 0
+        while index < len(nodes):
+            yield self.write_node(*nodes[index], nodes)
+            index += 1
 
 
 class TurtleRenderer(BaseRenderer):
@@ -62,12 +396,16 @@ class TurtleRenderer(BaseRenderer):
     media_type = 'text/turtle'
     format = 'turtle'
     charset = 'utf-8'
+    direct_writer = getattr(settings, 'LDP_TURTLE_WRITER', True)
 
     def render(self, data, accepted_media_type=None, renderer_context=None):
         """
-        Render JSON-LD data to Turtle format using rdflib.
+        Render JSON-LD data to Turtle format.
+
+        Writes the Turtle directly from the data with a TurtleWriter when it can, and through rdflib otherwise.
+        The data is given the same @context as by the JSONLDRenderer.
 
-        Tries JSON-LD expansion first to include nested resources, but falls back
+        With rdflib, tries JSON-LD expansion first to include nested resources, but falls back
         to direct parsing if expansion fails (e.g., network timeout on @context fetch).
 
         Falls back to a simple converter if rdflib parsing fails entirely.
@@ -76,6 +414,52 @@ class TurtleRenderer(BaseRenderer):
         if data is None:
             return b''
 
+        if isinstance(data, dict) and self.direct_writer:
+            try:
+                return self.write_turtle(dict(data, **{'@context': merge_rdf_context(data.get('@context'))}))
+            except (UnsupportedJsonLd, jsonld.JsonLdError) as e:
+                logger.debug(f"Direct Turtle writing not possible ({str(e)}), using rdflib")
+
+        return self.render_graph(data)
+
+    def render_stream(self, container, members, accepted_media_type=None, renderer_context=None):
+        """
+        Render a container to Turtle in chunks: the container first, then each of its members with its
+        ldp:contains triple, as they are serialized.
+
+        The members are written with a TurtleWriter when it can, and through rdflib otherwise. The prefixes
+        which rdflib declares again for them are allowed anywhere in a Turtle document.
+        """
+        context = merge_rdf_context(container.get('@context'))
+        try:
+            writer = TurtleWriter(context) if self.direct_writer else None
+        except (UnsupportedJsonLd, jsonld.JsonLdError) as e:
+            logger.debug(f"Direct Turtle writing not possible ({str(e)}), using rdflib")
+            writer = None
+
+        def render_nodes(data):
+            data = dict(data, **{'@context': context})
+            if writer is not None:
+                try:
+                    return ''.join(writer.write_nodes(data)).encode('utf-8')
+                except UnsupportedJsonLd as e:
+                    logger.debug(f"Direct Turtle writing not possible ({str(e)}), using rdflib")
+            return self.render_graph(data)
+
+        if writer is not None:
+            yield writer.write_prefixes().encode('utf-8')
+        yield render_nodes(container)
+        for member in members:
+            yield render_nodes({'@id': container['@id'], 'ldp:contains': member})
+
+    def render_graph(self, data):
+        """
+        Render JSON-LD data to Turtle format through an rdflib graph.
+        """
+        rdf_data = data
+        if isinstance(data, dict):
+            rdf_data = dict(data, **{'@context': merge_rdf_context(data.get('@context'))})
+
         # Create RDF graph
         g = Graph()
 
@@ -83,15 +467,13 @@ class TurtleRenderer(BaseRenderer):
         try:
             # Expand JSON-LD to include all nested resources as triples
             # This converts embedded objects into separate resource descriptions
-            # Set a timeout to avoid hanging on @context URL fetches
+            # The @context is loaded from the context store, which only fetches it once
             logger.debug("Attempting JSON-LD expansion for Turtle rendering")
 
-            # Configure jsonld expansion with timeout (2 seconds)
-            document_loader = jsonld.requests_document_loader(timeout=2.0)
             options = {
-                'documentLoader': document_loader
+                'documentLoader': GLOBAL_CONTEXT_STORE
             }
-            expanded = jsonld.expand(data, options)
+            expanded = jsonld.expand(rdf_data, options)
             logger.debug(f"Expansion successful, expanded data has {len(expanded)} top-level items")
 
             # Check if expansion actually worked (expanded data should not have prefixed terms)
@@ -149,6 +531,18 @@ class TurtleRenderer(BaseRenderer):
                     # Return minimal valid Turtle on complete failure
                     return b'# Serialization error\n'
 
+    def write_turtle(self, data):
+        """
+        Write the Turtle of JSON-LD data with a TurtleWriter, without building an RDF graph.
+
+        Raises UnsupportedJsonLd if the data uses JSON-LD features which the writer doesn't handle, or has no triples.
+        """
+        writer = TurtleWriter(data['@context'])
+        turtle = ''.join(writer.write(data))
+        if not writer.count:
+            raise UnsupportedJsonLd('no triples')
+        return turtle.encode('utf-8')
+
     def simple_jsonld_to_turtle(self, data):
         """
         Simple fallback converter for basic JSON-LD to Turtle.
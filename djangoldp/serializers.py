@@ -22,6 +22,7 @@ from .serializers import *  # noqa: F401, F403
 from .serializers import (
     GLOBAL_SERIALIZER_CACHE,
     InMemoryCache,
+    DjangoCacheBackend,
     RDFSerializerMixin,
     LDListMixin,
     IdentityFieldMixin,
@@ -35,6 +36,7 @@ from .serializers import (
 
 __all__ = [
     'InMemoryCache',
+    'DjangoCacheBackend',
     'GLOBAL_SERIALIZER_CACHE',
     'MAX_RECORDS_SERIALIZER_CACHE',
     'RDFSerializerMixin',
@@ -6,7 +6,7 @@ Previously all serializers were in a single file. This package maintains backwar
 compatibility by re-exporting all public classes.
 
 Organization:
-- cache.py: Serializer caching functionality
+- cache.py: Serializer caching functionality (in memory or shared through Django's cache framework)
 - mixins.py: Reusable serializer mixins (RDFSerializerMixin, LDListMixin, IdentityFieldMixin)
 - fields.py: Custom field types (JsonLdField, JsonLdRelatedField, JsonLdIdentityField)
 - list_serializer.py: List/container serializers (ContainerSerializer, ManyJsonLdRelatedField)
@@ -16,6 +16,7 @@ Organization:
 # Cache
 from .cache import (
     InMemoryCache,
+    DjangoCacheBackend,
     GLOBAL_SERIALIZER_CACHE,
     MAX_RECORDS_SERIALIZER_CACHE,
 )
@@ -49,6 +50,7 @@ from .model_serializer import (
 __all__ = [
     # Cache
     'InMemoryCache',
+    'DjangoCacheBackend',
     'GLOBAL_SERIALIZER_CACHE',
     'MAX_RECORDS_SERIALIZER_CACHE',
     # Mixins
@@ -1,46 +1,368 @@
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+
 from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+from rest_framework.utils.encoders import JSONEncoder
 
 # defaults for various DjangoLDP settings (see documentation)
 MAX_RECORDS_SERIALIZER_CACHE = getattr(settings, 'MAX_RECORDS_SERIALIZER_CACHE', 10000)
+MAX_BYTES_SERIALIZER_CACHE = getattr(settings, 'MAX_BYTES_SERIALIZER_CACHE', None)
+SERIALIZER_CACHE_TTL = getattr(settings, 'SERIALIZER_CACHE_TTL', None)
+# the alias of a Django cache (settings.CACHES) to share the serializer cache between processes
+SERIALIZER_CACHE_BACKEND = getattr(settings, 'SERIALIZER_CACHE_BACKEND', None)
+
+
+def _approximate_size(value):
+    '''returns an approximation of the memory footprint of a serialized value, based on its JSON length'''
+    try:
+        return len(json.dumps(value, default=str))
+    except (TypeError, ValueError):
+        return 0
+
+
+# model Meta options naming fields which decide whether an instance is listed in a container
+MEMBERSHIP_META_FIELDS = ('owner_field', 'owner_urlid_field', 'auto_author', 'public_field', 'active_field')
+
+
+def get_membership_fields(model):
+    '''
+    returns the attnames of the concrete fields of the model which may change the containers an instance belongs to:
+    its relations, and the fields used to filter containers (owner, public or active fields, permission roles)
+    '''
+    if '_membership_fields' in model.__dict__:
+        return model._membership_fields
+    names = {getattr(model._meta, option) for option in MEMBERSHIP_META_FIELDS if getattr(model._meta, option, None)}
+    names.update(getattr(model._meta, 'permission_roles', {}).keys())
+    fields = tuple(sorted(field.attname for field in model._meta.concrete_fields
+                          if field.is_relation or field.name in names))
+    model._membership_fields = fields
+    return fields
+
+
+def get_membership_fingerprint(instance):
+    '''returns the values of the membership fields of an instance, see get_membership_fields'''
+    return tuple(getattr(instance, attname, None) for attname in get_membership_fields(type(instance)))
 
 
 class InMemoryCache:
-    def __init__(self):
-        self.cache = {}
+    '''
+    A bounded LRU cache for serialized containers, stored as cache_key -> container_urlid -> vary.
+    Entries are evicted one at a time (least recently used first) when the cache holds more than max_records
+    entries or more than max_bytes (approximate JSON size). If a ttl (in seconds) is set, entries older than
+    the ttl are treated as absent
+    The cache also keeps a reverse index of the instances listed in each cached container (directly or nested in
+    its resources), and of the instance owning each nested container, so that a change on an instance only
+    invalidates the containers it affects
+    '''
+    # the instances embedded in an entry are known, for a change on any of them to invalidate it
+    indexes_members = True
+
+    def __init__(self, max_records=MAX_RECORDS_SERIALIZER_CACHE, max_bytes=MAX_BYTES_SERIALIZER_CACHE,
+                 ttl=SERIALIZER_CACHE_TTL):
+        self.max_records = max_records
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.lock = threading.RLock()
+        self.reset()
 
     def reset(self):
-        self.cache = {}
+        with self.lock:
+            self.cache = {}
+            # (cache_key, container_urlid, vary) tuples, ordered from least to most recently used
+            self.lru = OrderedDict()
+            self.total_bytes = 0
+            # (cache_key, container_urlid) -> {(label, pk)} of the instances listed in a container, and reverse index
+            self.container_members = {}
+            self.member_containers = {}
+            # (label, pk) -> membership fingerprint of the instance when it was last serialized
+            self.fingerprints = {}
+            # (label, pk) of an instance -> {(cache_key, container_urlid)} of its nested containers, and reverse index
+            self.owned_containers = {}
+            self.container_owner = {}
+            self.hits = 0
+            self.misses = 0
+            self.evictions = 0
+
+    def _is_expired(self, entry):
+        return entry['expires'] is not None and entry['expires'] <= time.monotonic()
+
+    def _remove(self, cache_key, container_urlid, vary):
+        '''removes a single entry and cleans up the empty branches it leaves behind'''
+        containers = self.cache.get(cache_key)
+        if containers is None or container_urlid not in containers:
+            return
+        entry = containers[container_urlid].pop(vary, None)
+        if entry is not None:
+            self.total_bytes -= entry['size']
+            self.lru.pop((cache_key, container_urlid, vary), None)
+        if not containers[container_urlid]:
+            containers.pop(container_urlid)
+            self._unindex(cache_key, container_urlid)
+        if not containers:
+            self.cache.pop(cache_key)
+
+    def _unindex(self, cache_key, container_urlid):
+        '''removes a container which isn't cached anymore from the reverse indexes'''
+        container = (cache_key, container_urlid)
+        for member in self.container_members.pop(container, ()):
+            containers = self.member_containers.get(member)
+            if containers is not None:
+                containers.discard(container)
+                if not containers:
+                    self.member_containers.pop(member)
+                    self.fingerprints.pop(member, None)
+        owner = self.container_owner.pop(container, None)
+        if owner is not None:
+            containers = self.owned_containers.get(owner)
+            if containers is not None:
+                containers.discard(container)
+                if not containers:
+                    self.owned_containers.pop(owner)
+
+    def _evict(self):
+        '''evicts least recently used entries until the cache is within its bounds'''
+        while self.lru and (
+            (self.max_records and len(self.lru) > self.max_records)
+            or (self.max_bytes and self.total_bytes > self.max_bytes)
+        ):
+            cache_key, container_urlid, vary = next(iter(self.lru))
+            self._remove(cache_key, container_urlid, vary)
+            self.evictions += 1
 
     def has(self, cache_key, container_urlid=None, vary=None):
-        return cache_key in self.cache and \
-               (container_urlid is None or container_urlid in self.cache[cache_key]) and \
-               (vary is None or vary in self.cache[cache_key][container_urlid])
+        with self.lock:
+            if cache_key not in self.cache:
+                return False
+            if container_urlid is None:
+                return True
+            if container_urlid not in self.cache[cache_key]:
+                return False
+            if vary is None:
+                return True
+            entry = self.cache[cache_key][container_urlid].get(vary)
+            if entry is None:
+                return False
+            if self._is_expired(entry):
+                self._remove(cache_key, container_urlid, vary)
+                return False
+            return True
 
     def get(self, cache_key, container_urlid, vary):
-        if self.has(cache_key, container_urlid, vary):
-            return self.cache[cache_key][container_urlid][vary]['value']
-        else:
+        with self.lock:
+            if self.has(cache_key, container_urlid, vary):
+                self.hits += 1
+                self.lru.move_to_end((cache_key, container_urlid, vary))
+                return self.cache[cache_key][container_urlid][vary]['value']
+            self.misses += 1
             return None
 
     def set(self, cache_key, container_urlid, vary, value):
-        if len(self.cache.keys()) > MAX_RECORDS_SERIALIZER_CACHE:
-            self.reset()
+        with self.lock:
+            self._remove(cache_key, container_urlid, vary)
+
+            size = _approximate_size(value) if self.max_bytes else 0
+            expires = time.monotonic() + self.ttl if self.ttl else None
+            self.cache.setdefault(cache_key, {}).setdefault(container_urlid, {})[vary] = \
+                {'value': value, 'size': size, 'expires': expires}
+            self.lru[(cache_key, container_urlid, vary)] = None
+            self.total_bytes += size
 
-        if cache_key not in self.cache:
-            self.cache[cache_key] = {}
-        if container_urlid not in self.cache[cache_key]:
-            self.cache[cache_key][container_urlid] = {}
-        self.cache[cache_key][container_urlid][vary] = {'value': value}
+            self._evict()
 
     def invalidate(self, cache_key, container_urlid=None, vary=None):
         # can clear cache_key -> container_urlid -> vary, cache_key -> container_urlid or cache_key
-        if container_urlid is not None:
-            if vary is not None:
-                self.cache[cache_key][container_urlid].pop(vary, None)
+        with self.lock:
+            if cache_key not in self.cache:
+                return
+            if container_urlid is not None:
+                if container_urlid not in self.cache[cache_key]:
+                    return
+                varies = [vary] if vary is not None else list(self.cache[cache_key][container_urlid].keys())
+                for entry_vary in varies:
+                    self._remove(cache_key, container_urlid, entry_vary)
             else:
-                self.cache[cache_key].pop(container_urlid, None)
+                for entry_urlid, entries in list(self.cache[cache_key].items()):
+                    for entry_vary in list(entries.keys()):
+                        self._remove(cache_key, entry_urlid, entry_vary)
+
+    def index(self, cache_key, container_urlid, members, owner=None):
+        '''
+        records the instances listed in a cached container
+        :param members: a dict of {(label, pk): membership fingerprint} of the instances listed
+        :param owner: the (label, pk) of the instance owning the container, if it is a nested container
+        '''
+        with self.lock:
+            if not self.has(cache_key, container_urlid):
+                return
+            container = (cache_key, container_urlid)
+            self.container_members.setdefault(container, set()).update(members.keys())
+            for member, fingerprint in members.items():
+                self.member_containers.setdefault(member, set()).add(container)
+                self.fingerprints[member] = fingerprint
+            if owner is not None:
+                self.container_owner[container] = owner
+                self.owned_containers.setdefault(owner, set()).add(container)
+
+    def members(self, cache_key, container_urlid):
+        '''returns the {(label, pk): membership fingerprint} of the instances listed in a cached container'''
+        with self.lock:
+            return {member: self.fingerprints.get(member)
+                    for member in self.container_members.get((cache_key, container_urlid), ())}
+
+    def fingerprint(self, label, pk):
+        '''returns the membership fingerprint of an instance when it was last serialized, None if unknown'''
+        with self.lock:
+            return self.fingerprints.get((label, pk))
+
+    def invalidate_instances(self, label, pks, owned=False):
+        '''
+        invalidates the containers listing the instances of a model with the given pks
+        :param owned: set to True to also invalidate the nested containers of the instances
+        '''
+        with self.lock:
+            containers = set()
+            for pk in pks:
+                containers.update(self.member_containers.get((label, pk), ()))
+                if owned:
+                    containers.update(self.owned_containers.get((label, pk), ()))
+            for cache_key, container_urlid in containers:
+                self.invalidate(cache_key, container_urlid)
+
+    def stats(self):
+        '''returns the hit/miss/eviction counters and the current size of the cache'''
+        with self.lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'entries': len(self.lru),
+                'bytes': self.total_bytes,
+            }
+
+
+class DjangoCacheBackend:
+    '''
+    A serializer cache stored in a Django cache (locmem, file-based, Redis, Memcached...), which can be shared by
+    all the workers of a deployment.
+    Invalidation relies on generation counters, stored alongside the entries: one for the whole cache, one per
+    model label and one per container. Each entry key embeds the generations it was written with, so invalidating
+    is a single write of a new generation, after which stale entries are never read again and expire from the
+    underlying cache by themselves
+    '''
+    key_prefix = 'djangoldp:serializer'
+    # the instances embedded in an entry are not known, so the representations of single resources, which embed
+    # instances of other models, can't be cached
+    indexes_members = False
+
+    def __init__(self, alias='default', ttl=SERIALIZER_CACHE_TTL):
+        self.alias = alias
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    @property
+    def backend(self):
+        return caches[self.alias]
+
+    def _hash(self, value):
+        '''keys are hashed so that they are always valid for the underlying cache backend'''
+        return hashlib.sha1(str(value).encode()).hexdigest()
+
+    def _generation_keys(self, cache_key, container_urlid):
+        return [
+            '{}:gen'.format(self.key_prefix),
+            '{}:gen:{}'.format(self.key_prefix, cache_key),
+            '{}:gen:{}:{}'.format(self.key_prefix, cache_key, self._hash(container_urlid)),
+        ]
+
+    def _new_generation(self):
+        # generations start from the current time, so that losing a generation key (e.g. to an eviction in the
+        # underlying cache) can never resurrect the entries written with a previous generation
+        return time.time_ns()
+
+    def _bump_generation(self, generation_key):
+        self.invalidations += 1
+        self.backend.set(generation_key, self._new_generation(), timeout=None)
+
+    def _entry_key(self, cache_key, container_urlid, vary):
+        generation_keys = self._generation_keys(cache_key, container_urlid)
+        generations = self.backend.get_many(generation_keys)
+        missing = {key: self._new_generation() for key in generation_keys if key not in generations}
+        if missing:
+            # add() does not overwrite generations set concurrently by another worker
+            for key, generation in missing.items():
+                if not self.backend.add(key, generation, timeout=None):
+                    generation = self.backend.get(key, generation)
+                generations[key] = generation
+        return '{}:{}:{}:{}'.format(self.key_prefix, cache_key,
+                                    self._hash([generations[key] for key in generation_keys]),
+                                    self._hash([container_urlid, vary]))
+
+    def reset(self):
+        self._bump_generation(self._generation_keys(None, None)[0])
+
+    def has(self, cache_key, container_urlid=None, vary=None):
+        # the presence of a model label or a container isn't tracked, so they are always assumed to be cached
+        if container_urlid is None or vary is None:
+            return True
+        return self.backend.get(self._entry_key(cache_key, container_urlid, vary)) is not None
+
+    def get(self, cache_key, container_urlid, vary):
+        value = self.backend.get(self._entry_key(cache_key, container_urlid, vary))
+        if value is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return json.loads(value)
+
+    def set(self, cache_key, container_urlid, vary, value):
+        # values are stored as JSON, which is portable across backends and avoids pickling serializer internals
+        self.backend.set(self._entry_key(cache_key, container_urlid, vary), json.dumps(value, cls=JSONEncoder),
+                         timeout=self.ttl or DEFAULT_TIMEOUT)
+
+    def invalidate(self, cache_key, container_urlid=None, vary=None):
+        # can clear cache_key -> container_urlid -> vary, cache_key -> container_urlid or cache_key
+        if container_urlid is None:
+            self._bump_generation(self._generation_keys(cache_key, None)[1])
+        elif vary is None:
+            self._bump_generation(self._generation_keys(cache_key, container_urlid)[2])
         else:
-            self.cache.pop(cache_key, None)
+            self.backend.delete(self._entry_key(cache_key, container_urlid, vary))
+
+    def index(self, cache_key, container_urlid, members, owner=None):
+        # instances are not indexed in a shared cache, it would cost a write per instance serialized
+        pass
+
+    def members(self, cache_key, container_urlid):
+        return {}
+
+    def fingerprint(self, label, pk):
+        return None
+
+    def invalidate_instances(self, label, pks, owned=False):
+        # without an index, any container of the model may list the instances
+        self.invalidate(label)
+
+    def stats(self):
+        '''returns the hit/miss/invalidation counters of this process'''
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'invalidations': self.invalidations,
+        }
+
+
+def get_serializer_cache():
+    '''returns the serializer cache configured by SERIALIZER_CACHE_BACKEND, in memory by default'''
+    if SERIALIZER_CACHE_BACKEND:
+        return DjangoCacheBackend(SERIALIZER_CACHE_BACKEND)
+    return InMemoryCache()
 
 
-GLOBAL_SERIALIZER_CACHE = InMemoryCache()
+GLOBAL_SERIALIZER_CACHE = get_serializer_cache()
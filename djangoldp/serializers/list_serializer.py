@@ -1,8 +1,11 @@
+from itertools import islice
+
 from rest_framework.relations import ManyRelatedField
 from rest_framework.serializers import ListSerializer
 from rest_framework.utils.serializer_helpers import ReturnDict
 
-from .mixins import LDListMixin, IdentityFieldMixin
+from djangoldp.permissions import get_batch_permissions
+from .mixins import LDListMixin, IdentityFieldMixin, RDFSerializerMixin
 
 
 class ContainerSerializer(LDListMixin, ListSerializer, IdentityFieldMixin):
@@ -12,6 +15,34 @@ class ContainerSerializer(LDListMixin, ListSerializer, IdentityFieldMixin):
     def data(self):
         return ReturnDict(super(ListSerializer, self).data, serializer=self)
 
+    def prefetch_permissions(self, value, child_model):
+        '''computes the permissions on all the objects of the container at once, when the child serializes them'''
+        child = self.get_child()
+        user = self.context['request'].user
+        if not isinstance(child, RDFSerializerMixin) or not child.includes_permissions() or user.is_superuser:
+            return value
+        objs = [obj for obj in value if isinstance(obj, child_model) and obj.pk is not None]
+        child.batch_permissions = get_batch_permissions(getattr(child_model._meta, 'permission_classes', []),
+                                                        user, child_model, objs)
+        return value
+
+    def to_stream(self, queryset, chunk_size):
+        '''returns the representation of the container without its members, and an iterator serializing its members
+        by chunks of the queryset, to be rendered as they are serialized'''
+        child_model = queryset.model
+        container = self.serialize_container([], self.compute_id(queryset), self.context['request'].user, child_model)
+        del container['ldp:contains']
+
+        def iter_members():
+            objects = queryset.iterator(chunk_size=chunk_size)
+            while True:
+                chunk = list(islice(objects, chunk_size))
+                if not chunk:
+                    return
+                for obj in self.prefetch_permissions(chunk, child_model):
+                    yield self.get_child().to_representation(obj)
+        return container, iter_members()
+
 
 class ManyJsonLdRelatedField(LDListMixin, ManyRelatedField):
     child_attr = 'child_relation'
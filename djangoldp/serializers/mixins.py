@@ -1,18 +1,92 @@
 from copy import copy
 
 from django.conf import settings
-from django.db.models import QuerySet
+from django.db.models import Model as DjangoModel, QuerySet
+from django.db.models.manager import BaseManager
 from rest_framework.fields import empty
 
 from djangoldp.models import Model
-from djangoldp.permissions import DEFAULT_DJANGOLDP_PERMISSIONS
-from .cache import GLOBAL_SERIALIZER_CACHE
+from djangoldp.permissions import DEFAULT_DJANGOLDP_PERMISSIONS, get_memo_permissions, get_op_cache_vary, \
+    get_permission_memo, get_permissions_filter_q, get_user_cache_vary
+from .cache import GLOBAL_SERIALIZER_CACHE, get_membership_fingerprint
+
+
+def get_cache_vary_models(model, depth=0, _models=None):
+    '''returns the models whose permissions apply to a representation of the model: the model itself, the models of
+    its nested containers and, down to the depth of the serialization, those of its nested resources'''
+    key = (model, depth)
+    if _models is None and key in _cache_vary_models:
+        return _cache_vary_models[key]
+    models = [] if _models is None else _models
+    if model not in models:
+        models.append(model)
+    for field in get_serialized_relations(model):
+        related_model = field.related_model
+        if related_model in models:
+            continue
+        if depth > 0:
+            get_cache_vary_models(related_model, depth - 1, models)
+        elif field.many_to_many or field.one_to_many:
+            models.append(related_model)
+    if _models is None:
+        _cache_vary_models[key] = models
+    return models
+_cache_vary_models = {}
+
+
+def get_serialized_relations(model):
+    '''returns the relation fields of the model which are serialized by default'''
+    relations = {}
+    for field in model._meta.get_fields():
+        if field.is_relation and field.related_model is not None:
+            relations[field.get_accessor_name() if field.auto_created else field.name] = field
+    names = getattr(model._meta, 'serializer_fields', None)
+    if names is None:
+        names = [name for name, field in relations.items() if not field.auto_created]
+    names = set(names).union(getattr(model._meta, 'nested_fields', []))
+    return [field for name, field in relations.items() if name in names]
 
 
 class RDFSerializerMixin:
+    # the {(label, pk): membership fingerprint} of the instances embedded in the representation being serialized,
+    # collected for the reverse index of the cache. None when the representation isn't being cached
+    cache_members = None
+
+    def get_cache_vary(self, model, depth=0):
+        '''returns the key on which cached representations of the model vary, from the permission classes applying to
+        them. Representations are shared by all users when none of these classes depend on the user'''
+        request = self.context['request']
+        if request.user.is_superuser:
+            return get_user_cache_vary(request.user)
+
+        def compute_cache_vary():
+            return ';'.join(','.join(get_op_cache_vary(permission(), request, vary_model)
+                                     for permission in getattr(vary_model._meta, 'permission_classes', []))
+                            for vary_model in get_cache_vary_models(model, depth))
+        memo = get_permission_memo(request)
+        if memo is None:
+            return compute_cache_vary()
+        return memo.get(('cache_vary', model, depth), compute_cache_vary)
+
+    def propagate_cache_members(self, members):
+        '''adds the instances embedded in this representation to the closest parent being cached, which embeds them too'''
+        parent = getattr(self, 'parent', None)
+        while parent is not None:
+            if getattr(parent, 'cache_members', None) is not None:
+                parent.cache_members.update(members)
+                return
+            parent = getattr(parent, 'parent', None)
+
+    # the {pk: permissions} of the user on the objects about to be serialized, computed at once by the container
+    batch_permissions = None
+
+    def includes_permissions(self):
+        '''returns True if the permissions are serialized, which they aren't on nested objects by default'''
+        return not self.parent or settings.LDP_INCLUDE_INNER_PERMS
+
     def add_permissions(self, data, user, model, obj=None):
         '''takes a set or list of permissions and returns them in the JSON-LD format'''
-        if self.parent and not settings.LDP_INCLUDE_INNER_PERMS:  # Don't serialize permissions on nested objects
+        if not self.includes_permissions():  # Don't serialize permissions on nested objects
             return data
 
         if user.is_superuser:
@@ -22,8 +96,12 @@ class RDFSerializerMixin:
         permission_classes = getattr(model._meta, 'permission_classes', [])
         if not permission_classes:
             return data
+        if obj is not None and self.batch_permissions is not None and obj.pk in self.batch_permissions:
+            data['permissions'] = self.batch_permissions[obj.pk]
+            return data
         # The permissions must be given by all permission classes to be granted
-        permissions = set.intersection(*[permission().get_permissions(user, model, obj) for permission in permission_classes])
+        permissions = set.intersection(*[get_memo_permissions(permission(), user, model, obj)
+                                         for permission in permission_classes])
         # Don't grant delete permissions on containers
         if not obj and 'delete' in permissions:
             permissions.remove('delete')
@@ -49,6 +127,7 @@ class LDListMixin(RDFSerializerMixin):
     '''A Mixin for serializing containers into JSONLD format'''
     child_attr = 'child'
     with_cache = getattr(settings, 'SERIALIZER_CACHE', True)
+    with_compiled_filters = getattr(settings, 'COMPILED_PERMISSION_FILTERS', False)
 
     def get_child(self):
         return getattr(self, self.child_attr)
@@ -72,15 +151,32 @@ class LDListMixin(RDFSerializerMixin):
 
     def filter_queryset(self, queryset, child_model):
         '''Applies the permission of the child model to the child queryset'''
+        if self.with_compiled_filters:
+            permissions_q = get_permissions_filter_q(getattr(child_model._meta, 'permission_classes', []),
+                                                     self.context['request'], child_model)
+            if permissions_q is not None:
+                return queryset.filter(permissions_q)
         view = copy(self.context['view'])
         view.model = child_model
-        filter_backends = list({perm_class().get_filter_backend(child_model) for perm_class in
-                                getattr(child_model._meta, 'permission_classes', []) if hasattr(perm_class(), 'get_filter_backend')})
+
+        def get_filter_backends():
+            return list({perm_class().get_filter_backend(child_model) for perm_class in
+                         getattr(child_model._meta, 'permission_classes', []) if hasattr(perm_class(), 'get_filter_backend')})
+        memo = get_permission_memo(self.context['request'])
+        filter_backends = get_filter_backends() if memo is None else memo.get(('filter_backends', child_model),
+                                                                              get_filter_backends)
         for backend in filter_backends:
             if backend:
                 queryset = backend().filter_queryset(self.context['request'], queryset, view)
         return queryset
 
+    def is_filtered_by_query_plan(self, value):
+        '''returns True if the objects were prefetched by the query plan of the view, with their permissions applied'''
+        plan = getattr(self.context.get('view'), 'query_plan', None)
+        parent_instance = getattr(self, 'parent_instance', None)
+        return (plan is not None and parent_instance is not None and value._result_cache is not None
+                and plan.is_filtered(type(parent_instance), self.source))
+
     def compute_id(self, value):
         '''generates the @id of the container'''
         if not hasattr(self, 'parent_instance'):
@@ -93,20 +189,31 @@ class LDListMixin(RDFSerializerMixin):
         self.parent_instance = instance
         return super().get_attribute(instance)
 
-    def check_cache(self, value, id, model, cache_vary):
-        '''Auxiliary function to avoid code duplication - checks cache and returns from it if it has entry'''
+    def prefetch_permissions(self, value, child_model):
+        '''hook called with the objects of the container before they are serialized, returning the objects to serialize'''
+        return value
+
+    def get_cache_members(self, value):
+        '''returns the {(label, pk): membership fingerprint} of the instances listed in the container'''
+        return {(item._meta.label, item.pk): get_membership_fingerprint(item)
+                for item in value if isinstance(item, DjangoModel)}
+
+    def get_depth(self):
+        '''returns the depth at which the items of the container are serialized'''
         parent_meta = getattr(self.get_child(), 'Meta', getattr(self.parent, 'Meta', None))
-        depth = max(getattr(parent_meta, "depth", 0), 0) if parent_meta else 1
+        return max(getattr(parent_meta, "depth", 0), 0) if parent_meta else 1
 
-        if depth:
+    def check_cache(self, value, id, model, cache_vary):
+        '''Auxiliary function to avoid code duplication - checks cache and returns from it if it has entry'''
+        if self.get_depth():
             # if the depth is greater than 0, we don't hit the cache, because a nested container might be outdated
             # this Mixin may not have access to the depth of the parent serializer, e.g. if it's a ManyRelatedField
             # in these cases we assume the depth is 0 and so we hit the cache
             return None
         cache_key = getattr(model._meta, 'label', None)
 
-        if self.with_cache and GLOBAL_SERIALIZER_CACHE.has(cache_key, id, cache_vary):
-            cache_value = GLOBAL_SERIALIZER_CACHE.get(cache_key, id, cache_vary)
+        cache_value = GLOBAL_SERIALIZER_CACHE.get(cache_key, id, cache_vary) if self.with_cache else None
+        if cache_value is not None:
             # this check is to handle the situation where the cache has been invalidated by something we don't check
             # namely if my permissions are upgraded then I may have access to view more objects
             cache_under_value = cache_value['ldp:contains'] if 'ldp:contains' in cache_value else cache_value
@@ -131,7 +238,7 @@ class LDListMixin(RDFSerializerMixin):
 
         is_container = True
         if getattr(self, 'parent', None):  # If we're in a nested container
-            if isinstance(value, QuerySet) and getattr(self, 'parent', None):
+            if isinstance(value, QuerySet) and not self.is_filtered_by_query_plan(value):
                 value = self.filter_queryset(value, child_model)
 
             if getattr(self, 'field_name', None) is not None:
@@ -140,17 +247,32 @@ class LDListMixin(RDFSerializerMixin):
                 if not self.field_name in getattr(self.parent.Meta.model._meta, 'nested_fields', []):
                     is_container = False
 
-        cache_vary = str(user)
+        cache_key = getattr(child_model._meta, 'label')
+        cache_vary = self.get_cache_vary(child_model, self.get_depth())
         cache_result = self.check_cache(value, id, child_model, cache_vary)
         if cache_result:
+            self.propagate_cache_members(GLOBAL_SERIALIZER_CACHE.members(cache_key, id))
             return cache_result
 
+        if isinstance(value, BaseManager):
+            # evaluate the queryset once, for both the serialization and the indexing of its members
+            value = value.all()
+        value = self.prefetch_permissions(value, child_model)
+        # collects the instances listed by nested containers, while serializing
+        self.cache_members = {}
         data = super().to_representation(value)
         if is_container:
             data = self.serialize_container(data, id, user, child_model)
 
-        GLOBAL_SERIALIZER_CACHE.set(getattr(child_model._meta, 'label'), id, cache_vary, data)
-        return GLOBAL_SERIALIZER_CACHE.get(getattr(child_model._meta, 'label'), id, cache_vary)
+        members, self.cache_members = self.cache_members, None
+        members.update(self.get_cache_members(value))
+        parent_instance = getattr(self, 'parent_instance', None)
+        owner = (parent_instance._meta.label, parent_instance.pk) if isinstance(parent_instance, DjangoModel) else None
+
+        GLOBAL_SERIALIZER_CACHE.set(cache_key, id, cache_vary, data)
+        GLOBAL_SERIALIZER_CACHE.index(cache_key, id, members, owner)
+        self.propagate_cache_members(members)
+        return data
 
     def get_value(self, dictionary):
         try:
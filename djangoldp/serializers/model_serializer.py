@@ -16,7 +16,9 @@ from functools import cached_property
 from rest_framework.exceptions import ValidationError
 from rest_framework.fields import SkipField, empty, ReadOnlyField
 from rest_framework.fields import get_error_detail
-from rest_framework.serializers import HyperlinkedModelSerializer, ModelSerializer, LIST_SERIALIZER_KWARGS
+from rest_framework.relations import ManyRelatedField, RelatedField
+from rest_framework.serializers import BaseSerializer, HyperlinkedModelSerializer, ModelSerializer, \
+    LIST_SERIALIZER_KWARGS
 from rest_framework.settings import api_settings
 from rest_framework.utils import model_meta
 from rest_framework.utils.field_mapping import get_nested_relation_kwargs
@@ -50,16 +52,24 @@ except ImportError:
 
 from djangoldp.fields import LDPUrlField, IdURLField
 from djangoldp.models import Model
+from djangoldp.utils import freeze
+from .cache import GLOBAL_SERIALIZER_CACHE, get_membership_fingerprint
 from .fields import JsonLdRelatedField, JsonLdIdentityField
 from .list_serializer import ContainerSerializer
 from .mixins import RDFSerializerMixin
 
+# the serializer classes of nested resources, generated once for each serializer class, model and depth
+_nested_serializer_classes = {}
+# the output plans of the serializers, computed once for each serializer class and fields
+_output_plans = {}
+
 
 class LDPSerializer(HyperlinkedModelSerializer, RDFSerializerMixin):
     url_field_name = "@id"
     serializer_related_field = JsonLdRelatedField
     serializer_url_field = JsonLdIdentityField
     ModelSerializer.serializer_field_mapping[LDPUrlField] = IdURLField
+    with_resource_cache = getattr(settings, 'SERIALIZER_RESOURCE_CACHE', False)
 
     # The default serializer repr ends in infinite loop. Overloading it prevents that.
     def __repr__(self):
@@ -111,18 +121,82 @@ class LDPSerializer(HyperlinkedModelSerializer, RDFSerializerMixin):
             return model_field.field.related_rdf_type
         return None
 
+    @cached_property
+    def output_plan(self):
+        '''
+        :return: the output plan of the readable fields, computed once for the serializer class and its fields:
+         the (field name, RDF name) of the fields to rename, and the fields whose @id may be a template of the object id
+        '''
+        readable_fields = list(self._readable_fields)
+        key = (type(self), tuple((field.field_name, field.source) for field in readable_fields))
+        if key not in _output_plans:
+            renamed_fields = []
+            for field in readable_fields:
+                try:
+                    rdf_field_name = self._get_rdf_field_name(self.Meta.model._meta.get_field(field.source))
+                except FieldDoesNotExist:
+                    continue
+                if rdf_field_name is not None:
+                    renamed_fields.append((field.field_name, rdf_field_name))
+            # relations and nested serializers generate the ids of their values themselves
+            templated_fields = [field.field_name for field in readable_fields
+                                if not isinstance(field, (RelatedField, ManyRelatedField, BaseSerializer))]
+            _output_plans[key] = (tuple(renamed_fields), tuple(templated_fields))
+        return _output_plans[key]
+
+    def get_resource_cache_key(self, obj):
+        '''
+        :return: the key of the representation of obj in the serializer cache, which changes with the instance itself
+         and with the shape of the representation. None if the representation should not be cached, including when
+         the cache can't invalidate it on a change of the instances it embeds
+        '''
+        updated_at = getattr(obj, 'updated_at', None)
+        if not self.with_resource_cache or not GLOBAL_SERIALIZER_CACHE.indexes_members or updated_at is None or \
+                'request' not in self.context:
+            return None
+        return 'resource:{}:{}:{}:{}:{}:{}'.format(obj.pk, updated_at.timestamp(), getattr(self.Meta, 'depth', 0),
+                                                   getattr(self, 'parent', None) is not None,
+                                                   type(self).__name__, ','.join(self.fields.keys()))
+
     def to_representation(self, obj):
         # external Models should only be returned with rdf values
         if Model.is_external(obj):
             data = {'@id': obj.urlid}
             return self.serialize_rdf_fields(obj, data)
 
-        data = super().to_representation(obj)
+        cache_key = obj._meta.label
+        resource_key = self.get_resource_cache_key(obj)
+        if resource_key is not None:
+            cache_vary = self.get_cache_vary(type(obj), getattr(self.Meta, 'depth', 0))
+            cache_value = GLOBAL_SERIALIZER_CACHE.get(cache_key, resource_key, cache_vary)
+            if cache_value is not None:
+                self.propagate_cache_members(GLOBAL_SERIALIZER_CACHE.members(cache_key, resource_key))
+                return dict(cache_value)
+            # collects the instances embedded in the resource, while serializing
+            self.cache_members = {}
+
+        data = self.to_uncached_representation(obj)
+
+        members = {(cache_key, obj.pk): get_membership_fingerprint(obj)}
+        if resource_key is not None:
+            members.update(self.cache_members)
+            self.cache_members = None
+            GLOBAL_SERIALIZER_CACHE.set(cache_key, resource_key, cache_vary, dict(data))
+            GLOBAL_SERIALIZER_CACHE.index(cache_key, resource_key, members)
+        self.propagate_cache_members(members)
+        return data
 
-        slug_field = Model.slug_field(obj)
-        for field in data:
-            if isinstance(data[field], dict) and '@id' in data[field]:
-                data[field]['@id'] = data[field]['@id'].format(Model.container_id(obj), str(getattr(obj, slug_field)))
+    def to_uncached_representation(self, obj):
+        data = super().to_representation(obj)
+        renamed_fields, templated_fields = self.output_plan
+
+        template_args = None
+        for field in templated_fields:
+            value = data.get(field)
+            if isinstance(value, dict) and isinstance(value.get('@id'), str) and '{' in value['@id']:
+                if template_args is None:
+                    template_args = (Model.container_id(obj), str(getattr(obj, Model.slug_field(obj))))
+                value['@id'] = value['@id'].format(*template_args)
         # prioritise urlid field over generated @id
         if 'urlid' in data and data['urlid'] is not None:
             data['@id'] = data.pop('urlid')['@id']
@@ -132,19 +206,9 @@ class LDPSerializer(HyperlinkedModelSerializer, RDFSerializerMixin):
         # Django Rest Framework will by default serialize fields with the field name.
         # LDPFields may have configured an RDF type which is required for valid serialization.
         # This is handled after serialization to avoid overriding the basic serialization of DRF.
-        model = self.Meta.model
-        for field in self._readable_fields:
-            try:
-                model_field = model._meta.get_field(field.source)
-                if (
-                    model_field is not None
-                    and field.field_name in data
-                    and self._get_rdf_field_name(model_field) is not None
-                ):
-                    data[self._get_rdf_field_name(model_field)] = data[field.field_name]
-                    data.pop(field.field_name)
-            except FieldDoesNotExist:
-                pass
+        for field_name, rdf_field_name in renamed_fields:
+            if field_name in data:
+                data[rdf_field_name] = data.pop(field_name)
 
         data = self.serialize_rdf_fields(obj, data, include_context=True)
         data = self.add_permissions(data, self.context['request'].user, type(obj), obj=obj)
@@ -236,103 +300,108 @@ class LDPSerializer(HyperlinkedModelSerializer, RDFSerializerMixin):
         return type(field_class.__name__ + 'Valued', (JSonLDStandardField, field_class), {}), field_kwargs
 
     def build_nested_field(self, field_name, relation_info, nested_depth):
-        class NestedLDPSerializer(self.__class__):
-            class Meta:
-                model = relation_info.related_model
-                depth = nested_depth - 1
-                try:
-                    fields = ['@id'] + list(model._meta.serializer_fields)
-                except AttributeError:
-                    fields = '__all__'
-
-            def to_internal_value(self, data):
-                if data == '':
-                    return ''
-                if self.url_field_name in data:
-                    if not isinstance(data, Mapping):
-                        message = self.error_messages['invalid'].format(
-                            datatype=type(data).__name__
-                        )
-                        raise ValidationError({
-                            api_settings.NON_FIELD_ERRORS_KEY: [message]
-                        }, code='invalid')
-
-                    ret = OrderedDict()
-                    errors = OrderedDict()
-
-                    # validate fields passed in the data
-                    for field in self._writable_fields:
-                        # Consider only fields which are present in data, but try to find alternative keys for that field
-                        # in the data, first.
-                        if field.field_name not in data:
-                            try:
-                                model_field = self.Meta.model._meta.get_field(field.source)
-                                rdf_field_name = self._get_rdf_field_name(model_field)
-                                if (
-                                    model_field is not None
-                                    and field.field_name not in data
-                                    and rdf_field_name is not None
-                                    and rdf_field_name in data
-                                ):
-                                    data[field.field_name] = data[rdf_field_name]
-                                    data.pop(rdf_field_name)
-                                else:
+        model = relation_info.related_model
+        key = (type(self), model, nested_depth, freeze(getattr(model._meta, 'serializer_fields', None)))
+        if key not in _nested_serializer_classes:
+            class NestedLDPSerializer(self.__class__):
+                class Meta:
+                    model = relation_info.related_model
+                    depth = nested_depth - 1
+                    try:
+                        fields = ['@id'] + list(model._meta.serializer_fields)
+                    except AttributeError:
+                        fields = '__all__'
+
+                def to_internal_value(self, data):
+                    if data == '':
+                        return ''
+                    if self.url_field_name in data:
+                        if not isinstance(data, Mapping):
+                            message = self.error_messages['invalid'].format(
+                                datatype=type(data).__name__
+                            )
+                            raise ValidationError({
+                                api_settings.NON_FIELD_ERRORS_KEY: [message]
+                            }, code='invalid')
+
+                        ret = OrderedDict()
+                        errors = OrderedDict()
+
+                        # validate fields passed in the data
+                        for field in self._writable_fields:
+                            # Consider only fields which are present in data, but try to find alternative keys for that field
+                            # in the data, first.
+                            if field.field_name not in data:
+                                try:
+                                    model_field = self.Meta.model._meta.get_field(field.source)
+                                    rdf_field_name = self._get_rdf_field_name(model_field)
+                                    if (
+                                        model_field is not None
+                                        and field.field_name not in data
+                                        and rdf_field_name is not None
+                                        and rdf_field_name in data
+                                    ):
+                                        data[field.field_name] = data[rdf_field_name]
+                                        data.pop(rdf_field_name)
+                                    else:
+                                        continue
+                                except FieldDoesNotExist:
                                     continue
-                            except FieldDoesNotExist:
-                                continue
-
-                        validate_method = getattr(self, 'validate_' + field.field_name, None)
-                        primitive_value = field.get_value(data)
-                        try:
-                            validated_value = field.run_validation(primitive_value)
-                            if validate_method is not None:
-                                validated_value = validate_method(validated_value)
-                        except ValidationError as exc:
-                            errors[field.field_name] = exc.detail
-                        except DjangoValidationError as exc:
-                            errors[field.field_name] = get_error_detail(exc)
-                        except SkipField:
-                            pass
-                        else:
-                            set_value(ret, field.source_attrs, validated_value)
 
-                    if errors:
-                        raise ValidationError(errors)
-
-                    # if it's a local resource - use the path to resolve the slug_field on the model
-                    uri = data[self.url_field_name]
-                    if not Model.is_external(uri):
-                        http_prefix = uri.startswith(('http:', 'https:'))
+                            validate_method = getattr(self, 'validate_' + field.field_name, None)
+                            primitive_value = field.get_value(data)
+                            try:
+                                validated_value = field.run_validation(primitive_value)
+                                if validate_method is not None:
+                                    validated_value = validate_method(validated_value)
+                            except ValidationError as exc:
+                                errors[field.field_name] = exc.detail
+                            except DjangoValidationError as exc:
+                                errors[field.field_name] = get_error_detail(exc)
+                            except SkipField:
+                                pass
+                            else:
+                                set_value(ret, field.source_attrs, validated_value)
+
+                        if errors:
+                            raise ValidationError(errors)
+
+                        # if it's a local resource - use the path to resolve the slug_field on the model
+                        uri = data[self.url_field_name]
+                        if not Model.is_external(uri):
+                            http_prefix = uri.startswith(('http:', 'https:'))
+
+                            if http_prefix:
+                                uri = parse.urlparse(uri).path
+                                prefix = get_script_prefix()
+                                if uri.startswith(prefix):
+                                    uri = '/' + uri[len(prefix):]
 
-                        if http_prefix:
-                            uri = parse.urlparse(uri).path
-                            prefix = get_script_prefix()
-                            if uri.startswith(prefix):
-                                uri = '/' + uri[len(prefix):]
+                            try:
+                                match = resolve(uri_to_iri(uri))
+                                slug_field = Model.slug_field(self.__class__.Meta.model)
+                                ret[slug_field] = match.kwargs[slug_field]
+                            except Resolver404:
+                                pass
 
-                        try:
-                            match = resolve(uri_to_iri(uri))
-                            slug_field = Model.slug_field(self.__class__.Meta.model)
-                            ret[slug_field] = match.kwargs[slug_field]
-                        except Resolver404:
-                            pass
+                        if 'urlid' in data:
+                            ret['urlid'] = data['urlid']
 
-                    if 'urlid' in data:
-                        ret['urlid'] = data['urlid']
+                    else:
+                        ret = super().to_internal_value(data)
 
-                else:
-                    ret = super().to_internal_value(data)
+                    # copy url_field_name value to urlid, if necessary
+                    if self.url_field_name in data and not 'urlid' in data and data[self.url_field_name].startswith('http'):
+                        ret['urlid'] = data[self.url_field_name]
 
-                # copy url_field_name value to urlid, if necessary
-                if self.url_field_name in data and not 'urlid' in data and data[self.url_field_name].startswith('http'):
-                    ret['urlid'] = data[self.url_field_name]
+                    return ret
 
-                return ret
+            _nested_serializer_classes[key] = NestedLDPSerializer
 
         kwargs = get_nested_relation_kwargs(relation_info)
         kwargs['read_only'] = False
         kwargs['required'] = False
-        return NestedLDPSerializer, kwargs
+        return _nested_serializer_classes[key], kwargs
 
     @classmethod
     def many_init(cls, *args, **kwargs):
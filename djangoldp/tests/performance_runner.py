@@ -22,7 +22,8 @@ test_runner = DiscoverRunner(verbosity=1)
 
 failures = test_runner.run_tests([
     # 'djangoldp.tests.tests_performance',
-    'djangoldp.tests.tests_perf_get'
+    'djangoldp.tests.tests_perf_get',
+    'djangoldp.tests.tests_perf_parser'
 ])
 if failures:
     sys.exit(failures)
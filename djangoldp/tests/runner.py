@@ -43,6 +43,8 @@ failures = test_runner.run_tests([
     'djangoldp.tests.test_prefer_options',
     'djangoldp.tests.test_pagination_cors',
     'djangoldp.tests.test_renderers_parsers',
+    'djangoldp.tests.tests_contexts',
+    'djangoldp.tests.tests_http_client',
 ])
 if failures:
     sys.exit(failures)
@@ -11,13 +11,20 @@ import json
 from datetime import datetime, timedelta
 from time import sleep
 
+from unittest.mock import patch
+
 from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Group
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from django.utils.http import http_date
 from rest_framework.test import APIClient, APIRequestFactory, APITestCase
 
-from djangoldp.etag import generate_etag, generate_container_etag, normalize_etag
-from djangoldp.serializers import GLOBAL_SERIALIZER_CACHE
-from djangoldp.tests.models import Post
+from djangoldp.etag import generate_etag, generate_container_etag, get_container_stats, normalize_etag
+from djangoldp.journal import GLOBAL_CHANGE_JOURNAL, get_journal_models
+from djangoldp.serializers import GLOBAL_SERIALIZER_CACHE, LDPSerializer
+from djangoldp.tests.models import Batch, Invoice, Post, Task
+from djangoldp.views.ldp_viewset import LDPViewSet
 
 
 class TestETagCompliance(APITestCase):
@@ -195,6 +202,26 @@ class TestETagCompliance(APITestCase):
         # 304 responses should not have a body
         self.assertEqual(len(response.content), 0)
 
+    def test_if_none_match_get_304_without_serializing(self):
+        """Test that a 304 for a resource is answered from its modification time, without serializing it."""
+        post = Post.objects.create(content="test content")
+        etag = self.client.get(f'/posts/{post.pk}/', content_type='application/ld+json')['ETag']
+
+        with patch.object(LDPSerializer, 'to_representation') as to_representation:
+            response = self.client.get(f'/posts/{post.pk}/', content_type='application/ld+json',
+                                       HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+        to_representation.assert_not_called()
+
+        # a changed resource is still served, with its relations
+        post.content = "updated content"
+        post.save()
+        response = self.client.get(f'/posts/{post.pk}/', content_type='application/ld+json', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['content'], 'updated content')
+        self.assertNotEqual(response['ETag'], etag)
+
     def test_if_none_match_put_412(self):
         """Test If-None-Match returns 412 for PUT when ETag matches."""
         post = Post.objects.create(content="original content")
@@ -353,6 +380,45 @@ class TestETagCompliance(APITestCase):
         # ETags should be different
         self.assertNotEqual(etag1, etag2)
 
+    def test_container_if_none_match_304(self):
+        """Test If-None-Match returns 304 for an unchanged container, or page, without fetching its objects."""
+        for i in range(8):
+            Post.objects.create(content=f"post {i}")
+        etag = self.client.get('/posts/?p=2', content_type='application/ld+json')['ETag']
+        self.assertNotEqual(etag, self.client.get('/posts/', content_type='application/ld+json')['ETag'])
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/posts/?p=2', content_type='application/ld+json', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+        self.assertEqual(len(response.content), 0)
+        self.assertFalse([query for query in queries.captured_queries if 'LIMIT' in query['sql']])
+
+        # the container changes when one of its objects is removed
+        Post.objects.first().delete()
+        response = self.client.get('/posts/?p=2', content_type='application/ld+json', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['ldp:contains']), 2)
+
+    def test_container_without_updated_at_if_none_match(self):
+        """Test the ETag of a container of a model without updated_at changes with its objects."""
+        group = Group.objects.create(name='readers')
+        response = self.client.get('/groups/', content_type='application/ld+json')
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+
+        response = self.client.get('/groups/', content_type='application/ld+json', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+
+        # renaming a group changes neither the count of the container nor its query
+        group.name = 'writers'
+        group.save()
+        response = self.client.get('/groups/', content_type='application/ld+json', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['ldp:contains'][0]['name'], 'writers')
+        self.assertNotEqual(response['ETag'], etag)
+
     # ===== Concurrent Update Prevention Tests =====
 
     def test_concurrent_update_prevention(self):
@@ -502,6 +568,40 @@ class TestETagUtilities(APITestCase):
         # ETags should be different for different pages
         self.assertNotEqual(etag_page1, etag_page2)
 
+    def test_container_stats(self):
+        """Test that the count and latest modification time of a container are aggregated in one query."""
+        posts = [Post.objects.create(content=f"post {i}") for i in range(3)]
+        queryset = Post.objects.all()
+        with self.assertNumQueries(1):
+            stats = get_container_stats(queryset)
+        self.assertEqual(stats, {'count': 3, 'latest_updated': posts[-1].updated_at, 'exact': True})
+        with self.assertNumQueries(0):
+            etag = generate_container_etag(queryset, stats['count'], latest_updated=stats['latest_updated'])
+        self.assertEqual(etag, generate_container_etag(queryset, 3))
+
+        # the count can be bounded
+        self.assertEqual(get_container_stats(queryset, count_limit=2)['count'], 3)
+        self.assertFalse(get_container_stats(queryset, count_limit=2)['exact'])
+        self.assertTrue(get_container_stats(queryset, count_limit=3)['exact'])
+
+    def test_container_counted_once(self):
+        """Test that listing a paginated container counts its objects once, for the ETag and the paginator."""
+        for i in range(8):
+            Post.objects.create(content=f"post {i}")
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/posts/?p=2', content_type='application/ld+json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['ldp:contains']), 3)
+        counts = [query['sql'] for query in queries.captured_queries if 'COUNT(' in query['sql']]
+        self.assertEqual(len(counts), 1)
+        self.assertIn('MAX(', counts[0])
+
+        # above the limit, the objects aren't counted exactly, and are counted by the paginator
+        with patch.object(LDPViewSet, 'container_count_limit', 5):
+            response = self.client.get('/posts/?p=2', content_type='application/ld+json')
+        self.assertEqual(len(response.data['ldp:contains']), 3)
+        self.assertIn('rel="last"', response['Link'])
+
     def test_generate_etag_deterministic(self):
         """Test that ETag generation is deterministic."""
         post = Post.objects.create(content="test content")
@@ -514,3 +614,69 @@ class TestETagUtilities(APITestCase):
         # All should be the same
         self.assertEqual(etag1, etag2)
         self.assertEqual(etag2, etag3)
+
+
+class TestChangeJournal(APITestCase):
+    """Test the container ETags computed from the change journal."""
+
+    def setUp(self):
+        self.client = APIClient()
+        patcher = patch.object(GLOBAL_CHANGE_JOURNAL, 'alias', 'default')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(GLOBAL_CHANGE_JOURNAL.backend.clear)
+        GLOBAL_SERIALIZER_CACHE.reset()
+
+    def test_versions_bumped_on_changes(self):
+        """Test that saving, deleting or relating an instance changes the version of its model."""
+        labels = get_journal_models(Post)
+        self.assertIn(Post._meta.label, labels)
+        self.assertIn(get_user_model()._meta.label, labels)
+
+        versions = GLOBAL_CHANGE_JOURNAL.get_versions(labels)
+        self.assertEqual(GLOBAL_CHANGE_JOURNAL.get_versions(labels), versions)
+        post = Post.objects.create(content="post")
+        changed = GLOBAL_CHANGE_JOURNAL.get_versions(labels)
+        self.assertNotEqual(changed, versions)
+        post.delete()
+        self.assertNotEqual(GLOBAL_CHANGE_JOURNAL.get_versions(labels), changed)
+
+    def test_nested_relation_changes_container(self):
+        """Test the journal ETag of a container changes with the objects nested in its nested objects."""
+        invoice = Invoice.objects.create(title='invoice')
+        batch = Batch.objects.create(invoice=invoice, title='batch')
+        task = Task.objects.create(batch=batch, title='task')
+        self.assertIn(Task._meta.label, get_journal_models(Invoice, Invoice._meta.depth))
+
+        etag = self.client.get('/invoices/', content_type='application/ld+json')['ETag']
+        task.title = 'new title'
+        task.save()
+        response = self.client.get('/invoices/', content_type='application/ld+json', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_container_304_without_queries(self):
+        """Test If-None-Match returns 304 for a container from the change journal, without querying it."""
+        for i in range(6):
+            Post.objects.create(content=f"post {i}")
+        response = self.client.get('/posts/', content_type='application/ld+json')
+        etag = response['ETag']
+        self.assertEqual(self.client.get('/posts/', content_type='application/ld+json')['ETag'], etag)
+
+        with self.assertNumQueries(0):
+            response = self.client.get('/posts/', content_type='application/ld+json', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+
+        # the ETag depends on the page and on the user
+        self.assertNotEqual(self.client.get('/posts/?p=2', content_type='application/ld+json')['ETag'], etag)
+        self.client.force_authenticate(get_user_model().objects.create_user(username='journal', password='pass'))
+        response = self.client.get('/posts/', content_type='application/ld+json', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+
+        # a change on the model is a change of the container
+        Post.objects.first().delete()
+        response = self.client.get('/posts/', content_type='application/ld+json', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['ldp:contains']), 5)
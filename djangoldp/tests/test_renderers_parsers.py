@@ -5,15 +5,24 @@ Tests both JSON-LD and Turtle renderers/parsers in isolation.
 """
 
 import json
+import unittest
+from datetime import datetime, timezone
+from decimal import Decimal
 from io import BytesIO
 from unittest.mock import Mock, patch
 
 from django.conf import settings
 from django.test import TestCase, override_settings
+from pyld import jsonld
+from rdflib import Graph
+from rdflib.compare import isomorphic
 from rest_framework.exceptions import ParseError
+from rest_framework.relations import Hyperlink
+from rest_framework.utils.serializer_helpers import ReturnDict
 
-from djangoldp.parsers import JSONLDParser, TurtleParser
-from djangoldp.renderers import JSONLDRenderer, TurtleRenderer
+from djangoldp.contexts import GLOBAL_CONTEXT_STORE
+from djangoldp.parsers import JSONLDParser, TurtleParser, _compact_shapes
+from djangoldp.renderers import JSON_ENCODERS, JSONLDRenderer, TurtleRenderer, UnsupportedJsonLd
 
 
 class TestJSONLDRenderer(TestCase):
@@ -132,6 +141,42 @@ class TestJSONLDRenderer(TestCase):
         self.assertIsNotNone(result)  # Just verify it doesn't crash
 
 
+class TestJSONLDRendererEncoders(TestCase):
+    """Test the rendering of JSON-LD with the optional JSON encoders."""
+
+    def setUp(self):
+        self.renderer = JSONLDRenderer()
+        self.data = ReturnDict({
+            '@context': {'custom': 'http://example.org/custom#'},
+            '@id': Hyperlink('http://example.org/resource/1', None),
+            'date': datetime(2024, 1, 1, 12, 30, 15, 5, tzinfo=timezone.utc),
+            'price': Decimal('9.99'),
+            'permissions': {'view'},
+            'content': 'line\u2028separated, \u00e9',
+            'nested': [{'@id': 'http://example.org/resource/2', 'empty': None}]
+        }, serializer=None)
+
+    @unittest.skipUnless(JSON_ENCODERS['orjson'], 'orjson is not installed')
+    def test_orjson(self):
+        expected = self.renderer.render(self.data)
+        with patch.object(JSONLDRenderer, 'json_encoder', 'orjson'):
+            self.assertEqual(self.renderer.render(self.data), expected)
+            # indented output is left to DRF
+            self.assertEqual(self.renderer.render(self.data, 'application/ld+json; indent=2'),
+                             JSONLDRenderer().render(self.data, 'application/ld+json; indent=2'))
+        self.assertEqual(list(json.loads(expected))[0], '@context')
+        self.assertEqual(json.loads(expected)['date'], '2024-01-01T12:30:15.000005Z')
+
+    def test_missing_encoder(self):
+        expected = self.renderer.render(self.data)
+        with patch.dict(JSON_ENCODERS, {'ujson': None}), patch.object(JSONLDRenderer, 'json_encoder', 'ujson'):
+            self.assertEqual(self.renderer.render(self.data), expected)
+
+    def test_empty_data(self):
+        with patch.object(JSONLDRenderer, 'json_encoder', 'orjson'):
+            self.assertEqual(json.loads(self.renderer.render({})), {'@context': settings.LDP_RDF_CONTEXT})
+
+
 class TestJSONLDParser(TestCase):
     """Test JSONLDParser class."""
 
@@ -185,6 +230,62 @@ class TestJSONLDParser(TestCase):
         self.assertIn("Invalid JSON-LD", str(cm.exception))
 
 
+class TestJSONLDParserFastPath(TestCase):
+    """Test the skipping of the compaction of already compact payloads."""
+
+    context = {'@context': {'@vocab': 'https://cdn.startinblox.com/owl#', 'ldp': 'http://www.w3.org/ns/ldp#',
+                            'owner': {'@type': '@id'}}}
+
+    def setUp(self):
+        self.parser = JSONLDParser()
+        # serve the context without fetching it
+        GLOBAL_CONTEXT_STORE.set(settings.LDP_RDF_CONTEXT, {'contextUrl': None, 'documentUrl': settings.LDP_RDF_CONTEXT,
+                                                            'document': self.context})
+        self.addCleanup(GLOBAL_CONTEXT_STORE.documents.pop, settings.LDP_RDF_CONTEXT)
+        self.addCleanup(_compact_shapes.clear)
+        _compact_shapes.clear()
+
+    def parse(self, data):
+        from pyld import jsonld
+        with patch('djangoldp.parsers.jsonld.compact', wraps=jsonld.compact) as compact:
+            result = self.parser.parse(BytesIO(json.dumps(data).encode('utf-8')))
+        self.assertEqual(result, jsonld.compact(data, ctx=settings.LDP_RDF_CONTEXT))
+        return compact.call_count
+
+    def payload(self, name, pk):
+        return {'@context': settings.LDP_RDF_CONTEXT, '@id': f'http://happy-dev.fr/circles/{pk}/',
+                'name': name, 'owner': 'http://happy-dev.fr/users/1/', 'ldp:contains': [{'@id': '1'}, {'@id': '2'}]}
+
+    def test_compact_payload(self):
+        self.assertEqual(self.parse(self.payload('first', 1)), 1)
+        # compaction is skipped for payloads of the same shape, which it leaves unchanged
+        self.assertEqual(self.parse(self.payload('second', 2)), 0)
+        self.assertEqual(self.parse(self.payload('third: a title', 3)), 0)
+
+    def test_expanded_payload(self):
+        data = {'@context': settings.LDP_RDF_CONTEXT, 'https://cdn.startinblox.com/owl#name': 'expanded'}
+        self.assertEqual(self.parse(data), 1)
+        self.assertEqual(self.parse(data), 1)
+
+    def test_new_shape(self):
+        self.assertEqual(self.parse(self.payload('first', 1)), 1)
+        data = self.payload('other namespace', 2)
+        data['owner'] = 'http://www.w3.org/ns/ldp#owner'
+        self.assertEqual(self.parse(data), 1)
+        data = self.payload('other type', 3)
+        data['@type'] = 'http://www.w3.org/ns/ldp#Container'
+        self.assertEqual(self.parse(data), 1)
+
+    def test_settings(self):
+        data = self.payload('first', 1)
+        with patch.object(JSONLDParser, 'fast_path', False):
+            self.assertEqual(self.parse(data), 1)
+            self.assertEqual(self.parse(data), 1)
+        # without strict mode, payloads using the server context are trusted to be compact
+        with patch.object(JSONLDParser, 'strict', False):
+            self.assertEqual(self.parse(data), 0)
+
+
 class TestTurtleRenderer(TestCase):
     """Test TurtleRenderer class."""
 
@@ -315,6 +416,72 @@ class TestTurtleRenderer(TestCase):
         self.assertIn('resource/2', content)
 
 
+class TestTurtleWriter(TestCase):
+    """Test the writing of Turtle without an rdflib graph."""
+
+    context = {'@context': {'@vocab': 'https://cdn.startinblox.com/owl#', 'ldp': 'http://www.w3.org/ns/ldp#',
+                            'foaf': 'http://xmlns.com/foaf/0.1/', 'xsd': 'http://www.w3.org/2001/XMLSchema#',
+                            'owner': {'@type': '@id'}, 'kind': {'@type': '@vocab'},
+                            'creation_date': {'@type': 'xsd:dateTime'}}}
+
+    def setUp(self):
+        self.renderer = TurtleRenderer()
+        # serve the context without fetching it
+        GLOBAL_CONTEXT_STORE.set(settings.LDP_RDF_CONTEXT, {'contextUrl': None, 'documentUrl': settings.LDP_RDF_CONTEXT,
+                                                            'document': self.context})
+        self.addCleanup(GLOBAL_CONTEXT_STORE.documents.pop, settings.LDP_RDF_CONTEXT)
+
+    def get_rdflib_graph(self, data):
+        data = dict(data, **{'@context': settings.LDP_RDF_CONTEXT})
+        return Graph().parse(data=json.dumps(jsonld.expand(data)), format='json-ld')
+
+    def assertSameTriples(self, data):
+        with patch.object(TurtleRenderer, 'simple_jsonld_to_turtle') as fallback, \
+                patch('djangoldp.renderers.Graph') as graph:
+            turtle = self.renderer.render(data)
+        graph.assert_not_called()
+        fallback.assert_not_called()
+        self.assertTrue(isomorphic(Graph().parse(data=turtle, format='turtle'), self.get_rdflib_graph(data)))
+        return turtle.decode('utf-8')
+
+    def test_container(self):
+        data = {'@id': 'http://happy-dev.fr/circles/', '@type': 'ldp:Container', 'ldp:contains': [
+            {'@id': f'http://happy-dev.fr/circles/{pk}/', '@type': 'foaf:Group', 'name': f'circle "{pk}"\nline',
+             'owner': 'http://happy-dev.fr/users/1/', 'kind': 'Circle', 'public': pk == 1, 'order': pk,
+             'score': 1.5 * pk, 'description': None, 'creation_date': '2024-01-01T00:00:00Z',
+             'members': {'@id': f'http://happy-dev.fr/circles/{pk}/members/',
+                         'ldp:contains': [{'@id': 'http://happy-dev.fr/users/1/', 'username': 'admin'}]},
+             'permissions': ['view', 'add'], 'address': {'city': 'Paris'},
+             'title': {'@value': 'cercle', '@language': 'fr'}}
+            for pk in (1, 2)]}
+        turtle = self.assertSameTriples(data)
+        # the IRIs are shortened with the prefixes of the context
+        self.assertIn('@prefix ldp: <http://www.w3.org/ns/ldp#> .', turtle)
+        self.assertIn('<http://happy-dev.fr/circles/> a ldp:Container', turtle)
+
+    def test_expanded_properties(self):
+        self.assertSameTriples({'@id': 'http://example.org/resource/1', 'http://example.org/title': 'Test',
+                                'foaf:knows': {'@id': '_:someone', 'foaf:name': 'someone'}})
+
+    def test_unsupported(self):
+        for data in ({'@id': 'http://example.org/resource/1', 'items': {'@list': ['a', 'b']}},
+                     {'@id': 'relative/1', 'name': 'relative'},
+                     {'@id': 'http://example.org/resource/1', 'http://example.org/with space': 'invalid IRI'},
+                     {'@id': 'http://example.org/resource/1'}):
+            with self.assertRaises(UnsupportedJsonLd):
+                self.renderer.write_turtle(dict(data, **{'@context': settings.LDP_RDF_CONTEXT}))
+            # the data is rendered through rdflib instead
+            self.assertIsInstance(self.renderer.render(data), bytes)
+
+    def test_settings(self):
+        data = {'@id': 'http://example.org/resource/1', 'name': 'Test'}
+        with patch.object(TurtleRenderer, 'direct_writer', False), \
+                patch.object(TurtleRenderer, 'write_turtle') as write_turtle:
+            turtle = self.renderer.render(data)
+        write_turtle.assert_not_called()
+        self.assertTrue(isomorphic(Graph().parse(data=turtle, format='turtle'), self.get_rdflib_graph(data)))
+
+
 class TestTurtleParser(TestCase):
     """Test TurtleParser class."""
 
@@ -1,9 +1,15 @@
 import copy
+import threading
 import time
 import uuid
+from datetime import timedelta
+from unittest.mock import patch
+from urllib.parse import urlparse
 
 from django.contrib.auth import get_user_model
-from django.test import override_settings
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from requests import Response
 from rest_framework.test import APIClient, APITestCase
 
 from djangoldp.activities.services import (BACKLINKS_ACTOR, ActivityPubService,
@@ -133,6 +139,37 @@ class TestsBacklinksService(APITestCase):
         obj = 'https://test.com/users/test/'
         send_two_activities_and_assert_old_discarded(obj)
 
+    def test_scheduled_activity_object_target_ids(self):
+        a = {'type': 'Remove', 'actor': {'type': 'Service', 'name': 'Backlinks Service'},
+             'object': 'https://api.test2.startinblox.com/users/calum/',
+             'origin': {'@type': 'hd:skill', '@id': 'https://api.test1.startinblox.com/skills/' + 'x' * 300}}
+        scheduled = ActivityQueueService._save_sent_activity(a, ScheduledActivity)
+        self.assertEqual(scheduled.object_id, 'https://api.test2.startinblox.com/users/calum/')
+        # ids too long for the column are hashed
+        self.assertTrue(scheduled.target_id.startswith('sha256:'))
+        self.assertEqual(scheduled.target_id, ScheduledActivity.get_normalized_id(a['origin']['@id']))
+
+    def test_supersession_checked_in_one_query(self):
+        inbox = 'https://distant.com/inbox/'
+        activity = ActivityPubService.build_activity(BACKLINKS_ACTOR, {'@id': 'https://test.com/circles/1/'},
+                                                     activity_type='Create', summary='old')
+        scheduled = ActivityQueueService._save_sent_activity(activity, ScheduledActivity, external_id=inbox)
+        for i in range(2, 20):
+            other = ActivityPubService.build_activity(BACKLINKS_ACTOR, {'@id': 'https://test.com/circles/{}/'.format(i)},
+                                                      activity_type='Update', summary='other')
+            ActivityQueueService._save_sent_activity(other, ScheduledActivity, external_id=inbox)
+
+        # the later activities on other objects don't supersede it, and aren't loaded to find it out
+        with self.assertNumQueries(1), patch.object(ScheduledActivity, 'to_activitystream') as decode:
+            self.assertTrue(ActivityQueueService._is_worth_sending(inbox, scheduled))
+        decode.assert_not_called()
+
+        newer = ActivityPubService.build_activity(BACKLINKS_ACTOR, {'@id': 'https://test.com/circles/1/'},
+                                                  activity_type='Update', summary='new')
+        ActivityQueueService._save_sent_activity(newer, ScheduledActivity, external_id=inbox)
+        self.assertFalse(ActivityQueueService._is_worth_sending(inbox, scheduled))
+        self.assertFalse(ScheduledActivity.objects.filter(pk=scheduled.pk).exists())
+
     # test that older ScheduledActivity is still sent if it's on a different object
     @override_settings(SEND_BACKLINKS=True, DISABLE_OUTBOX='DEBUG')
     def test_old_valid_scheduled_activity_sent(self):
@@ -323,3 +360,258 @@ class TestsBacklinksService(APITestCase):
         ActivityQueueService._activity_queue_worker('https://distant.com/inbox/', scheduled)
         self.assertEqual(ScheduledActivity.objects.count(), 0)
         self.assertEqual(Activity.objects.count(), 1)
+
+    def _schedule_adds(self, inbox, count):
+        '''Auxiliary function schedules Add activities of distinct users to the inbox'''
+        scheduled = []
+        for i in range(count):
+            a = {'type': 'Add', 'actor': {'type': 'Service', 'name': 'Backlinks Service'},
+                 'object': {'@type': 'foaf:user', '@id': 'https://api.test2.startinblox.com/users/' + str(uuid.uuid4())},
+                 'target': {'@type': 'hd:circle', '@id': 'https://api.test1.startinblox.com/circles/1/'}}
+            scheduled.append(ActivityQueueService._save_sent_activity(a, ScheduledActivity, type='add',
+                                                                      external_id=inbox))
+        return scheduled
+
+    def _get_response(self, status_code):
+        response = Response()
+        response.status_code = status_code
+        response._content = b''
+        return response
+
+    def test_batch_sent_in_one_delivery(self):
+        inbox = 'https://batching.com/inbox/'
+        scheduled = self._schedule_adds(inbox, 3)
+        with patch.object(ActivityQueueService, 'do_post', return_value=self._get_response(200)) as do_post:
+            ActivityQueueService._send_batch(inbox, scheduled)
+
+        self.assertEqual(do_post.call_count, 1)
+        collection = do_post.call_args[0][1]
+        self.assertEqual(collection['type'], 'OrderedCollection')
+        self.assertEqual(collection['totalItems'], 3)
+        self.assertEqual([item['object']['@id'] for item in collection['orderedItems']],
+                         [s.to_activitystream()['object']['@id'] for s in scheduled])
+        self.assertEqual(ScheduledActivity.objects.count(), 0)
+
+    def test_refused_batch_sent_one_by_one(self):
+        inbox = 'https://old-peer.com/inbox/'
+        self.addCleanup(ActivityQueueService.unbatched_hosts.pop, 'old-peer.com', None)
+        scheduled = self._schedule_adds(inbox, 3)
+        responses = [self._get_response(status_code) for status_code in (415, 201, 201, 201)]
+        with patch.object(ActivityQueueService, 'do_post', side_effect=responses) as do_post:
+            ActivityQueueService._send_batch(inbox, scheduled)
+
+        # the collection, then each activity
+        self.assertEqual(do_post.call_count, 4)
+        self.assertEqual([call[0][1]['type'] for call in do_post.call_args_list],
+                         ['OrderedCollection', 'Add', 'Add', 'Add'])
+        self.assertEqual(ScheduledActivity.objects.count(), 0)
+        self.assertIn('old-peer.com', ActivityQueueService.unbatched_hosts)
+        self.assertTrue(ActivityQueueService._is_unbatched(inbox))
+
+        # the host is sent batches again once the mark expired
+        ActivityQueueService.unbatched_hosts['old-peer.com'] = time.monotonic() - 1
+        self.assertFalse(ActivityQueueService._is_unbatched(inbox))
+        self.assertNotIn('old-peer.com', ActivityQueueService.unbatched_hosts)
+
+    def test_undelivered_batch_rescheduled(self):
+        inbox = 'https://unavailable.com/inbox/'
+        self.addCleanup(ActivityQueueService.unbatched_hosts.pop, 'unavailable.com', None)
+        for side_effect in [[self._get_response(503)], ValueError('boom')]:
+            scheduled = self._schedule_adds(inbox, 3)
+            with patch.object(ActivityQueueService, 'do_post', side_effect=side_effect) as do_post, \
+                    patch.object(ActivityQueueService, '_push_to_queue') as push:
+                ActivityQueueService._send_batch(inbox, scheduled)
+
+            # the activities are retried later with their backoff, rather than sent one by one to a failing inbox
+            self.assertEqual(do_post.call_count, 1)
+            self.assertEqual([call[0][1] for call in push.call_args_list], scheduled)
+            for activity in scheduled:
+                activity.refresh_from_db()
+                self.assertEqual(activity.failed_attempts, 1)
+            self.assertNotIn('unavailable.com', ActivityQueueService.unbatched_hosts)
+            ScheduledActivity.objects.all().delete()
+
+    def test_batch_refused_with_bad_request(self):
+        inbox = 'https://bad-request.com/inbox/'
+        self.addCleanup(ActivityQueueService.unbatched_hosts.pop, 'bad-request.com', None)
+
+        # an activity of the batch is refused alone as well: the inbox understands batches
+        responses = [self._get_response(status_code) for status_code in (400, 201, 400, 201)]
+        with patch.object(ActivityQueueService, 'do_post', side_effect=responses) as do_post:
+            ActivityQueueService._send_batch(inbox, self._schedule_adds(inbox, 3))
+        self.assertEqual(do_post.call_count, 4)
+        self.assertNotIn('bad-request.com', ActivityQueueService.unbatched_hosts)
+
+        # all the activities are accepted alone: the inbox answers 400 to any batch, and isn't sent batches anymore
+        responses = [self._get_response(status_code) for status_code in (400, 201, 201, 201)]
+        with patch.object(ActivityQueueService, 'do_post', side_effect=responses) as do_post:
+            ActivityQueueService._send_batch(inbox, self._schedule_adds(inbox, 3))
+        self.assertEqual(do_post.call_count, 4)
+        self.assertIn('bad-request.com', ActivityQueueService.unbatched_hosts)
+
+
+class TestsActivityQueue(TestCase):
+
+    def setUp(self):
+        # restarts the queue with two workers, which record the activities instead of sending them
+        ActivityQueueService.stop()
+        self.addCleanup(ActivityQueueService.stop)
+        self.sent = []
+        self.slow = threading.Event()
+        patcher = patch.object(ActivityQueueService, '_activity_queue_worker', side_effect=self.send)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        ActivityQueueService.start(workers=2)
+
+    def send(self, url, activity):
+        if activity == 'slow':
+            self.slow.wait(5)
+        self.sent.append((urlparse(url).netloc, activity))
+
+    def get_inboxes(self):
+        '''returns the inboxes of two hosts sent to by different workers'''
+        hosts = ['host{}.com'.format(i) for i in range(10)]
+        first = hosts[0]
+        other = next(host for host in hosts if ActivityQueueService.get_shard('https://{}/'.format(host)) !=
+                     ActivityQueueService.get_shard('https://{}/'.format(first)))
+        return 'https://{}/inbox/'.format(first), 'https://{}/inbox/'.format(other)
+
+    def test_hosts_sent_in_parallel(self):
+        slow_inbox, fast_inbox = self.get_inboxes()
+        ActivityQueueService._push_to_queue(slow_inbox, 'slow', delay=0)
+        ActivityQueueService._push_to_queue(slow_inbox, 'after slow', delay=0)
+        for i in range(3):
+            ActivityQueueService._push_to_queue(fast_inbox, i, delay=0)
+
+        # the activities to the other host are sent while the slow one is in flight
+        for _ in range(50):
+            if len(self.sent) == 3:
+                break
+            time.sleep(0.05)
+        self.assertEqual([activity for _, activity in self.sent], [0, 1, 2])
+        stats = ActivityQueueService.stats()
+        self.assertEqual(stats['workers'], 2)
+        self.assertEqual(stats['in_flight'], 1)
+        self.assertEqual(stats['queued'], 1)
+
+        # the activities to an inbox are sent in order
+        self.slow.set()
+        ActivityQueueService.join()
+        self.assertEqual([activity for host, activity in self.sent if host == urlparse(slow_inbox).netloc],
+                         ['slow', 'after slow'])
+        self.assertEqual(ActivityQueueService.stats()['in_flight'], 0)
+
+    def test_worker_survives_errors(self):
+        inbox, _ = self.get_inboxes()
+        side_effect = [ValueError('boom'), None]
+        with patch.object(ActivityQueueService, '_activity_queue_worker', side_effect=side_effect) as worker:
+            ActivityQueueService._push_to_queue(inbox, 'failing', delay=0)
+            ActivityQueueService._push_to_queue(inbox, 'next', delay=0)
+            ActivityQueueService.join()
+        self.assertEqual(worker.call_count, 2)
+
+    def test_activities_batched_per_inbox(self):
+        inbox, other_inbox = self.get_inboxes()
+        batches = []
+        with patch.object(ActivityQueueService, 'batch_window', 0.1), \
+                patch.object(ActivityQueueService, '_send_batch',
+                             side_effect=lambda url, activities: batches.append(activities)):
+            for activity in ['a', 'b', 'c']:
+                ActivityQueueService._push_to_queue(inbox, activity, delay=0)
+            ActivityQueueService._push_to_queue(other_inbox, 'alone', delay=0)
+            ActivityQueueService.join()
+
+        # the activities to the same inbox are sent in a single batch, in order
+        self.assertEqual(batches, [['a', 'b', 'c']])
+        self.assertEqual(self.sent, [(urlparse(other_inbox).netloc, 'alone')])
+        self.assertEqual(ActivityQueueService.stats()['queued'], 0)
+
+    def test_batch_collects_inbox_in_order(self):
+        inbox, other_inbox = self.get_inboxes()
+        batches = {}
+        with patch.object(ActivityQueueService, 'batch_window', 60), \
+                patch.object(ActivityQueueService, 'batch_size', 2), \
+                patch.object(ActivityQueueService.scheduler, 'schedule') as schedule:
+            ready = [ActivityQueueService._collect_batch(item, batches)
+                     for item in [[inbox, 'a'], [other_inbox, 'x'], [inbox, 'b'], [inbox, 'c']]]
+
+            # the batch is sent once full, and its flush at the end of the window ignored
+            self.assertEqual(ready, [[], [], [(inbox, ['a', 'b'])], []])
+            flush = schedule.call_args_list[0][0][0]
+            self.assertEqual(ActivityQueueService._collect_batch(flush, batches), [])
+            self.assertEqual({url: batch for url, (_, batch) in batches.items()}, {other_inbox: ['x'], inbox: ['c']})
+
+            # an activity which can't be batched is sent after the batch opened for its inbox
+            retried = ScheduledActivity(failed_attempts=1)
+            self.assertEqual(ActivityQueueService._collect_batch([inbox, retried], batches),
+                             [(inbox, ['c']), (inbox, [retried])])
+            flush = schedule.call_args_list[1][0][0]
+            self.assertEqual(ActivityQueueService._collect_batch(flush, batches), [(other_inbox, ['x'])])
+        self.assertEqual(batches, {})
+
+    def test_batch_window_does_not_block_worker(self):
+        inbox, _ = self.get_inboxes()
+        shard = ActivityQueueService.get_shard(inbox)
+        hosts = [host for host in ['batch{}.com'.format(i) for i in range(40)]
+                 if ActivityQueueService.get_shard('https://{}/'.format(host)) == shard][:5]
+        batches = []
+        with patch.object(ActivityQueueService, 'batch_window', 0.2), \
+                patch.object(ActivityQueueService, '_send_batch',
+                             side_effect=lambda url, activities: batches.append(activities)):
+            start = time.time()
+            for host in hosts:
+                for activity in ['a', 'b']:
+                    ActivityQueueService._push_to_queue('https://{}/inbox/'.format(host), activity, delay=0)
+            ActivityQueueService.join()
+
+        # the inboxes of the shard are collected in the same window, not one window after the other
+        self.assertLess(time.time() - start, 0.2 * len(hosts))
+        self.assertEqual(batches, [['a', 'b']] * len(hosts))
+
+    def test_delayed_activity_does_not_block_worker(self):
+        inbox, _ = self.get_inboxes()
+        ActivityQueueService._push_to_queue(inbox, 'later', delay=0.5)
+        ActivityQueueService._push_to_queue(inbox, 'first', delay=0.2)
+        ActivityQueueService._push_to_queue(inbox, 'now', delay=0)
+
+        # the activity without delay is sent while the others are held until they are due
+        for _ in range(20):
+            if self.sent:
+                break
+            time.sleep(0.01)
+        self.assertEqual([activity for _, activity in self.sent], ['now'])
+        self.assertEqual(ActivityQueueService.stats()['scheduled'], 2)
+
+        ActivityQueueService.join()
+        self.assertEqual([activity for _, activity in self.sent], ['now', 'first', 'later'])
+        self.assertEqual(ActivityQueueService.stats()['scheduled'], 0)
+
+    def test_revive_restores_due_times(self):
+        a = {'type': 'Add', 'actor': {'type': 'Service', 'name': 'Backlinks Service'},
+             'object': {'@type': 'foaf:user', '@id': 'https://api.test2.startinblox.com/users/calum/'},
+             'target': {'@type': 'hd:skill', '@id': 'https://api.test1.startinblox.com/skills/3/'}}
+        due = ActivityQueueService._save_sent_activity(a, ScheduledActivity, external_id='https://distant.com/inbox/',
+                                                       due_at=timezone.now() + timedelta(seconds=60))
+        overdue = ActivityQueueService._save_sent_activity(a, ScheduledActivity, external_id='https://distant.com/inbox/',
+                                                           due_at=timezone.now() - timedelta(seconds=60))
+
+        with patch.object(ActivityQueueService, '_push_to_queue') as push:
+            ActivityQueueService.revive_activities()
+        delays = {call[0][1].pk: call[0][2] for call in push.call_args_list}
+        self.assertAlmostEqual(delays[due.pk], 60, delta=5)
+        self.assertEqual(delays[overdue.pk], 0)
+
+    def test_failed_activity_rescheduled_with_backoff(self):
+        a = {'type': 'Create', 'actor': {'type': 'Service', 'name': 'Backlinks Service'},
+             'object': {'@type': 'hd:circle', '@id': 'https://test.com/circles/8/'}}
+        scheduled = ActivityQueueService._save_sent_activity(a, ScheduledActivity,
+                                                             external_id='https://distant.com/inbox/')
+        scheduled.failed_attempts = 2
+        with patch.object(ActivityQueueService, '_push_to_queue') as push:
+            self.assertTrue(ActivityQueueService._attempt_failed_reschedule('https://distant.com/inbox/', scheduled, 4))
+
+        # the backoff is the delay of the activity, persisted as its due time
+        self.assertEqual(push.call_args[0][2], 8)
+        scheduled.refresh_from_db()
+        self.assertEqual(scheduled.failed_attempts, 3)
+        self.assertAlmostEqual((scheduled.due_at - timezone.now()).total_seconds(), 8, delta=2)
@@ -1,9 +1,18 @@
+import time
+from unittest.mock import patch
+
 from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Group
 from django.test import TestCase, override_settings
+from guardian.shortcuts import assign_perm
+from rest_framework.permissions import IsAuthenticated
 from rest_framework.test import APIClient, APIRequestFactory
 from rest_framework.utils import json
 
-from djangoldp.tests.models import Circle, Conversation, Project
+from djangoldp.serializers import GLOBAL_SERIALIZER_CACHE, DjangoCacheBackend, InMemoryCache, LDPSerializer
+from djangoldp.permissions import ACLPermissions, InheritPermissions, get_user_cache_vary
+from djangoldp.tests.models import AnonymousReadOnlyPost, Batch, Circle, Conversation, Invoice, OwnedResource, \
+    PermissionlessDummy, Project, ReadOnlyPost, RestrictedCircle, RestrictedResource
 
 
 class TestCache(TestCase):
@@ -269,3 +278,302 @@ class TestCache(TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertIn('@id', response.data)
         self.assertEqual(len(response.data['user_set']), 1)
+
+
+class TestCacheInvalidation(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(username='john', email='jlennon@beatles.com',
+                                                         password='glass onion')
+        self.client.force_authenticate(self.user)
+        GLOBAL_SERIALIZER_CACHE.reset()
+
+        self.invoice = Invoice.objects.create(title='invoice')
+        self.other_invoice = Invoice.objects.create(title='other invoice')
+        self.batch = Batch.objects.create(invoice=self.invoice, title='batch')
+        Batch.objects.create(invoice=self.other_invoice, title='other batch')
+
+        self.batches_id = 'http://happy-dev.fr/invoices/{}/batches/'.format(self.invoice.pk)
+        self.other_batches_id = 'http://happy-dev.fr/invoices/{}/batches/'.format(self.other_invoice.pk)
+        for container_id in (self.batches_id, self.other_batches_id):
+            response = self.client.get(container_id, content_type='application/ld+json')
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(GLOBAL_SERIALIZER_CACHE.has('tests.Batch', container_id))
+
+    def test_update_invalidates_containers_listing_instance(self):
+        self.batch.title = 'new title'
+        self.batch.save()
+
+        self.assertFalse(GLOBAL_SERIALIZER_CACHE.has('tests.Batch', self.batches_id))
+        self.assertTrue(GLOBAL_SERIALIZER_CACHE.has('tests.Batch', self.other_batches_id))
+
+    def test_update_relation_invalidates_model(self):
+        self.batch.invoice = self.other_invoice
+        self.batch.save()
+
+        self.assertFalse(GLOBAL_SERIALIZER_CACHE.has('tests.Batch', self.batches_id))
+        self.assertFalse(GLOBAL_SERIALIZER_CACHE.has('tests.Batch', self.other_batches_id))
+
+    def test_delete_invalidates_containers_listing_instance(self):
+        self.batch.delete()
+
+        self.assertFalse(GLOBAL_SERIALIZER_CACHE.has('tests.Batch', self.batches_id))
+        self.assertTrue(GLOBAL_SERIALIZER_CACHE.has('tests.Batch', self.other_batches_id))
+
+    def test_create_invalidates_model(self):
+        Batch.objects.create(invoice=self.invoice, title='new batch')
+
+        self.assertFalse(GLOBAL_SERIALIZER_CACHE.has('tests.Batch', self.batches_id))
+        self.assertFalse(GLOBAL_SERIALIZER_CACHE.has('tests.Batch', self.other_batches_id))
+
+    def test_update_invalidates_parent_containers(self):
+        response = self.client.get('/invoices/', content_type='application/ld+json')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(GLOBAL_SERIALIZER_CACHE.has('tests.Invoice', 'http://happy-dev.fr/invoices/'))
+
+        # the batches are embedded in the invoices container
+        self.batch.title = 'new title'
+        self.batch.save()
+        self.assertFalse(GLOBAL_SERIALIZER_CACHE.has('tests.Invoice', 'http://happy-dev.fr/invoices/'))
+
+
+@patch.object(LDPSerializer, 'with_resource_cache', True)
+class TestResourceCache(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(username='john', email='jlennon@beatles.com',
+                                                         password='glass onion')
+        self.client.force_authenticate(self.user)
+        GLOBAL_SERIALIZER_CACHE.reset()
+        self.invoice = Invoice.objects.create(title='invoice')
+        self.batch = Batch.objects.create(invoice=self.invoice, title='batch')
+
+    def test_resource_served_from_cache(self):
+        response = self.client.get('/batchs/{}/'.format(self.batch.pk), content_type='application/ld+json')
+        self.assertEqual(response.status_code, 200)
+        hits = GLOBAL_SERIALIZER_CACHE.stats()['hits']
+
+        response = self.client.get('/batchs/{}/'.format(self.batch.pk), content_type='application/ld+json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['title'], 'batch')
+        self.assertGreater(GLOBAL_SERIALIZER_CACHE.stats()['hits'], hits)
+
+    def test_resource_updated(self):
+        response = self.client.get('/batchs/{}/'.format(self.batch.pk), content_type='application/ld+json')
+        self.assertEqual(response.data['title'], 'batch')
+
+        self.batch.title = 'new title'
+        self.batch.save()
+        response = self.client.get('/batchs/{}/'.format(self.batch.pk), content_type='application/ld+json')
+        self.assertEqual(response.data['title'], 'new title')
+
+    def test_resource_nested_instance_updated(self):
+        response = self.client.get('/invoices/{}/'.format(self.invoice.pk), content_type='application/ld+json')
+        self.assertEqual(response.data['batches']['ldp:contains'][0]['title'], 'batch')
+
+        # the invoice itself doesn't change, but one of its nested batches does
+        self.batch.title = 'new title'
+        self.batch.save()
+        response = self.client.get('/invoices/{}/'.format(self.invoice.pk), content_type='application/ld+json')
+        self.assertEqual(response.data['batches']['ldp:contains'][0]['title'], 'new title')
+
+    def test_resource_cache_varies_on_user(self):
+        response = self.client.get('/batchs/{}/'.format(self.batch.pk), content_type='application/ld+json')
+        self.assertEqual(response.status_code, 200)
+        hits = GLOBAL_SERIALIZER_CACHE.stats()['hits']
+
+        self.client.force_authenticate(None)
+        response = self.client.get('/batchs/{}/'.format(self.batch.pk), content_type='application/ld+json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(GLOBAL_SERIALIZER_CACHE.stats()['hits'], hits)
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+                           'serializer': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                                          'LOCATION': 'djangoldp-tests-serializer'}})
+@patch.object(LDPSerializer, 'with_resource_cache', True)
+class TestSharedResourceCache(TestCase):
+    '''the resource cache with a shared backend, which doesn't index the instances embedded in a resource'''
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(username='john', email='jlennon@beatles.com',
+                                                         password='glass onion')
+        self.client.force_authenticate(self.user)
+        shared_cache = DjangoCacheBackend('serializer')
+        for module in ['djangoldp.serializers', 'djangoldp.serializers.mixins', 'djangoldp.serializers.model_serializer']:
+            patcher = patch(module + '.GLOBAL_SERIALIZER_CACHE', shared_cache)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        shared_cache.reset()
+        self.invoice = Invoice.objects.create(title='invoice')
+        self.batch = Batch.objects.create(invoice=self.invoice, title='batch')
+
+    def test_resource_nested_instance_updated(self):
+        response = self.client.get('/invoices/{}/'.format(self.invoice.pk), content_type='application/ld+json')
+        self.assertEqual(response.data['batches']['ldp:contains'][0]['title'], 'batch')
+
+        self.batch.title = 'new title'
+        self.batch.save()
+        response = self.client.get('/invoices/{}/'.format(self.invoice.pk), content_type='application/ld+json')
+        self.assertEqual(response.data['batches']['ldp:contains'][0]['title'], 'new title')
+
+
+class TestCacheVary(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(username='john', email='jlennon@beatles.com',
+                                                         password='glass onion')
+        self.other_user = get_user_model().objects.create_user(username='paul', email='paul@beatles.com',
+                                                               password='yesterday')
+        GLOBAL_SERIALIZER_CACHE.reset()
+
+    def get_as(self, user, url):
+        self.client.force_authenticate(user)
+        response = self.client.get(url, content_type='application/ld+json')
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def get_cached_varies(self, urlid):
+        return [vary for (_, cached_urlid, vary) in GLOBAL_SERIALIZER_CACHE.lru if cached_urlid == urlid]
+
+    def test_public_container_shared_between_users(self):
+        ReadOnlyPost.objects.create(content='post')
+        self.get_as(self.user, '/readonlyposts/')
+        self.assertTrue(GLOBAL_SERIALIZER_CACHE.has('tests.ReadOnlyPost', 'http://happy-dev.fr/readonlyposts/', 'public'))
+        self.get_as(self.other_user, '/readonlyposts/')
+        self.assertEqual(self.get_cached_varies('http://happy-dev.fr/readonlyposts/'), ['public'])
+
+    def test_anonymous_container_not_shared_with_authenticated_users(self):
+        AnonymousReadOnlyPost.objects.create(content='post')
+        self.get_as(self.user, '/anonymousreadonlyposts/')
+        self.get_as(self.other_user, '/anonymousreadonlyposts/')
+        self.assertEqual(len(self.get_cached_varies('http://happy-dev.fr/anonymousreadonlyposts/')), 1)
+        self.get_as(None, '/anonymousreadonlyposts/')
+        self.assertEqual(len(self.get_cached_varies('http://happy-dev.fr/anonymousreadonlyposts/')), 2)
+
+    def test_owned_container_private_to_users(self):
+        OwnedResource.objects.create(description='resource', user=self.user)
+        response = self.get_as(self.user, '/ownedresources/')
+        self.assertEqual(len(response.data['ldp:contains']), 1)
+        response = self.get_as(self.other_user, '/ownedresources/')
+        self.assertEqual(len(response.data['ldp:contains']), 0)
+        self.assertEqual(len(self.get_cached_varies('http://happy-dev.fr/ownedresources/')), 2)
+
+    def test_acl_vary_on_groups(self):
+        group = Group.objects.create(name='readers')
+        for user in (self.user, self.other_user):
+            user.groups.add(group)
+        request = APIRequestFactory().get('/')
+        varies = []
+        for user in (self.user, self.other_user):
+            request.user = get_user_model().objects.get(pk=user.pk)
+            varies.append(ACLPermissions().get_cache_vary(request, PermissionlessDummy))
+        self.assertEqual(varies, ['groups:{}'.format(group.pk)] * 2)
+
+        assign_perm('view_permissionlessdummy', self.user, PermissionlessDummy.objects.create(some='dummy'))
+        request.user = get_user_model().objects.get(pk=self.user.pk)
+        self.assertEqual(ACLPermissions().get_cache_vary(request, PermissionlessDummy), 'user:{}'.format(self.user.pk))
+
+    def test_inherit_vary_on_drf_permission(self):
+        # a parent model protected by a permission of DRF, which has no cache vary of its own
+        request = APIRequestFactory().get('/')
+        request.user = self.user
+        with patch.object(RestrictedCircle._meta, 'permission_classes', [IsAuthenticated]):
+            vary = InheritPermissions().get_cache_vary(request, RestrictedResource)
+        self.assertEqual(vary, 'inherit({})'.format(get_user_cache_vary(self.user)))
+
+
+class TestInMemoryCache(TestCase):
+
+    def test_lru_eviction(self):
+        cache = InMemoryCache(max_records=2)
+        cache.set('tests.Circle', '/circles/', 'john', {'ldp:contains': []})
+        cache.set('tests.Circle', '/circles/1/members/', 'john', {'ldp:contains': []})
+        # access the first entry, so that the second is the least recently used
+        self.assertIsNotNone(cache.get('tests.Circle', '/circles/', 'john'))
+        cache.set('tests.Project', '/projects/', 'john', {'ldp:contains': []})
+
+        self.assertTrue(cache.has('tests.Circle', '/circles/', 'john'))
+        self.assertFalse(cache.has('tests.Circle', '/circles/1/members/'))
+        self.assertTrue(cache.has('tests.Project', '/projects/', 'john'))
+        self.assertEqual(cache.stats()['evictions'], 1)
+        self.assertEqual(cache.stats()['entries'], 2)
+
+    def test_max_bytes_eviction(self):
+        cache = InMemoryCache(max_records=None, max_bytes=100)
+        cache.set('tests.Circle', '/circles/', 'john', {'ldp:contains': ['a' * 40]})
+        cache.set('tests.Circle', '/circles/', 'paul', {'ldp:contains': ['b' * 40]})
+
+        self.assertFalse(cache.has('tests.Circle', '/circles/', 'john'))
+        self.assertTrue(cache.has('tests.Circle', '/circles/', 'paul'))
+        self.assertLessEqual(cache.stats()['bytes'], 100)
+
+    def test_ttl_expiry(self):
+        cache = InMemoryCache(ttl=60)
+        cache.set('tests.Circle', '/circles/', 'john', {'ldp:contains': []})
+        self.assertIsNotNone(cache.get('tests.Circle', '/circles/', 'john'))
+
+        with patch('djangoldp.serializers.cache.time.monotonic', return_value=time.monotonic() + 61):
+            self.assertIsNone(cache.get('tests.Circle', '/circles/', 'john'))
+        self.assertFalse(cache.has('tests.Circle'))
+
+    def test_hit_miss_counters(self):
+        cache = InMemoryCache()
+        self.assertIsNone(cache.get('tests.Circle', '/circles/', 'john'))
+        cache.set('tests.Circle', '/circles/', 'john', {'ldp:contains': []})
+        cache.get('tests.Circle', '/circles/', 'john')
+        cache.invalidate('tests.Circle')
+
+        stats = cache.stats()
+        self.assertEqual(stats['hits'], 1)
+        self.assertEqual(stats['misses'], 1)
+        self.assertEqual(stats['entries'], 0)
+
+
+@override_settings(CACHES={'serializer': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                                          'LOCATION': 'djangoldp-tests-serializer'}})
+class TestDjangoCacheBackend(TestCase):
+
+    def setUp(self):
+        self.cache = DjangoCacheBackend('serializer')
+        self.cache.reset()
+
+    def test_shared_between_instances(self):
+        self.cache.set('tests.Circle', '/circles/', 'john', {'ldp:contains': [{'@id': '/circles/1/'}]})
+
+        # another worker, reading from the same Django cache
+        other_worker = DjangoCacheBackend('serializer')
+        self.assertEqual(other_worker.get('tests.Circle', '/circles/', 'john'),
+                         {'ldp:contains': [{'@id': '/circles/1/'}]})
+        self.assertEqual(other_worker.stats()['hits'], 1)
+
+    def test_invalidate_model_label(self):
+        self.cache.set('tests.Circle', '/circles/', 'john', {'ldp:contains': []})
+        self.cache.set('tests.Project', '/projects/', 'john', {'ldp:contains': []})
+
+        DjangoCacheBackend('serializer').invalidate('tests.Circle')
+
+        self.assertIsNone(self.cache.get('tests.Circle', '/circles/', 'john'))
+        self.assertIsNotNone(self.cache.get('tests.Project', '/projects/', 'john'))
+
+    def test_invalidate_container(self):
+        self.cache.set('tests.Circle', '/circles/', 'john', {'ldp:contains': []})
+        self.cache.set('tests.Circle', '/circles/', 'paul', {'ldp:contains': []})
+        self.cache.set('tests.Circle', '/projects/1/circles/', 'john', {'ldp:contains': []})
+
+        self.cache.invalidate('tests.Circle', '/circles/', 'john')
+        self.assertIsNone(self.cache.get('tests.Circle', '/circles/', 'john'))
+        self.assertIsNotNone(self.cache.get('tests.Circle', '/circles/', 'paul'))
+
+        self.cache.invalidate('tests.Circle', '/circles/')
+        self.assertIsNone(self.cache.get('tests.Circle', '/circles/', 'paul'))
+        self.assertIsNotNone(self.cache.get('tests.Circle', '/projects/1/circles/', 'john'))
+
+    def test_reset(self):
+        self.cache.set('tests.Circle', '/circles/', 'john', {'ldp:contains': []})
+        self.cache.reset()
+        self.assertFalse(self.cache.has('tests.Circle', '/circles/', 'john'))
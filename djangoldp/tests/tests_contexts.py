@@ -0,0 +1,101 @@
+import json
+import os
+import tempfile
+import threading
+from io import BytesIO
+from unittest.mock import MagicMock, patch
+
+from django.conf import settings
+from django.test import TestCase
+from pyld import jsonld
+
+from djangoldp.contexts import GLOBAL_CONTEXT_STORE, ContextStore
+from djangoldp.parsers import JSONLDParser
+
+CONTEXT_URL = 'https://example.org/context.jsonld'
+CONTEXT = {'@context': {'@vocab': 'https://cdn.startinblox.com/owl#', 'ldp': 'http://www.w3.org/ns/ldp#'}}
+
+
+def remote_document(url, document=CONTEXT):
+    return {'contextUrl': None, 'documentUrl': url, 'document': document}
+
+
+class TestContextStore(TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.loader = MagicMock(side_effect=remote_document)
+        patcher = patch('djangoldp.contexts.jsonld.requests_document_loader', return_value=self.loader)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(self.directory.cleanup)
+
+    def test_local_context(self):
+        path = os.path.join(self.directory.name, 'context.jsonld')
+        with open(path, 'w') as f:
+            json.dump(CONTEXT, f)
+        store = ContextStore(local_contexts={CONTEXT_URL: path})
+        self.assertEqual(store.load_document(CONTEXT_URL)['document'], CONTEXT)
+        self.loader.assert_not_called()
+
+    def test_fetch_once(self):
+        store = ContextStore(ttl=60)
+        for _ in range(3):
+            self.assertEqual(store.load_document(CONTEXT_URL)['document'], CONTEXT)
+        self.assertEqual(self.loader.call_count, 1)
+        self.assertEqual(store.stats(), {'hits': 2, 'misses': 1, 'documents': 1})
+
+        # pyld may alter the documents it loads, which must not change the stored ones
+        store.load_document(CONTEXT_URL)['document']['@context']['@vocab'] = 'altered'
+        self.assertEqual(store.load_document(CONTEXT_URL)['document'], CONTEXT)
+
+    def test_stats_concurrent(self):
+        store = ContextStore(ttl=60)
+        store.load_document(CONTEXT_URL)
+
+        def load():
+            for _ in range(200):
+                store.load_document(CONTEXT_URL)
+        threads = [threading.Thread(target=load) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(store.stats(), {'hits': 1600, 'misses': 1, 'documents': 1})
+
+    def test_ttl(self):
+        store = ContextStore(ttl=60)
+        with patch('djangoldp.contexts.time.time', return_value=1000):
+            store.load_document(CONTEXT_URL)
+        with patch('djangoldp.contexts.time.time', return_value=1059):
+            store.load_document(CONTEXT_URL)
+        self.assertEqual(self.loader.call_count, 1)
+        with patch('djangoldp.contexts.time.time', return_value=1060):
+            store.load_document(CONTEXT_URL)
+        self.assertEqual(self.loader.call_count, 2)
+
+    def test_expired_copy_served_on_error(self):
+        store = ContextStore(ttl=0)
+        store.load_document(CONTEXT_URL)
+        self.loader.side_effect = jsonld.JsonLdError('Could not retrieve a JSON-LD document from the URL.',
+                                                     'jsonld.LoadDocumentError')
+        self.assertEqual(store.load_document(CONTEXT_URL)['document'], CONTEXT)
+        with self.assertRaises(jsonld.JsonLdError):
+            store.load_document('https://example.org/other.jsonld')
+
+    def test_persistence(self):
+        ContextStore(ttl=60, directory=self.directory.name).load_document(CONTEXT_URL)
+        store = ContextStore(ttl=60, directory=self.directory.name)
+        self.assertEqual(store.load_document(CONTEXT_URL)['document'], CONTEXT)
+        self.assertEqual(self.loader.call_count, 1)
+
+    def test_parser_offline(self):
+        GLOBAL_CONTEXT_STORE.set(settings.LDP_RDF_CONTEXT, remote_document(settings.LDP_RDF_CONTEXT))
+        self.addCleanup(GLOBAL_CONTEXT_STORE.documents.pop, settings.LDP_RDF_CONTEXT)
+        data = {'@context': CONTEXT_URL, '@id': 'https://example.org/resources/1', 'name': 'offline'}
+        GLOBAL_CONTEXT_STORE.set(CONTEXT_URL, remote_document(CONTEXT_URL))
+        self.addCleanup(GLOBAL_CONTEXT_STORE.documents.pop, CONTEXT_URL)
+
+        parsed = JSONLDParser().parse(BytesIO(json.dumps(data).encode('utf-8')))
+        self.assertEqual(parsed['name'], 'offline')
+        self.assertEqual(parsed['@id'], 'https://example.org/resources/1')
+        self.loader.assert_not_called()
@@ -1,13 +1,19 @@
+import json
 from datetime import datetime
 
+from django.conf import settings
 from django.contrib.auth import get_user_model
+from rdflib import Graph
+from rdflib.compare import isomorphic
 from rest_framework.test import APIClient, APIRequestFactory, APITestCase
 from unittest.mock import patch
 
+from djangoldp.contexts import GLOBAL_CONTEXT_STORE
 from djangoldp.serializers import GLOBAL_SERIALIZER_CACHE
 from djangoldp.tests.models import (Batch, Circle, Conversation, DateModel, Enterprise,
                                     Invoice, JobOffer, Message, Post, Skill,
                                     User, UserProfile)
+from djangoldp.views.ldp_viewset import LDPViewSet
 
 
 class TestGET(APITestCase):
@@ -263,3 +269,49 @@ class TestGET(APITestCase):
         self.assertEqual(serialized_enterprise["dfc-b:name"], enterprise.name)
         self.assertEqual(serialized_enterprise["dfc-b:VATStatus"], enterprise.VATstatus)
         self.assertIsNotNone(serialized_enterprise["dfc-b:affiliatedTo"])
+
+    def disable_pagination(self):
+        patcher = patch.object(LDPViewSet, 'pagination_class', None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_get_streamed_container(self):
+        user = self._set_up_user()
+        for index in range(5):
+            circle = Circle.objects.create(name=f'circle {index}', description='test', owner=user)
+            circle.members.user_set.add(user)
+        self.client.force_authenticate(user)
+        # only the containers which aren't paginated are streamed
+        self.disable_pagination()
+        response = self.client.get('/circles/', content_type='application/ld+json')
+        expected = json.loads(response.content)
+
+        with patch.object(LDPViewSet, 'with_streaming', True), patch.object(LDPViewSet, 'streaming_chunk_size', 2):
+            response = self.client.get('/circles/', content_type='application/ld+json')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'application/ld+json')
+        self.assertIn('ETag', response)
+        data = json.loads(b''.join(response.streaming_content))
+        for container in (data, expected):
+            container['permissions'] = sorted(container['permissions'])
+        self.assertEqual(data, expected)
+
+    def test_get_streamed_container_turtle(self):
+        context = {'@context': {'@vocab': 'https://cdn.startinblox.com/owl#', 'ldp': 'http://www.w3.org/ns/ldp#',
+                                'hd': 'http://happy-dev.fr/owl/#'}}
+        GLOBAL_CONTEXT_STORE.set(settings.LDP_RDF_CONTEXT, {'contextUrl': None, 'documentUrl': settings.LDP_RDF_CONTEXT,
+                                                            'document': context})
+        self.addCleanup(GLOBAL_CONTEXT_STORE.documents.pop, settings.LDP_RDF_CONTEXT)
+        for index in range(3):
+            Post.objects.create(content=f'content {index}')
+        self.disable_pagination()
+        response = self.client.get('/posts/', HTTP_ACCEPT='text/turtle')
+        expected = Graph().parse(data=response.content, format='turtle')
+
+        with patch.object(LDPViewSet, 'with_streaming', True), patch.object(LDPViewSet, 'streaming_chunk_size', 2):
+            response = self.client.get('/posts/', HTTP_ACCEPT='text/turtle')
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'text/turtle; charset=utf-8')
+        graph = Graph().parse(data=b''.join(response.streaming_content), format='turtle')
+        self.assertTrue(isomorphic(graph, expected))
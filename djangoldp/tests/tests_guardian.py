@@ -1,7 +1,10 @@
 import json
 import uuid
+from unittest.mock import patch
 from django.contrib.auth import get_user_model
 from django.contrib.auth.models import Group
+from django.test import override_settings
+from guardian.conf import settings as guardian_settings
 from rest_framework.test import APIClient, APITestCase
 from guardian.shortcuts import assign_perm
 
@@ -165,4 +168,30 @@ class TestsGuardian(APITestCase):
         view_perms = [perm for perm in perms if perm == 'view']
         self.assertEqual(len(view_perms), 1)
 
+    # test that the permissions of the resources of a container are computed for all of them at once
+    @override_settings(LDP_INCLUDE_INNER_PERMS=True)
+    def test_list_inner_permissions(self):
+        self.setUpLoggedInUser()
+        viewable = self._get_dummy_with_perms(['view'])
+        changeable = self._get_dummy_with_perms(['view', 'change'])
+
+        response = self.client.get('/permissionless-dummys/')
+        self.assertEqual(response.status_code, 200)
+        perms = {item['@id']: set(self._unpack_permissions(item['permissions'])) for item in response.data['ldp:contains']}
+        self.assertEqual(perms[viewable.urlid], {'view'})
+        self.assertEqual(perms[changeable.urlid], {'view', 'change'})
+
+    @override_settings(LDP_INCLUDE_INNER_PERMS=True)
+    def test_list_inner_permissions_without_auto_prefetch(self):
+        self.setUpLoggedInUser()
+        viewable = self._get_dummy_with_perms(['view'])
+        changeable = self._get_dummy_with_perms(['view', 'change'], group=True)
+
+        with patch.object(guardian_settings, 'AUTO_PREFETCH', False):
+            response = self.client.get('/permissionless-dummys/')
+        self.assertEqual(response.status_code, 200)
+        perms = {item['@id']: set(self._unpack_permissions(item['permissions'])) for item in response.data['ldp:contains']}
+        self.assertEqual(perms[viewable.urlid], {'view'})
+        self.assertEqual(perms[changeable.urlid], {'view', 'change'})
+
     # TODO: attempting to migrate my object permissions by changing FK reference
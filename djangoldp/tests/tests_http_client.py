@@ -0,0 +1,45 @@
+from unittest.mock import MagicMock, patch
+
+from django.test import SimpleTestCase, override_settings
+from requests.adapters import HTTPAdapter
+
+from djangoldp.activities.services import ActivityQueueService
+from djangoldp.http_client import create_session, get_session, reset_session
+
+
+class TestHttpClient(SimpleTestCase):
+    def setUp(self):
+        self.addCleanup(reset_session)
+
+    def test_pooled_session(self):
+        session = create_session(pool_connections=3, pool_maxsize=7, retries=2)
+        adapter = session.get_adapter('https://example.org/inbox/')
+        self.assertIs(adapter, session.get_adapter('http://example.org/inbox/'))
+        self.assertEqual(adapter.poolmanager.connection_pool_kw['maxsize'], 7)
+        self.assertEqual(adapter.poolmanager.pools._maxsize, 3)
+        self.assertEqual(adapter.max_retries.connect, 2)
+        # a POST already sent isn't retried
+        self.assertEqual(adapter.max_retries.read, 0)
+        self.assertNotIn('POST', adapter.max_retries.allowed_methods)
+
+    @override_settings(DEFAULT_REQUEST_TIMEOUT=3)
+    def test_default_timeout(self):
+        session = create_session()
+        with patch.object(HTTPAdapter, 'send', return_value=MagicMock(status_code=200, is_redirect=False)) as send:
+            session.get('https://example.org/')
+            self.assertEqual(send.call_args.kwargs['timeout'], 3)
+            session.get('https://example.org/', timeout=1)
+            self.assertEqual(send.call_args.kwargs['timeout'], 1)
+
+    def test_shared_session(self):
+        session = get_session()
+        self.assertIs(get_session(), session)
+        reset_session()
+        self.assertIsNot(get_session(), session)
+
+    def test_activities_posted_with_shared_session(self):
+        with patch('djangoldp.activities.services.get_session') as get_shared_session:
+            ActivityQueueService.do_post('https://example.org/inbox/', {'type': 'Create'})
+        post = get_shared_session.return_value.post
+        post.assert_called_once()
+        self.assertEqual(post.call_args.args[0], 'https://example.org/inbox/')
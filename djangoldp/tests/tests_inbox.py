@@ -170,6 +170,58 @@ class TestsInbox(APITestCase):
         self.assertEqual(Follower.objects.count(), 1)
         self._assert_follower_created(self.user.urlid, "https://distant.com/projects/1/")
 
+    @override_settings(SEND_BACKLINKS=True, DISABLE_OUTBOX=True)
+    def test_add_activities_in_ordered_collection(self):
+        activities = [self._get_activity_request_template(
+            "Add", {"@type": "hd:project", "@id": "https://distant.com/projects/{}/".format(i)},
+            self._build_target_from_user(self.user)) for i in range(3)]
+        payload = {
+            "@context": "https://www.w3.org/ns/activitystreams",
+            "type": "OrderedCollection",
+            "totalItems": len(activities),
+            "orderedItems": activities
+        }
+
+        response = self.client.post('/inbox/',
+                                    data=json.dumps(payload), content_type='application/ld+json')
+        self.assertEqual(response.status_code, 201)
+
+        # assert that each activity of the collection was handled and saved
+        self.assertEqual(self.user.projects.count(), 3)
+        self.assertEqual(Activity.objects.count(), 3)
+
+    @override_settings(SEND_BACKLINKS=True, DISABLE_OUTBOX=True)
+    def test_ordered_collection_skips_integrity_error(self):
+        # as when it is sent alone, the activity of a backlink which can't be saved is skipped
+        invalid = self._get_activity_request_template("Create", {
+            "@type": "hd:datechild",
+            "@id": "https://distant.com/datechilds/1/",
+            "parent": {"@type": "hd:date", "@id": "https://distant.com/dates/1/"}
+        })
+        valid = self._get_activity_request_template(
+            "Add", {"@type": "hd:project", "@id": "https://distant.com/projects/1/"},
+            self._build_target_from_user(self.user))
+        payload = {"type": "OrderedCollection", "orderedItems": [invalid, valid]}
+
+        response = self.client.post('/inbox/',
+                                    data=json.dumps(payload), content_type='application/ld+json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(DateChild.objects.count(), 0)
+        self.assertEqual(self.user.projects.count(), 1)
+        self.assertEqual(Activity.objects.count(), 1)
+
+    def test_ordered_collection_refused_entirely(self):
+        valid = self._get_activity_request_template(
+            "Add", {"@type": "hd:project", "@id": "https://distant.com/projects/1/"},
+            self._build_target_from_user(self.user))
+        invalid = self._get_activity_request_template("Add", {"@type": "hd:project"})
+        payload = {"type": "OrderedCollection", "orderedItems": [valid, invalid]}
+
+        response = self.client.post('/inbox/',
+                                    data=json.dumps(payload), content_type='application/ld+json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Project.objects.count(), 0)
+
 #TODO: write a new test for the new circle architecture
     # # circle model has a many-to-many with user, through an intermediate model
     # @override_settings(SEND_BACKLINKS=True, DISABLE_OUTBOX=True)
@@ -1,10 +1,14 @@
 from django.contrib.auth import get_user_model
+from django.db import connection
+from django.db.models import Prefetch
+from django.test.utils import CaptureQueriesContext
 
 from rest_framework import status
 from rest_framework.test import APIRequestFactory, APIClient, APITestCase
 from djangoldp.tests.models import User, Circle, Project
-from djangoldp.serializers import LDPSerializer
-from djangoldp.related import get_prefetch_fields
+from djangoldp.serializers import GLOBAL_SERIALIZER_CACHE, LDPSerializer
+from djangoldp.related import get_prefetch_fields, get_query_plan
+from djangoldp.views.ldp_viewset import LDPViewSet as LDPViewSetClass
 
 
 class LDPViewSet(APITestCase):
@@ -53,6 +57,58 @@ class LDPViewSet(APITestCase):
         result = get_prefetch_fields(model, serializer, depth)
         self.assertEqual(expected_fields, result)
 
+    def test_get_query_plan_circle(self):
+        serializer = self._get_serializer(Circle, 0, ['@id', 'name', 'description', 'owner', 'members'])
+        plan = get_query_plan(Circle, serializer, 0)
+        # the admins and the space of the circle aren't serialized, and aren't joined
+        self.assertEqual(plan.select_related, {'owner', 'members'})
+        self.assertEqual(plan.prefetch_related, [])
+
+    def test_get_query_plan_project(self):
+        serializer = self._get_serializer(Project, 0, self.project_serializer_fields)
+        filtered = []
+
+        def filter_queryset(queryset, model):
+            filtered.append(model)
+            return queryset.filter(is_active=True)
+
+        plan = get_query_plan(Project, serializer, 0, filter_queryset)
+        self.assertEqual(len(plan.prefetch_related), 1)
+        prefetch = plan.prefetch_related[0]
+        self.assertIsInstance(prefetch, Prefetch)
+        self.assertEqual(prefetch.prefetch_through, 'members')
+        # the members are serialized as links, loading only the columns they need, and filtered by permissions
+        loaded_fields, deferred = prefetch.queryset.query.deferred_loading
+        self.assertFalse(deferred)
+        self.assertIn('urlid', loaded_fields)
+        self.assertNotIn('username', loaded_fields)
+        self.assertEqual(filtered, [User])
+        self.assertTrue(plan.is_filtered(Project, 'members'))
+
+    def test_nested_containers_prefetched(self):
+        self.setUpLoggedInUser()
+        users = [get_user_model().objects.create_user(username=f'member{i}', password='pass') for i in range(3)]
+        project = Project.objects.create(description='project')
+        project.members.add(self.user, *users)
+
+        def get_queries():
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get('/projects/')
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            return response, len(queries)
+
+        # the permissions of the user are loaded once
+        get_queries()
+        GLOBAL_SERIALIZER_CACHE.reset()
+        response, queries = get_queries()
+        self.assertEqual(len(response.data['ldp:contains'][0]['members']['ldp:contains']), 4)
+        for i in range(3):
+            Project.objects.create(description=f'project {i}').members.add(*users)
+        GLOBAL_SERIALIZER_CACHE.reset()
+        response, more_queries = get_queries()
+        self.assertEqual(len(response.data['ldp:contains']), 4)
+        self.assertEqual(queries, more_queries)
+
     # TODO: dynamically generating serializer fields is necessary to retrieve many-to-many fields at depth > 0,
     #  but the _all_ default has issues detecting reverse many-to-many fields
     '''def test_get_prefetch_fields_depth_1(self):
@@ -117,3 +173,14 @@ class LDPViewSet(APITestCase):
 
         response = self.client.get('/circles/?search-fields=name&search-terms=test%20circle&search-method=exact')
         self.assertEqual(response.data['ldp:contains'][0]['name'], lowercase_circle.name)
+
+    def test_serializer_class_reused(self):
+        serializer_class = LDPViewSetClass(model=Circle, nested_fields=['members'], depth=0).get_serializer_class()
+        self.assertIs(LDPViewSetClass(model=Circle, nested_fields=['members'], depth=0).get_serializer_class(),
+                      serializer_class)
+        self.assertEqual(serializer_class.Meta.depth, 0)
+
+        other_serializer_class = LDPViewSetClass(model=Circle, nested_fields=['members'], depth=1).get_serializer_class()
+        self.assertIsNot(other_serializer_class, serializer_class)
+        self.assertEqual(other_serializer_class.Meta.depth, 1)
+        self.assertIsNot(LDPViewSetClass(model=Circle, fields=['@id', 'name']).get_serializer_class(), serializer_class)
@@ -4,7 +4,7 @@ from django.test import TestCase, override_settings
 from rest_framework.test import APIRequestFactory
 
 from djangoldp.serializers import LDPSerializer
-from djangoldp.tests.models import (Batch, Conversation, Invoice, JobOffer,
+from djangoldp.tests.models import (Batch, Conversation, Enterprise, Invoice, JobOffer,
                                     Message, ModelTask, Skill)
 
 
@@ -813,3 +813,11 @@ class LDPModelSerializerTestCase(TestCase):
         self.assertIs(result.joboffer_set.count(), 1)
         self.assertEqual(result.joboffer_set.get(), job)
         self.assertIs(result.joboffer_set.get().skills.count(), 1)
+
+    def test_output_plan(self):
+        serializer_class = self._get_serializer_class(Enterprise, 0, ("@id", "name", "VATstatus", "affiliated_to"))
+        renamed_fields, templated_fields = serializer_class().output_plan
+        self.assertEqual(set(renamed_fields), {('name', 'dfc-b:name'), ('VATstatus', 'dfc-b:VATStatus'),
+                                               ('affiliated_to', 'dfc-b:affiliatedTo')})
+        self.assertEqual(set(templated_fields), {'name', 'VATstatus'})
+        self.assertIs(serializer_class().output_plan, serializer_class().output_plan)
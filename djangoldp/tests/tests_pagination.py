@@ -1,6 +1,13 @@
+import re
+from unittest.mock import patch
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from rest_framework.test import APIClient, APIRequestFactory, APITestCase
 
+from djangoldp.pagination import LDPCursorPagination
 from djangoldp.tests.models import Post
+from djangoldp.views.ldp_viewset import LDPViewSet
 
 
 class TestPagination(APITestCase):
@@ -34,3 +41,54 @@ class TestPagination(APITestCase):
         # Check for LDP type links (added in Phase 1)
         self.assertIn('ldp#Resource', response.headers['link'])
         self.assertIn('ldp#Container', response.headers['link'])
+
+
+class TestCursorPagination(APITestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.posts = [Post.objects.create(content="content {}".format(i)) for i in range(0, 12)]
+        patcher = patch.object(LDPViewSet, 'pagination_class', LDPCursorPagination)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def get_links(self, response):
+        return {rel: url for url, rel in re.findall(r'<([^>]+)>; rel="(\w+)"', response.headers['link'])}
+
+    def get_page(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, content_type='application/ld+json')
+        self.assertEqual(response.status_code, 200)
+        # the pages are selected on the primary key, without an OFFSET
+        self.assertFalse([query for query in queries.captured_queries if 'OFFSET' in query['sql']])
+        return response
+
+    def test_walk_pages(self):
+        response = self.get_page('/posts/')
+        links = self.get_links(response)
+        self.assertEqual(links['first'], 'http://testserver/posts/')
+        self.assertNotIn('prev', links)
+        self.assertIn('ldp#Page', response.headers['link'])
+        self.assertIn('ldp#Container', response.headers['link'])
+
+        ids, etags = [], set()
+        while True:
+            ids += [post['@id'] for post in response.data['ldp:contains']]
+            etags.add(response['ETag'])
+            if 'next' not in links:
+                break
+            response = self.get_page(links['next'])
+            links = self.get_links(response)
+            self.assertIn('prev', links)
+        self.assertEqual(ids, [post.urlid for post in self.posts])
+        # each page has its own ETag
+        self.assertEqual(len(etags), 3)
+
+        response = self.get_page(links['prev'])
+        self.assertEqual([post['@id'] for post in response.data['ldp:contains']],
+                         [post.urlid for post in self.posts[5:10]])
+
+    def test_page_size(self):
+        response = self.get_page('/posts/?limit=10')
+        self.assertEqual(len(response.data['ldp:contains']), 10)
+        self.assertIn('limit=10', self.get_links(response)['next'])
@@ -0,0 +1,51 @@
+import json
+import time
+from io import BytesIO
+from statistics import mean
+from unittest.mock import patch
+
+from django.conf import settings
+from django.test import TestCase
+
+from djangoldp.contexts import GLOBAL_CONTEXT_STORE
+from djangoldp.parsers import JSONLDParser
+
+
+class TestPerformanceParser(TestCase):
+    '''compares the parsing of compact payloads with and without the compaction fast path'''
+    test_volume = 500
+    context = {'@context': {'@vocab': 'https://cdn.startinblox.com/owl#', 'ldp': 'http://www.w3.org/ns/ldp#',
+                            'foaf': 'http://xmlns.com/foaf/0.1/', 'author': {'@type': '@id'},
+                            'members': {'@type': '@id'}}}
+
+    def setUp(self):
+        # serve the context without fetching it, to only measure the parsing
+        GLOBAL_CONTEXT_STORE.set(settings.LDP_RDF_CONTEXT, {'contextUrl': None, 'documentUrl': settings.LDP_RDF_CONTEXT,
+                                                            'document': self.context})
+        self.addCleanup(GLOBAL_CONTEXT_STORE.documents.pop, settings.LDP_RDF_CONTEXT)
+        self.payloads = [json.dumps({
+            '@context': settings.LDP_RDF_CONTEXT,
+            '@id': f'http://happy-dev.fr/circles/{i}/',
+            'name': f'circle {i}',
+            'description': 'a circle',
+            'author': 'http://happy-dev.fr/users/1/',
+            'members': {'@id': f'http://happy-dev.fr/circles/{i}/members/',
+                        'ldp:contains': [{'@id': f'http://happy-dev.fr/users/{j}/'} for j in range(10)]}
+        }).encode('utf-8') for i in range(self.test_volume)]
+
+    def time_parse(self):
+        parser = JSONLDParser()
+        times = []
+        for payload in self.payloads:
+            start_time = time.time()
+            parser.parse(BytesIO(payload))
+            times.append(time.time() - start_time)
+        return mean(times)
+
+    def test_parse_compact_payloads(self):
+        with patch.object(JSONLDParser, 'fast_path', False):
+            compaction_time = self.time_parse()
+        fast_path_time = self.time_parse()
+        print(f'parsed {self.test_volume} compact payloads in {compaction_time:.6f}s each with compaction, '
+              f'{fast_path_time:.6f}s each with the fast path')
+        self.assertLess(fast_path_time, compaction_time)
@@ -1,10 +1,18 @@
 import json
+from unittest.mock import patch
 from django.contrib.auth import get_user_model
-from django.contrib.auth.models import Permission
+from django.contrib.auth.models import AnonymousUser, Group, Permission
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
 from guardian.models import GroupObjectPermission
 from rest_framework.test import APIRequestFactory, APIClient, APITestCase
+from djangoldp.permissions import OwnerPermissions, PermissionMemo, get_batch_permissions
+from djangoldp.serializers import ContainerSerializer
 from djangoldp.tests.models import AnonymousReadOnlyPost, AuthenticatedOnlyPost, ReadOnlyPost, DoubleInheritModel, \
-    ReadAndCreatePost, OwnedResource, RestrictedCircle, RestrictedResource, ANDPermissionsDummy, ORPermissionsDummy
+    ReadAndCreatePost, OwnedResource, RestrictedCircle, RestrictedResource, ANDPermissionsDummy, ORPermissionsDummy, \
+    Circle
+from djangoldp.views.ldp_viewset import LDPViewSet
 
 class TestPermissions(APITestCase):
     def setUp(self):
@@ -102,6 +110,106 @@ class TestPermissions(APITestCase):
         self.check_can_view_one(noones.urlid, 404)
         self.check_can_change(noones.urlid, 404)
 
+    @override_settings(LDP_INCLUDE_INNER_PERMS=True)
+    def test_owner_permissions_container(self):
+        self.authenticate()
+        them = get_user_model().objects.create_user(username='them', email='them@user.com', password='itstheirsecret')
+        mine = [OwnedResource.objects.create(description="Mine!", user=self.user) for i in range(3)]
+        OwnedResource.objects.create(description="Theirs", user=them)
+
+        # the ownership of the resources of the container is checked for all of them at once
+        with patch.object(OwnerPermissions, 'check_permission') as check_permission:
+            response = self.client.get('/ownedresources/', content_type='application/ld+json')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn(OwnedResource, [call.args[1] for call in check_permission.call_args_list])
+        self.assertEqual([resource['@id'] for resource in response.data['ldp:contains']], [obj.urlid for obj in mine])
+        for resource in response.data['ldp:contains']:
+            self.assertIn('change', resource['permissions'])
+
+    def test_permission_memo(self):
+        memo = PermissionMemo()
+        self.assertEqual(memo.get('key', lambda: {'view'}), {'view'})
+        self.assertEqual(memo.get('key', lambda: {'change'}), {'view'})
+        self.assertEqual(memo.stats(), {'hits': 1, 'misses': 1, 'entries': 1})
+        memo.clear()
+        self.assertEqual(memo.get('key', lambda: {'change'}), {'change'})
+
+    def test_owner_permissions_memoized_in_request(self):
+        self.authenticate()
+        mine = OwnedResource.objects.create(description="Mine!", user=self.user)
+
+        # the ownership checked by the object permissions is reused to serialize the permissions
+        with patch.object(OwnerPermissions, 'check_ownership', autospec=True,
+                          side_effect=OwnerPermissions.check_ownership) as check_ownership:
+            response = self.client.get(mine.urlid, content_type='application/ld+json')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('change', response.data['permissions'])
+        self.assertEqual([call.args[2] for call in check_ownership.call_args_list].count(OwnedResource), 1)
+        # the memo doesn't outlive the request
+        self.assertIsNone(getattr(self.user, 'permission_memo', None))
+
+    def test_batch_permissions(self):
+        mine, theirs, noones = self.create_circles()
+        ro_resource = ReadOnlyPost.objects.create(content="read only")
+        OwnedResource.objects.create(description="Mine!", user=self.user)
+        OwnedResource.objects.create(description="I belong to NO ONE!")
+        DoubleInheritModel.objects.create(content="mine", circle=mine, ro_ancestor=None)
+        DoubleInheritModel.objects.create(content="some", circle=theirs, ro_ancestor=ro_resource)
+        DoubleInheritModel.objects.create(content="other", circle=noones, ro_ancestor=None)
+        ORPermissionsDummy.objects.create(title='ABC')
+        ORPermissionsDummy.objects.create(title='plop')
+
+        # the permissions computed for all objects at once are the ones computed object by object
+        for user in (self.user, AnonymousUser()):
+            for model in (OwnedResource, DoubleInheritModel, ORPermissionsDummy, RestrictedCircle):
+                objs = list(model.objects.all())
+                permission_classes = model._meta.permission_classes
+                expected = {obj.pk: set.intersection(*[perm().get_permissions(user, model, obj) for perm in permission_classes])
+                            for obj in objs}
+                self.assertEqual(get_batch_permissions(permission_classes, user, model, objs), expected)
+
+    def get_container_ids(self, client, url):
+        response = client.get(url, content_type='application/ld+json')
+        self.assertEqual(response.status_code, 200, url)
+        return [resource['@id'] for resource in response.data['ldp:contains']]
+
+    def test_compiled_filters(self):
+        mine, theirs, noones = self.create_circles()
+        ro_resource = ReadOnlyPost.objects.create(content="read only")
+        OwnedResource.objects.create(description="Mine!", user=self.user)
+        OwnedResource.objects.create(description="I belong to NO ONE!")
+        for circle in (mine, theirs, noones):
+            RestrictedResource.objects.create(content=circle.name, circle=circle)
+        DoubleInheritModel.objects.create(content="mine", circle=mine, ro_ancestor=None)
+        DoubleInheritModel.objects.create(content="some", circle=theirs, ro_ancestor=ro_resource)
+        DoubleInheritModel.objects.create(content="other", circle=noones, ro_ancestor=None)
+        DoubleInheritModel.objects.create(content="orphan")
+        Circle.objects.create(name="owned", owner=self.user)
+        Circle.objects.create(name="other")
+        ORPermissionsDummy.objects.create(title='ABC')
+        ORPermissionsDummy.objects.create(title='plop')
+        Group.objects.create(name='orphans')
+
+        urls = ['/restrictedresources/', '/doubleinheritmodels/', '/circles/', '/orpermissionsdummys/', '/groups/',
+                '/users/']
+        # the owned resources and the restricted circles are only listed to the user
+        for client, client_urls in ((self.client, ['/ownedresources/', '/restrictedcircles/'] + urls),
+                                    (APIClient(), urls)):
+            for url in client_urls:
+                expected = self.get_container_ids(client, url)
+                with patch.object(LDPViewSet, 'with_compiled_filters', True), \
+                        patch.object(ContainerSerializer, 'with_compiled_filters', True), \
+                        patch.object(ContainerSerializer, 'with_cache', False):
+                    self.assertEqual(self.get_container_ids(client, url), expected, url)
+
+        # the objects are listed in a single query, without DISTINCT
+        with patch.object(LDPViewSet, 'with_compiled_filters', True), \
+                CaptureQueriesContext(connection) as context:
+            self.assertEqual(len(self.get_container_ids(self.client, '/doubleinheritmodels/')), 3)
+        queries = [query['sql'] for query in context.captured_queries
+                   if query['sql'].startswith('SELECT "tests_doubleinheritmodel"."id"')]
+        self.assertEqual(len(queries), 1)
+        self.assertNotIn('DISTINCT', queries[0])
 
     def check_permissions(self, obj, group, required_perms):
         perms = GroupObjectPermission.objects.filter(group=group)
@@ -24,3 +24,8 @@ def check_client_ip(request):
     elif request.META.get('REMOTE_ADDR') in PASSTHROUGH_IPS:
         return True
     return False
+
+
+# convenience function returns a hashable version of a list of field names, to use it in a cache key
+def freeze(value):
+    return tuple(value) if isinstance(value, (list, tuple, set)) else value
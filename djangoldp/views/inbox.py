@@ -18,6 +18,7 @@ from djangoldp.activities import (
     ACTIVITY_SAVING_SETTING,
     ActivityPubService,
     ActivityQueueService,
+    OrderedCollection,
     as_activitystream,
 )
 from djangoldp.activities.errors import (
@@ -41,6 +42,8 @@ class InboxView(APIView):
         '''
         try:
             activity = json.loads(request.body, object_hook=as_activitystream)
+            if isinstance(activity, OrderedCollection):
+                return self.post_collection(request, activity, **kwargs)
             activity.validate()
         except ActivityStreamDecodeError:
             return Response('Activity type unsupported', status=status.HTTP_405_METHOD_NOT_ALLOWED)
@@ -68,6 +71,40 @@ class InboxView(APIView):
 
         return response
 
+    def post_collection(self, request, collection, **kwargs):
+        '''
+        receiver for the activities batched by the ActivityQueueService of a sender in an OrderedCollection, handled in
+        order and all at once, with the outcome each of them would have alone: an activity which can't be saved because
+        of an IntegrityError is skipped, and a batch with an invalid activity is refused, for its activities to be sent
+        again one by one
+        '''
+        activities = collection.orderedItems
+        for activity in activities:
+            if not callable(getattr(activity, 'validate', None)):
+                raise ActivityStreamValidationError('Invalid collection, its items must be activities')
+            activity.validate()
+
+        handled = []
+        try:
+            with transaction.atomic():
+                for activity in activities:
+                    try:
+                        with transaction.atomic():
+                            self._handle_activity(activity, **kwargs)
+                        handled.append(activity)
+                    except IntegrityError:
+                        continue
+        except ValueError as e:
+            return Response(str(e), status=status.HTTP_400_BAD_REQUEST)
+
+        if ACTIVITY_SAVING_SETTING == 'VERBOSE':
+            for activity in handled:
+                ActivityQueueService._save_sent_activity(activity.to_json(), local_id=request.path_info, success=True,
+                                                         type=activity.type)
+            return Response({}, status=status.HTTP_201_CREATED)
+
+        return Response({}, status=status.HTTP_200_OK)
+
     def _handle_activity(self, activity, **kwargs):
         if activity.type == 'Add':
             self.handle_add_activity(activity, **kwargs)
@@ -1,25 +1,33 @@
 # Django imports
 from django.apps import apps
+from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.core.exceptions import FieldDoesNotExist
+from django.db.models import QuerySet, prefetch_related_objects
+from django.http import StreamingHttpResponse
 from django.shortcuts import get_object_or_404
 from django.urls import include, path, re_path
 from django.urls.resolvers import get_resolver
 from django.utils.decorators import classonlymethod
-from django.utils.http import parse_etags, http_date, parse_http_date
+from django.utils.http import http_date, parse_http_date
 
 # DjangoLDP imports
-from djangoldp.etag import generate_etag, generate_container_etag, normalize_etag
+from djangoldp.etag import generate_etag, generate_container_etag, generate_content_etag, generate_journal_etag, \
+    get_container_stats, has_updated_at, match_etags
 from djangoldp.filters import LocalObjectOnContainerPathBackend, SearchByQueryParamFilterBackend
+from djangoldp.journal import GLOBAL_CHANGE_JOURNAL, get_journal_models
 from djangoldp.models import DynamicNestedField, LDPSource
 from djangoldp.parsers import JSONLDParser, TurtleParser
-from djangoldp.related import get_prefetch_fields
+from djangoldp.permissions import attach_permission_memo, detach_permission_memo, get_permission_memo, \
+    get_permissions_filter_q
+from djangoldp.related import get_query_plan
 from djangoldp.renderers import JSONLDRenderer, TurtleRenderer
-from djangoldp.utils import is_authenticated_user
+from djangoldp.utils import freeze, is_authenticated_user
 from djangoldp.views.commons import NoCSRFAuthentication
 
 # DRF imports
 from rest_framework import status
+from rest_framework.pagination import CursorPagination
 from rest_framework.response import Response
 from rest_framework.viewsets import ModelViewSet
 
@@ -29,6 +37,10 @@ import re
 logger = logging.getLogger('djangoldp')
 get_user_model()._meta.rdf_context = {"get_full_name": "rdfs:label"}
 
+# the serializer classes generated by the viewsets, and the lookup fields of the models in the url configurations
+_serializer_classes = {}
+_lookup_fields = {}
+
 
 class LDPViewSetGenerator(ModelViewSet):
     """An extension of ModelViewSet that generates automatically URLs for the model"""
@@ -132,7 +144,19 @@ class LDPViewSet(LDPViewSetGenerator):
     parser_classes = (JSONLDParser, TurtleParser)
     authentication_classes = (NoCSRFAuthentication,)
     filter_backends = [SearchByQueryParamFilterBackend, LocalObjectOnContainerPathBackend]
+    # the lookups to prefetch, which replace the query plan when set
     prefetch_fields = None
+    query_plan = None
+    with_compiled_filters = getattr(settings, 'COMPILED_PERMISSION_FILTERS', False)
+    with_streaming = getattr(settings, 'LDP_STREAMING_CONTAINERS', False)
+    streaming_chunk_size = getattr(settings, 'LDP_STREAMING_CHUNK_SIZE', 1000)
+    container_count_limit = getattr(settings, 'LDP_CONTAINER_COUNT_LIMIT', None)
+    # the number of objects of the container, counted once for its ETag and its paginator
+    container_count = None
+    # False while the object of a conditional GET is fetched, for its relations to be prefetched only if it changed
+    with_prefetch = True
+    # the representation of the resource serialized for its ETag, for retrieve() to render it
+    resource_data = None
     metadata_class = None  # Disable DRF metadata to use custom OPTIONS handler
 
     # Fix Issues #3, #5: Define CORS expose headers once at class level
@@ -154,6 +178,11 @@ class LDPViewSet(LDPViewSetGenerator):
             return queryset
         return super().filter_queryset(queryset)
 
+    def perform_authentication(self, request):
+        super().perform_authentication(request)
+        # the permissions evaluated during the request are memoized, once the user is known
+        attach_permission_memo(request)
+
     def check_permissions(self, request):
         if request.user.is_superuser:
             return True
@@ -174,16 +203,37 @@ class LDPViewSet(LDPViewSetGenerator):
             return self.depth
         return getattr(self.model._meta, 'depth', 0)
 
-    def get_serializer_class(self):
+    def get_lookup_field(self):
+        '''returns the lookup field of the detail route of the model, resolved once per url configuration'''
+        resolver = get_resolver()
         model_name = self.model._meta.object_name.lower()
-        try:
-            lookup_field = get_resolver().reverse_dict[model_name + '-detail'][0][0][1][0]
-        except:
-            lookup_field = 'urlid'
-        
+        if (resolver, model_name) not in _lookup_fields:
+            try:
+                _lookup_fields[(resolver, model_name)] = resolver.reverse_dict[model_name + '-detail'][0][0][1][0]
+            except:
+                _lookup_fields[(resolver, model_name)] = 'urlid'
+        return _lookup_fields[(resolver, model_name)]
+
+    def get_serializer_class(self):
+        '''returns the serializer class of the view, generated once for each model, depth, fields and serializer class'''
+        from djangoldp.serializers import LDPSerializer
+        if self.serializer_class is None:
+            self.serializer_class = LDPSerializer
+
+        lookup_field = self.get_lookup_field()
+        depth = self.get_depth()
+        key = (self.model, depth, lookup_field, freeze(self.fields), freeze(self.exclude),
+               freeze(getattr(self.model._meta, 'serializer_fields_exclude', ())), freeze(self.nested_fields),
+               self.serializer_class)
+        if key not in _serializer_classes:
+            _serializer_classes[key] = self.build_serializer_class(lookup_field, depth)
+        return _serializer_classes[key]
+
+    def build_serializer_class(self, lookup_field, depth):
+        '''generates a subclass of the serializer class, with a Meta describing the fields of the view'''
         meta_args = {'model': self.model, 'extra_kwargs': {
                 '@id': {'lookup_field': lookup_field}},
-                'depth': self.get_depth(),
+                'depth': depth,
                 'extra_fields': self.nested_fields}
 
         if self.fields:
@@ -191,11 +241,6 @@ class LDPViewSet(LDPViewSetGenerator):
         else:
             meta_args['exclude'] = self.exclude or getattr(self.model._meta, 'serializer_fields_exclude', ())
         # create the Meta class to associate to LDPSerializer, using meta_args param
-
-        from djangoldp.serializers import LDPSerializer
-        if self.serializer_class is None:
-            self.serializer_class = LDPSerializer
-
         parent_meta = (self.serializer_class.Meta,) if hasattr(self.serializer_class, 'Meta') else ()
         meta_class = type('Meta', parent_meta, meta_args)
 
@@ -205,6 +250,14 @@ class LDPViewSet(LDPViewSetGenerator):
 
     # The chaining of filter through | may lead to duplicates and distinct should only be applied in the end.
     def filter_queryset(self, queryset):
+        if self.with_compiled_filters:
+            permissions_q = get_permissions_filter_q(self.permission_classes, self.request, self.model)
+            if permissions_q is not None:
+                for backend in type(self).filter_backends:
+                    queryset = backend().filter_queryset(self.request, queryset, self)
+                queryset = queryset.filter(permissions_q)
+                # the compiled filters don't duplicate objects, unlike searches on multi-valued relations
+                return queryset.distinct() if 'search-fields' in self.request.GET else queryset
         return super().filter_queryset(queryset).distinct()
 
     def create(self, request, *args, **kwargs):
@@ -221,6 +274,7 @@ class LDPViewSet(LDPViewSetGenerator):
             pass
 
         self.perform_create(serializer)
+        self.clear_permission_memo()
         response_serializer = self.get_serializer()
         data = response_serializer.to_representation(serializer.instance)
         headers = self.get_success_headers(data)
@@ -276,6 +330,7 @@ class LDPViewSet(LDPViewSetGenerator):
         self.force_depth = None
         serializer.is_valid(raise_exception=True)
         self.perform_update(serializer)
+        self.clear_permission_memo()
 
         if getattr(instance, '_prefetched_objects_cache', None):
             # If 'prefetch_related' has been applied to a queryset, we need to
@@ -316,6 +371,12 @@ class LDPViewSet(LDPViewSetGenerator):
 
         return response
 
+    def clear_permission_memo(self):
+        '''forgets the permissions memoized before the request changed the objects'''
+        memo = get_permission_memo(self.request)
+        if memo is not None:
+            memo.clear()
+
     def perform_create(self, serializer, **kwargs):
         if hasattr(self.model._meta, 'auto_author') and isinstance(self.request.user, get_user_model()):
             kwargs[self.model._meta.auto_author] = get_user_model().objects.get(pk=self.request.user.pk)
@@ -326,9 +387,61 @@ class LDPViewSet(LDPViewSetGenerator):
             queryset = self.model.objects.all()
         else:
             queryset = super(LDPViewSet, self).get_queryset(*args, **kwargs)
-        if self.prefetch_fields is None:
-            self.prefetch_fields = get_prefetch_fields(self.model, self.get_serializer(), self.get_depth())
-        return queryset.prefetch_related(*self.prefetch_fields)
+        if self.prefetch_fields is None and self.query_plan is None:
+            self.query_plan = get_query_plan(self.model, self.get_serializer(), self.get_depth(),
+                                             self.get_serializer(many=True).filter_queryset)
+        if not self.with_prefetch:
+            return queryset
+        if self.prefetch_fields is not None:
+            return queryset.prefetch_related(*self.prefetch_fields)
+        return self.query_plan.apply(queryset)
+
+    def get_prefetch_lookups(self):
+        '''returns the lookups of the relations loaded with the objects, to load them on objects already fetched'''
+        if self.prefetch_fields is not None:
+            return list(self.prefetch_fields)
+        return self.query_plan.get_lookups() if self.query_plan is not None else []
+
+    def get_resource_etag(self, instance):
+        '''
+        returns the ETag of the resource, from its modification time if it has one, without serializing it.
+        Otherwise its representation is serialized, once, and kept for retrieve() to render it
+        '''
+        if getattr(instance, 'updated_at', None):
+            return generate_etag(instance)
+        if self.resource_data is None:
+            self.resource_data = self.get_serializer(instance).data
+        return generate_etag(instance, self.resource_data)
+
+    def get_container_etag(self, queryset, stats):
+        '''returns the ETag of the container, or of its requested page, before its objects are fetched'''
+        paginator = self.paginator
+        page_key = paginator.get_page_key(self.request) if hasattr(paginator, 'get_page_key') else None
+        if isinstance(paginator, CursorPagination):
+            return generate_container_etag(queryset, stats['count'], cursor=page_key,
+                                           latest_updated=stats['latest_updated'])
+        return generate_container_etag(queryset, stats['count'], page_key, latest_updated=stats['latest_updated'])
+
+    def get_journal_labels(self):
+        '''returns the labels of the models whose versions in the change journal make the ETag of the container'''
+        return get_journal_models(self.model, self.get_depth())
+
+    def get_journal_etag(self, request):
+        '''
+        returns the ETag of the container from the change journal, without querying the container, or None if the
+        journal is disabled. Besides the versions of its models, the container depends on its URL (with its filters and
+        page), on the user, for the permissions, on the depth and on the media type
+        '''
+        if not GLOBAL_CHANGE_JOURNAL.enabled or self.model is None:
+            return None
+        versions = GLOBAL_CHANGE_JOURNAL.get_versions(self.get_journal_labels())
+        return generate_journal_etag(versions, request.get_full_path(), request.user.pk, self.get_depth(),
+                                     request.accepted_media_type)
+
+    def is_conditional_get(self, request):
+        '''returns True if the request is a GET or HEAD which may be answered with a 304 Not Modified'''
+        return request.method in ['GET', 'HEAD'] and ('HTTP_IF_NONE_MATCH' in request.META
+                                                      or 'HTTP_IF_MODIFIED_SINCE' in request.META)
 
     def check_preconditions(self, request, instance=None):
         """
@@ -344,30 +457,11 @@ class LDPViewSet(LDPViewSetGenerator):
         if_match = request.META.get('HTTP_IF_MATCH')
         if if_match and instance:
             try:
-                # Serialize the instance to get consistent ETag (same as retrieve())
-                serializer = self.get_serializer(instance)
-                data = serializer.data
-                current_etag = generate_etag(instance, data)
-                # normalize_etag returns (is_weak, etag_value)
-                _, current_etag_value = normalize_etag(current_etag)
-
-                # Parse If-Match ETags
-                match_etags = parse_etags(if_match)
+                # Same ETag as retrieve(), from the metadata of the instance when it has a modification time
+                current_etag = self.get_resource_etag(instance)
 
                 # For If-Match, use weak comparison (ignore weak/strong distinction)
-                # Only the values need to match
-                match_found = False
-                if '*' in match_etags:
-                    match_found = True
-                else:
-                    for etag in match_etags:
-                        _, etag_value = normalize_etag(etag)
-                        # Weak comparison: just compare values, ignore weak/strong status
-                        if etag_value == current_etag_value:
-                            match_found = True
-                            break
-
-                if not match_found:
+                if not match_etags(if_match, current_etag):
                     return Response(
                         {'detail': 'Precondition failed: ETag does not match'},
                         status=status.HTTP_412_PRECONDITION_FAILED
@@ -384,31 +478,13 @@ class LDPViewSet(LDPViewSetGenerator):
         if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
         if if_none_match and instance:
             try:
-                # Serialize the instance to get consistent ETag (same as retrieve())
-                serializer = self.get_serializer(instance)
-                data = serializer.data
-                current_etag = generate_etag(instance, data)
-                _, current_etag_value = normalize_etag(current_etag)
-
-                # Parse If-None-Match ETags
-                none_match_etags = parse_etags(if_none_match)
+                current_etag = self.get_resource_etag(instance)
 
                 # Check if current ETag matches any of the provided ETags (weak comparison)
-                etag_matches = False
-                if '*' in none_match_etags:
-                    etag_matches = True
-                else:
-                    for etag in none_match_etags:
-                        _, etag_value = normalize_etag(etag)
-                        # Weak comparison: just compare values
-                        if etag_value == current_etag_value:
-                            etag_matches = True
-                            break
-
-                if etag_matches:
+                if match_etags(if_none_match, current_etag):
                     # For GET/HEAD: return 304 Not Modified
                     if request.method in ['GET', 'HEAD']:
-                        return Response(status=status.HTTP_304_NOT_MODIFIED)
+                        return Response(status=status.HTTP_304_NOT_MODIFIED, headers={'ETag': current_etag})
                     # For PUT/POST/PATCH: return 412 Precondition Failed
                     elif request.method in ['PUT', 'POST', 'PATCH']:
                         return Response(
@@ -432,7 +508,8 @@ class LDPViewSet(LDPViewSetGenerator):
                     # Compare at second precision (HTTP dates don't include microseconds)
                     resource_timestamp = int(instance.updated_at.timestamp())
                     if resource_timestamp <= modified_since:
-                        return Response(status=status.HTTP_304_NOT_MODIFIED)
+                        return Response(status=status.HTTP_304_NOT_MODIFIED,
+                                        headers={'ETag': generate_etag(instance)})
                 except (ValueError, TypeError) as e:
                     # Log malformed date but continue (don't return 400)
                     logger.warning(f"Malformed If-Modified-Since header: {if_modified_since}, error: {e}")
@@ -442,17 +519,28 @@ class LDPViewSet(LDPViewSetGenerator):
     def retrieve(self, request, *args, **kwargs):
         """
         Retrieve a single resource with ETag and conditional request support.
+        The ETag of a resource with a modification time is checked before its relations are fetched and it is
+        serialized, so that a 304 Not Modified only costs the query of the resource and its permissions.
         """
-        instance = self.get_object()
+        deferred_prefetch = self.is_conditional_get(request) and has_updated_at(self.model)
+        self.with_prefetch = not deferred_prefetch
+        try:
+            instance = self.get_object()
+        finally:
+            self.with_prefetch = True
 
         # Check conditional headers
         precondition_response = self.check_preconditions(request, instance)
         if precondition_response:
             return precondition_response
 
-        serializer = self.get_serializer(instance)
-        data = serializer.data
-        etag = generate_etag(instance, data)
+        if deferred_prefetch:
+            prefetch_related_objects([instance], *self.get_prefetch_lookups())
+
+        etag = self.get_resource_etag(instance)
+        data = self.resource_data
+        if data is None:
+            data = self.get_serializer(instance).data
 
         response = Response(data)
         response['ETag'] = etag
@@ -467,41 +555,72 @@ class LDPViewSet(LDPViewSetGenerator):
         """
         List resources in a container with container ETag support.
         """
+        # With the change journal, the ETag is known without querying the container
+        if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+        etag = self.get_journal_etag(request)
+        if etag is not None and if_none_match and match_etags(if_none_match, etag):
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
+
         queryset = self.filter_queryset(self.get_queryset())
 
-        # Get total count for ETag generation
-        count = queryset.count()
+        # Count the objects and get their latest modification time at once, for the ETag and the paginator
+        stats = get_container_stats(queryset, self.container_count_limit)
+        self.container_count = stats['count'] if stats['exact'] else None
+
+        # Otherwise generate the container ETag (with the requested page) and check If-None-Match before fetching the
+        # objects. If-Modified-Since isn't used: the removal of an object doesn't change the latest modification time.
+        # Without updated_at, a change of an object changes neither, and the ETag is computed from the serialized page
+        if etag is None and has_updated_at(queryset.model):
+            etag = self.get_container_etag(queryset, stats)
+            if if_none_match and match_etags(if_none_match, etag):
+                return Response(status=status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
 
         # Handle pagination
         page = self.paginate_queryset(queryset)
         if page is not None:
             serializer = self.get_serializer(page, many=True)
             response = self.get_paginated_response(serializer.data)
-
-            # Extract page number from request for paginated ETag
-            page_number = None
-            try:
-                # Try to get page number from paginator
-                if hasattr(self, 'paginator') and hasattr(self.paginator, 'page'):
-                    page_number = self.paginator.page.number
-                # Fallback to query param
-                elif 'page' in request.query_params:
-                    page_number = int(request.query_params['page'])
-            except (AttributeError, ValueError, TypeError):
-                pass
-
-            # Generate container ETag with page number
-            etag = generate_container_etag(queryset, count, page_number)
+        elif self.is_streamed(queryset):
+            response = self.get_streaming_response(queryset)
         else:
             serializer = self.get_serializer(queryset, many=True)
             response = Response(serializer.data)
-            # Generate container ETag without pagination
-            etag = generate_container_etag(queryset, count)
 
-        response['ETag'] = etag
+        if etag is None and isinstance(response, Response):
+            etag = generate_content_etag(response.data, request.accepted_media_type)
+            if if_none_match and match_etags(if_none_match, etag):
+                return Response(status=status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
+        if etag is not None:
+            response['ETag'] = etag
 
         return response
 
+    def is_streamed(self, queryset):
+        '''returns True if the container is streamed, its members being serialized and rendered by chunks'''
+        return (self.with_streaming and isinstance(queryset, QuerySet)
+                and hasattr(self.request.accepted_renderer, 'render_stream'))
+
+    def get_streaming_response(self, queryset):
+        '''returns a response streaming the container, without holding all of its members in memory'''
+        container, members = self.get_serializer(many=True).to_stream(queryset, self.streaming_chunk_size)
+        renderer = self.request.accepted_renderer
+        request = self.request
+        memo = get_permission_memo(request)
+
+        def stream():
+            # the memo is detached at the end of the dispatch, before the members are serialized
+            attach_permission_memo(request, memo)
+            try:
+                yield from renderer.render_stream(container, members, request.accepted_media_type,
+                                                  self.get_renderer_context())
+            finally:
+                detach_permission_memo(request)
+
+        content_type = renderer.media_type
+        if renderer.charset:
+            content_type = f'{content_type}; charset={renderer.charset}'
+        return StreamingHttpResponse(stream(), content_type=content_type)
+
     def options(self, request, *args, **kwargs):
         """
         Handle OPTIONS requests with proper LDP headers.
@@ -570,6 +689,10 @@ class LDPViewSet(LDPViewSetGenerator):
 
         response = super(LDPViewSet, self).dispatch(request, *args, **kwargs)
 
+        memo = detach_permission_memo(self.request)
+        if memo is not None:
+            logger.debug(f"PERMISSIONS: {memo.hits} evaluations saved by the request memo, {memo.misses} computed")
+
         # Update Accept-Post to include text/turtle (for non-OPTIONS requests)
         response["Accept-Post"] = "application/ld+json, text/turtle"
 
@@ -637,6 +760,9 @@ class LDPNestedViewSet(LDPViewSet):
     def get_parent(self):
         return get_object_or_404(self.parent_model, **{self.parent_lookup_field: self.kwargs[self.parent_lookup_field]})
 
+    def get_journal_labels(self):
+        return tuple(sorted({*super().get_journal_labels(), self.parent_model._meta.label}))
+
     def perform_create(self, serializer, **kwargs):
         kwargs[self.field_name_to_parent] = self.get_parent()
         super().perform_create(serializer, **kwargs)